@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Counter columns of the post_stats table
+KINDS = ('views', 'clicks', 'searches')
+
+
+class Analytics:
+    """Per-post view, click and search counters, written behind in batches.
+
+    `record` only bumps an in-memory counter, so the request path does no
+    database write; every `flush_interval` seconds the accumulated counts
+    are added to the post_stats aggregates in one transaction. A crash
+    loses at most one interval of counts.
+    """
+
+    def __init__(self, db, flush_interval=10):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._counts = defaultdict(lambda: [0] * len(KINDS))
+        self._task = None
+
+    def record(self, post_id, kind, amount=1):
+        try:
+            post_id = int(post_id)
+        except (TypeError, ValueError):
+            return
+        self._counts[post_id][KINDS.index(kind)] += amount
+
+    def record_many(self, post_ids, kind):
+        for post_id in post_ids:
+            self.record(post_id, kind)
+
+    async def flush(self):
+        if not self._counts:
+            return
+        counts, self._counts = self._counts, defaultdict(lambda: [0] * len(KINDS))
+        rows = [(post_id, *values, time.time()) for post_id, values in counts.items()]
+        try:
+            await self.db.aio.add_post_stats(rows)
+        except Exception as e:
+            logger.error(f"Failed to flush analytics: {e}")
+            # Keep the counts for the next flush
+            for post_id, values in counts.items():
+                current = self._counts[post_id]
+                for i, value in enumerate(values):
+                    current[i] += value
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,115 @@
+import asyncio
+import itertools
+import random
+from types import SimpleNamespace
+from pyrogram.enums import ChatMemberStatus, ChatType
+from pyrogram.errors import FloodWait
+
+
+class FakeClient:
+    """Offline stand-in for pyrogram.Client.
+
+    Every API call sleeps for `latency` (+/- `jitter`) seconds and, with
+    probability `flood_rate`, raises FloodWait(`flood_seconds`) instead.
+    Sent messages are counted rather than stored so long runs stay flat.
+    The bot is an admin that may post in every chat, which are all channels.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, flood_rate=0.0, flood_seconds=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.flood_waits = 0
+        self._ids = itertools.count(1)
+
+    async def _wait(self):
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.flood_waits += 1
+            raise FloodWait(value=self.flood_seconds)
+
+    async def _api_call(self, chat_id):
+        await self._wait()
+        self.sent += 1
+        return FakeMessage(self, chat_id, message_id=next(self._ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._api_call(chat_id)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self._api_call(chat_id)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self._api_call(chat_id)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return [await self._api_call(chat_id) for _ in media]
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        return await self._api_call(chat_id)
+
+    async def edit_message_caption(self, chat_id, message_id, caption, **kwargs):
+        return await self._api_call(chat_id)
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        return await self._api_call(chat_id)
+
+    async def delete_messages(self, chat_id, message_ids, revoke=True):
+        await self._api_call(chat_id)
+        return len(message_ids)
+
+    async def get_me(self):
+        return SimpleNamespace(id=0, username="benchmark_bot")
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id, title=f"Chat {chat_id}", type=ChatType.CHANNEL)
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._wait()
+        return SimpleNamespace(status=ChatMemberStatus.ADMINISTRATOR, privileges=SimpleNamespace(can_post_messages=True))
+
+    async def get_media_group(self, chat_id, message_id):
+        await self._wait()
+        album = []
+        for offset in range(2):
+            item = FakeMessage(self, chat_id, message_id=message_id + offset)
+            item.photo = SimpleNamespace(file_id=f"photo-{message_id + offset}")
+            item.media_group_id = str(message_id)
+            album.append(item)
+        return album
+
+
+class FakeMessage:
+    """Just enough of pyrogram.types.Message for the bot's handlers."""
+
+    def __init__(self, client, chat_id, text=None, user_id=None, message_id=1):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=user_id if user_id is not None else chat_id)
+        self.text = FakeText(text) if text is not None else None
+        self.caption = None
+        self.photo = None
+        self.video = None
+        self.media_group_id = None
+        self.forward_from_chat = None
+        self.command = text.split() if text and text.startswith('/') else None
+        if self.command:
+            self.command[0] = self.command[0][1:]
+
+    async def reply_text(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, **kwargs)
+
+
+class FakeText(str):
+    """str with the `.markdown` attribute pyrogram's Str provides."""
+
+    @property
+    def markdown(self):
+        return str(self)
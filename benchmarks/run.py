@@ -0,0 +1,337 @@
+"""Offline benchmarks for the bot's hot paths.
+
+Runs without network access: Telegram is replaced by FakeClient and
+ShrinkEarn by a local StubShortener. Results are written as JSON so two
+commits can be compared:
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_client import FakeClient, FakeMessage  # noqa: E402
+from benchmarks.stub_shortener import StubShortener  # noqa: E402
+
+WORDS = ("movie series episode season trailer download free premium course tutorial python music album "
+         "live match highlights news update guide review offer deal ebook podcast").split()
+
+
+def summarize(samples):
+    """Latency summary in milliseconds."""
+    samples = sorted(samples)
+    ms = [s * 1000 for s in samples]
+
+    def pct(p):
+        return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))]
+
+    return {
+        'n': len(ms),
+        'mean_ms': statistics.fmean(ms),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': ms[-1],
+    }
+
+
+async def measure(func, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def measure_sync(func, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def seed_posts(db, count, seed=0):
+    rng = random.Random(seed)
+    conn = db._connect()
+    batch = []
+    for i in range(count):
+        title = ' '.join(rng.choices(WORDS, k=4)) + f' {i}'
+        content = ' '.join(rng.choices(WORDS, k=40))
+        batch.append((title, content, None, None, '[]'))
+        if len(batch) == 5000:
+            with conn:
+                conn.executemany("INSERT INTO posts (title, content, media_type, media_file_id, buttons) VALUES (?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany("INSERT INTO posts (title, content, media_type, media_file_id, buttons) VALUES (?, ?, ?, ?, ?)", batch)
+
+
+# ============== BENCHMARKS ==============
+
+async def bench_fanout(channel_counts, latency, flood_rate):
+    from publisher import Publisher
+    from pyrogram.enums import ParseMode
+    from post_cache import PreparedPost
+    from config import PUBLISH_CONCURRENCY
+
+    results = {}
+    post = PreparedPost(1, "Benchmark post", None, None, None, "Benchmark post", None, ParseMode.DISABLED)
+    for count in channel_counts:
+        client = FakeClient(latency=latency, flood_rate=flood_rate, flood_seconds=0.2)
+        # Lift the token buckets so the numbers measure the engine, not Telegram's limits
+        publisher = Publisher(PUBLISH_CONCURRENCY, 1e9, 1e9)
+        channel_ids = [str(-1000000000000 - i) for i in range(count)]
+        start = time.perf_counter()
+        report = await publisher.publish(client, channel_ids, post)
+        elapsed = time.perf_counter() - start
+        results[f'fanout.publish.{count}'] = {
+            'channels': count,
+            'seconds': elapsed,
+            'sends_per_second': count / elapsed,
+            'delivered': sum(1 for r in report if r.ok),
+            'flood_waits': client.flood_waits,
+        }
+    return results
+
+
+async def bench_outbox(channel_counts, latency, flood_rate, workdir):
+    from database import Database
+    from publisher import Publisher
+    from post_cache import PostCache
+    from outbox import OutboxWorker
+    from config import PUBLISH_CONCURRENCY, OUTBOX_CAPACITY
+
+    results = {}
+    for count in channel_counts:
+        db = Database(os.path.join(workdir, f'outbox_{count}.db'))
+        post_id = db.add_post("Benchmark", "Benchmark post", None, None, [])
+        client = FakeClient(latency=latency, flood_rate=flood_rate, flood_seconds=0.2)
+        worker = OutboxWorker(db, Publisher(PUBLISH_CONCURRENCY, 1e9, 1e9), PostCache(db),
+                              capacity=OUTBOX_CAPACITY, base_delay=0.1, poll_interval=0.05)
+        worker.start(client)
+        start = time.perf_counter()
+        job_id = await db.aio.enqueue_publish(post_id, [str(-1000000000000 - i) for i in range(count)])
+        worker.wake()
+        finished = "SELECT finished_at FROM publish_jobs WHERE id = ?"
+        while db._connect().execute(finished, (job_id,)).fetchone()[0] is None:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await worker.stop()
+        db.close()
+        results[f'fanout.outbox.{count}'] = {
+            'channels': count,
+            'seconds': elapsed,
+            'sends_per_second': count / elapsed,
+            'flood_waits': client.flood_waits,
+        }
+    return results
+
+
+async def bench_shards(shard_counts, channels, latency, workdir):
+    """Outbox throughput with one worker per bot token, each held to Telegram's global send rate."""
+    from database import Database
+    from publisher import Publisher
+    from post_cache import PostCache
+    from outbox import OutboxWorker
+    from sharding import HashRing
+    from config import PUBLISH_CONCURRENCY, OUTBOX_CAPACITY, GLOBAL_SEND_RATE
+
+    results = {}
+    for shards in shard_counts:
+        db = Database(os.path.join(workdir, f'shards_{shards}.db'), shard_ring=HashRing(shards))
+        post_id = db.add_post("Benchmark", "Benchmark post", None, None, [])
+        clients = [FakeClient(latency=latency, seed=shard) for shard in range(shards)]
+        workers = [OutboxWorker(db, Publisher(PUBLISH_CONCURRENCY, GLOBAL_SEND_RATE, 1e9), PostCache(db),
+                                capacity=OUTBOX_CAPACITY, poll_interval=0.05, shard=shard, reports=shard == 0)
+                   for shard in range(shards)]
+        for worker, client in zip(workers, clients):
+            worker.start(client)
+        start = time.perf_counter()
+        job_id = await db.aio.enqueue_publish(post_id, [str(-1000000000000 - i) for i in range(channels)])
+        for worker in workers:
+            worker.wake()
+        finished = "SELECT finished_at FROM publish_jobs WHERE id = ?"
+        while db._connect().execute(finished, (job_id,)).fetchone()[0] is None:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            await worker.stop()
+        db.close()
+        results[f'fanout.shards.{shards}'] = {
+            'shards': shards,
+            'channels': channels,
+            'seconds': elapsed,
+            'sends_per_second': channels / elapsed,
+            'per_shard': [client.sent for client in clients],
+        }
+    return results
+
+
+def bench_search(sizes, iterations, workdir):
+    from database import Database
+
+    results = {}
+    rng = random.Random(1)
+    for size in sizes:
+        db = Database(os.path.join(workdir, f'search_{size}.db'))
+        seed_posts(db, size)
+        queries = [' '.join(rng.choices(WORDS, k=rng.randint(1, 2)))[:rng.randint(3, 12)] for _ in range(iterations)]
+        results[f'search_posts.{size}'] = measure_sync(lambda i: db.search_posts(queries[i]), iterations)
+        db.close()
+    return results
+
+
+async def bench_handlers(iterations, shortener_latency, workdir):
+    # main opens bot_data.db in the working directory, so import it from a scratch dir
+    os.chdir(workdir)
+    import main
+    from config import ADMINS
+
+    seed_posts(main.db, 1000)
+    # Handlers only queue the update; each measurement waits for the dispatcher to run it
+    client = FakeClient(latency=0, jitter=0)
+    admin_id, user_id = ADMINS[0], 424242
+    results = {}
+
+    results['get_post'] = measure_sync(lambda i: main.db.get_post(1 + i % 1000), iterations)
+
+    async def deep_link_cold(i):
+        main.post_cache.cache.clear()
+        await main.start_command(client, FakeMessage(client, user_id, f"/start post_{1 + i % 1000}"))
+        await main.dispatcher.join()
+    results['deep_link.cold'] = await measure(deep_link_cold, iterations)
+
+    async def deep_link_hot(i):
+        await main.start_command(client, FakeMessage(client, user_id, "/start post_1"))
+        await main.dispatcher.join()
+    results['deep_link.hot'] = await measure(deep_link_hot, iterations)
+
+    async def search_message(i):
+        # A fresh user and an empty result cache, so every search reaches the database
+        main.search.cache.clear()
+        await main.handle_messages(client, FakeMessage(client, user_id + i, random.choice(WORDS)))
+        await main.dispatcher.join()
+    results['handle_messages.search'] = await measure(search_message, iterations)
+
+    async def flood():
+        while True:
+            await main.handle_messages(client, FakeMessage(client, user_id, ' '.join(random.choices(WORDS, k=2))))
+            await asyncio.sleep(0)
+
+    # Other users' searches while one user floods the bot, run past the dispatcher queue
+    flooder = asyncio.create_task(flood())
+    handle_search = main.handle_messages.__wrapped__
+
+    async def search_during_flood(i):
+        main.search.cache.clear()
+        await handle_search(client, FakeMessage(client, user_id + iterations + i, random.choice(WORDS)))
+    results['handle_messages.search_under_flood'] = await measure(search_during_flood, iterations)
+    flooder.cancel()
+    await main.dispatcher.join()
+
+    stub = await StubShortener(latency=shortener_latency).start()
+    main.shortener.base_url = stub.url
+
+    async def button_capture(i):
+        main.user_data[admin_id] = {'state': 'creating_post', 'post_data': {'content': 'x', 'content_set': True}}
+        lines = '\n'.join(f"Link {n} | https://example.com/{i}/{n}{{url}}" for n in range(3))
+        await main.handle_messages(client, FakeMessage(client, admin_id, lines))
+        await main.dispatcher.join()
+    results['handle_messages.buttons_3_urls'] = await measure(button_capture, max(1, iterations // 10))
+
+    await main.shortener.close()
+    await stub.stop()
+    main.db.close()
+    return results
+
+
+# ============== RUNNER ==============
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline):
+    """Print the change of each metric against a previous run."""
+    for name, stats in sorted(results.items()):
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        if 'p50_ms' in stats:
+            key, better = 'p50_ms', 'lower'
+        else:
+            key, better = 'sends_per_second', 'higher'
+        if old.get(key):
+            change = (stats[key] - old[key]) / old[key] * 100
+            print(f"{name:40s} {key:18s} {old[key]:12.3f} -> {stats[key]:12.3f} ({change:+.1f}%, {better} is better)")
+
+
+async def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        results.update(await bench_fanout(args.channels, args.send_latency, args.flood_rate))
+        results.update(await bench_outbox(args.channels, args.send_latency, args.flood_rate, workdir))
+        results.update(await bench_shards(args.shards, args.shard_channels, args.send_latency, workdir))
+        results.update(bench_search(args.posts, args.iterations, workdir))
+        results.update(await bench_handlers(args.iterations, args.shortener_latency, workdir))
+        os.chdir(ROOT)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--shard-channels', type=int, default=200)
+    parser.add_argument('--posts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--send-latency', type=float, default=0.05)
+    parser.add_argument('--flood-rate', type=float, default=0.01)
+    parser.add_argument('--shortener-latency', type=float, default=0.05)
+    parser.add_argument('--output', help="write JSON results to this file (default: stdout)")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    # Keep the bot's INFO logging (and per-FloodWait warnings) out of the report;
+    # main's own basicConfig does nothing once the root logger has a handler
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(run(args))
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import asyncio
+import hashlib
+from aiohttp import web
+
+
+class StubShortener:
+    """Local ShrinkEarn stand-in: answers `?api=&url=&format=text` after `latency` seconds."""
+
+    def __init__(self, latency=0.05, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api"
+
+    async def _handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        digest = hashlib.sha1(request.query.get('url', '').encode()).hexdigest()[:8]
+        return web.Response(text=f"https://shrinkearn.com/{digest}")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,186 @@
+"""Streaming JSONL import/export of posts and channels.
+
+    python bulk.py export posts posts.jsonl
+    python bulk.py export channels channels.jsonl
+    python bulk.py import posts posts.jsonl --chunk-size 1000
+
+One JSON object per line. Posts: id (optional on import), title, content,
+media_type, media_file_id, buttons, created_at. Channels: channel_id,
+channel_name. Imports commit in chunks and remember how far they got, so
+re-running an interrupted import resumes after the last committed chunk;
+`export --resume` appends to an interrupted export.
+
+Run against the bot's database from a separate process, imported posts
+are not evicted from the running bot's post cache; use the /import
+command for a live bot.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from database import Database
+
+
+def post_record(row):
+    post_id, title, content, media_type, media_file_id, buttons, created_at = row
+    if media_type == 'album':
+        media_file_id = json.loads(media_file_id)
+    return {
+        'id': post_id,
+        'title': title,
+        'content': content,
+        'media_type': media_type,
+        'media_file_id': media_file_id,
+        'buttons': json.loads(buttons) if buttons else [],
+        'created_at': created_at,
+    }
+
+
+def parse_created_at(value):
+    """Convert an ISO 8601 timestamp to the UTC 'YYYY-MM-DD HH:MM:SS' the database stores.
+
+    Stored values sort as text in the (created_at, id) keyset pages, so any
+    other form (a 'T', an offset, fractions of a second) would misorder them.
+    A value without an offset is taken as UTC, like CURRENT_TIMESTAMP.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise TypeError(f"created_at must be a string, not {type(value).__name__}")
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"created_at is not an ISO 8601 timestamp: {value!r}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def post_row(record):
+    content = record.get('content') or ''
+    return (
+        record.get('id'),
+        record.get('title') or content[:50] or "Untitled Post",
+        content,
+        record.get('media_type'),
+        record.get('media_file_id'),
+        record.get('buttons') or [],
+        parse_created_at(record.get('created_at')),
+    )
+
+
+def channel_record(row):
+    channel_id, channel_name = row
+    return {'channel_id': channel_id, 'channel_name': channel_name}
+
+
+def channel_row(record):
+    return (str(record['channel_id']), record.get('channel_name') or str(record['channel_id']))
+
+
+# kind: (export rows, to record, from record, import rows, resume key)
+KINDS = {
+    'posts': ('iter_posts', post_record, post_row, 'import_posts', 'id'),
+    'channels': ('iter_channels', channel_record, channel_row, 'import_channels', 'channel_id'),
+}
+
+
+def _resume_export(path, key):
+    """Drop a trailing partial line from an interrupted export and return the last exported key."""
+    last, good_end = None, 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            last = json.loads(line)[key]
+            good_end += len(line)
+    with open(path, 'r+b') as f:
+        f.truncate(good_end)
+    return last
+
+
+def export_jsonl(db, kind, path, resume=False, progress=None, progress_every=1000):
+    """Write every `kind` row to `path` as JSONL, streaming from the database; returns the rows written."""
+    iter_rows, to_record, _, _, key = KINDS[kind]
+    after = None
+    if resume and os.path.exists(path):
+        after = _resume_export(path, key)
+    count = 0
+    with open(path, 'a' if after is not None else 'w', encoding='utf-8') as f:
+        rows = getattr(db, iter_rows)(after) if after is not None else getattr(db, iter_rows)()
+        for row in rows:
+            f.write(json.dumps(to_record(row), ensure_ascii=False) + '\n')
+            count += 1
+            if progress and count % progress_every == 0:
+                progress(count)
+    if progress:
+        progress(count)
+    return count
+
+
+def import_jsonl(db, kind, path, chunk_size=1000, source=None, restart=False, progress=None):
+    """Upsert `kind` rows from a JSONL file in chunked transactions; returns the rows imported.
+
+    `source` identifies the file across runs (default: its name and size). An
+    import of a known source continues after its last committed chunk unless
+    `restart` is set.
+    """
+    _, _, from_record, import_rows, _ = KINDS[kind]
+    if source is None:
+        source = f"{kind}:{os.path.basename(path)}:{os.path.getsize(path)}"
+    skip, finished = (0, False) if restart else db.get_import_progress(source)
+    if finished:
+        return 0
+
+    count, line_no, chunk = 0, 0, []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if line_no <= skip or not line.strip():
+                continue
+            try:
+                chunk.append(from_record(json.loads(line)))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"{path}, line {line_no}: {e}") from e
+            if len(chunk) >= chunk_size:
+                getattr(db, import_rows)(chunk, source, line_no)
+                count += len(chunk)
+                chunk = []
+                if progress:
+                    progress(count)
+    if chunk:
+        getattr(db, import_rows)(chunk, source, line_no)
+        count += len(chunk)
+    db.finish_import(source, line_no)
+    if progress:
+        progress(count)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('kind', choices=list(KINDS))
+    parser.add_argument('path')
+    parser.add_argument('--db', default='bot_data.db')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--resume', action='store_true', help="export: append to an interrupted export")
+    parser.add_argument('--restart', action='store_true', help="import: ignore the saved resume point")
+    args = parser.parse_args()
+
+    def progress(count):
+        print(f"\r{args.kind}: {count} {args.action}ed", end='', file=sys.stderr, flush=True)
+
+    db = Database(args.db)
+    try:
+        if args.action == 'export':
+            export_jsonl(db, args.kind, args.path, args.resume, progress, args.chunk_size)
+        else:
+            import_jsonl(db, args.kind, args.path, args.chunk_size, restart=args.restart, progress=progress)
+        print(file=sys.stderr)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
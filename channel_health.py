@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import random
+import time
+from pyrogram.enums import ChatMemberStatus, ChatType
+from pyrogram.errors import (
+    ChannelBanned, ChannelInvalid, ChannelPrivate, ChannelPublicGroupNa, ChatAdminRequired, ChatForbidden,
+    ChatIdInvalid, ChatInvalid, ChatRestricted, ChatWriteForbidden, PeerIdInvalid, UserBannedInChannel
+)
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the bot can no longer post to the chat at all (kicked, demoted,
+# banned, chat deleted), as opposed to a problem with one message or a network blip
+PERMANENT_ERRORS = (
+    ChannelBanned, ChannelInvalid, ChannelPrivate, ChannelPublicGroupNa, ChatAdminRequired, ChatForbidden,
+    ChatIdInvalid, ChatInvalid, ChatRestricted, ChatWriteForbidden, PeerIdInvalid, UserBannedInChannel
+)
+
+
+def is_permanent(error):
+    return isinstance(error, PERMANENT_ERRORS)
+
+
+class ChannelHealth:
+    """Per-channel health tracking and quarantine of dead destinations.
+
+    The outbox reports every failed send through `record_failure`; a
+    permanent error, or `quarantine_failures` failures in a row, quarantines
+    the channel so fan-outs and the channel picker skip it. A background
+    probe re-checks this shard's quarantined channels with one cheap
+    get_chat_member call (plus get_chat when the answer depends on whether
+    it is a broadcast channel), backing off from `probe_interval` to
+    `max_probe_interval`, and restores those the bot can post to again.
+    """
+
+    def __init__(self, db, publisher, quarantine_failures=10, probe_interval=3600, max_probe_interval=24 * 3600,
+                 batch_size=20, shard=0):
+        self.db = db
+        self.publisher = publisher
+        self.quarantine_failures = quarantine_failures
+        self.probe_interval = probe_interval
+        self.max_probe_interval = max_probe_interval
+        self.batch_size = batch_size
+        self.shard = shard
+        self.client = None
+        self._task = None
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def probe_delay(self, quarantined_for):
+        """Wait as long as the channel has been quarantined, so the gaps between probes double."""
+        delay = min(self.max_probe_interval, max(self.probe_interval, quarantined_for))
+        return delay * random.uniform(0.9, 1.1)
+
+    async def record_failure(self, channel_id, error):
+        """Count a failed send to `channel_id`; returns True if the channel is (now) quarantined."""
+        now = time.time()
+        permanent = is_permanent(error)
+        quarantined_at = await self.db.aio.record_channel_failure(
+            channel_id, type(error).__name__, permanent, self.quarantine_failures, now, now + self.probe_delay(0)
+        )
+        if quarantined_at == now:
+            logger.warning(f"Quarantined channel {channel_id}: {type(error).__name__}")
+        return quarantined_at is not None
+
+    async def _run(self):
+        while True:
+            try:
+                # Each shard probes with the bot that delivers to the channel
+                due = await self.db.aio.get_channels_to_probe(time.time(), self.batch_size, self.shard)
+                for channel_id, quarantined_at in due:
+                    await self._probe(channel_id, quarantined_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Channel probe error: {e}")
+            await asyncio.sleep(self.probe_interval / 12)
+
+    async def _posting_error(self, chat_id):
+        """None if the bot may post to `chat_id`, else why not."""
+        member, _ = await self.publisher.call(chat_id, self.client.get_chat_member, chat_id, "me")
+        if member.status == ChatMemberStatus.OWNER:
+            return None
+        if member.status == ChatMemberStatus.ADMINISTRATOR and member.privileges and member.privileges.can_post_messages:
+            return None
+        if member.status not in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER):
+            return member.status.name.title()
+        # Only admins with the post right can post in a broadcast channel; in groups membership is enough
+        chat, _ = await self.publisher.call(chat_id, self.client.get_chat, chat_id)
+        return "ChatAdminRequired" if chat.type == ChatType.CHANNEL else None
+
+    async def _probe(self, channel_id, quarantined_at):
+        chat_id = int(channel_id)
+        try:
+            error = await self._posting_error(chat_id)
+        except Exception as e:
+            error = type(e).__name__
+        if error is None:
+            logger.info(f"Channel {channel_id} is reachable again, lifting its quarantine")
+            await self.db.aio.record_channel_probe(channel_id, None)
+        else:
+            await self.db.aio.record_channel_probe(channel_id, error, time.time() + self.probe_delay(time.time() - quarantined_at))
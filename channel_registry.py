@@ -0,0 +1,52 @@
+import time
+from collections import namedtuple
+
+# The publishable channels: ids in picker (name) order, id -> name, and
+# group name -> ids of its publishable members in the same order
+Channels = namedtuple('Channels', 'ids names groups')
+
+
+def build_channels(rows, memberships):
+    """Build Channels from (channel_id, channel_name) rows and (group name, channel_id) memberships."""
+    ids = tuple(str(channel_id) for channel_id, _ in rows)
+    names = {str(channel_id): channel_name for channel_id, channel_name in rows}
+    position = {channel_id: i for i, channel_id in enumerate(ids)}
+    groups = {}
+    for name, channel_id in memberships:
+        if channel_id in position:
+            groups.setdefault(name, []).append(channel_id)
+    return Channels(ids, names, {name: tuple(sorted(members, key=position.get)) for name, members in groups.items()})
+
+
+class ChannelRegistry:
+    """In-memory copy of the active channels and their groups for the publish picker.
+
+    Loaded with two queries on first use and dropped whenever the storage
+    reports a channel change (channels added or removed, group edits,
+    quarantines), so picker taps never touch the database. `ttl` bounds how
+    long a quarantine or recovery made by another process goes unseen.
+    """
+
+    def __init__(self, db, ttl=60):
+        self.db = db
+        self.ttl = ttl
+        self._channels = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        db.on_channel_change(self.invalidate)
+
+    async def get(self):
+        channels = self._channels
+        if channels is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return channels
+        generation = self._generation
+        channels = build_channels(await self.db.aio.get_active_channels(), await self.db.aio.get_channel_groups())
+        # Don't keep a copy read before a concurrent change
+        if generation == self._generation:
+            self._channels = channels
+            self._loaded_at = time.monotonic()
+        return channels
+
+    def invalidate(self):
+        self._generation += 1
+        self._channels = None
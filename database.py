@@ -1,107 +1,657 @@
 import sqlite3
 import json
+import re
+import time
+import asyncio
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import DB_QUERY_SECONDS
+from migrations import migrate
+from storage import SHORT_URL_SLACK, Storage
 
-class Database:
-    def __init__(self, db_name='bot_data.db'):
+def fts_query(text, max_terms=8):
+    """Turn free text into an FTS5 query that prefix-matches every word."""
+    terms = re.findall(r'\w+', text.lower())[:max_terms]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def encode_media(media_file_id):
+    """Albums keep their [[media_type, file_id], ...] items as compact JSON in media_file_id."""
+    if isinstance(media_file_id, list):
+        return json.dumps(media_file_id, separators=(',', ':'))
+    return media_file_id
+
+
+class AsyncDatabase:
+    """Awaitable view of a Database: `await db.aio.get_post(1)` runs the query on a DB thread."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+
+        async def call(*args, **kwargs):
+            return await self._db.run(method, *args, **kwargs)
+
+        setattr(self, name, call)
+        return call
+
+
+class Database(Storage):
+    """SQLite storage: one long-lived connection per thread, blocking calls run on a small pool behind `aio`."""
+
+    def __init__(self, db_name='bot_data.db', workers=2, shard_ring=None):
+        super().__init__(shard_ring)
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+        # The loop awaiting `aio` calls, which owns the caches the change listeners update
+        self._loop = None
+        self.aio = AsyncDatabase(self)
         self.init_db()
 
-    def init_db(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
+    def _connect(self):
+        """Return this thread's long-lived connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_name, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA cache_size=-20000")
+            conn.execute("PRAGMA mmap_size=268435456")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking database call on the DB executor without blocking the event loop."""
+        loop = self._loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._timed, func, *args, **kwargs))
+
+    def _timed(self, func, *args, **kwargs):
+        with DB_QUERY_SECONDS.time(method=func.__name__):
+            return func(*args, **kwargs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self.close()
+
+    def _on_loop(self, func, *args):
+        """Run a change listener on the event loop rather than the DB thread that made the change.
+
+        Handing it over before the change's `aio` call returns its result
+        keeps the caches invalidated by the time the caller resumes.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            func(*args)
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            func(*args)
+        else:
+            loop.call_soon_threadsafe(func, *args)
+
+    def _post_changed(self, post_id):
+        self._on_loop(super()._post_changed, post_id)
 
-        # Posts table
-        c.execute('''CREATE TABLE IF NOT EXISTS posts
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      title TEXT,
-                      content TEXT,
-                      media_type TEXT,
-                      media_file_id TEXT,
-                      buttons TEXT,
-                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-
-        # Channels table
-        c.execute('''CREATE TABLE IF NOT EXISTS channels
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      channel_id TEXT UNIQUE,
-                      channel_name TEXT,
-                      added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-
-        conn.commit()
-        conn.close()
+    def _channel_changed(self):
+        self._on_loop(super()._channel_changed)
+
+    def init_db(self):
+        """Bring the schema up to date (see migrations.py)."""
+        migrate(self._connect())
 
     def add_post(self, title, content, media_type, media_file_id, buttons):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("""INSERT INTO posts (title, content, media_type, media_file_id, buttons)
-                     VALUES (?, ?, ?, ?, ?)""",
-                 (title, content, media_type, media_file_id, json.dumps(buttons)))
-        post_id = c.lastrowid
-        conn.commit()
-        conn.close()
-        return post_id
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""INSERT INTO posts (title, content, media_type, media_file_id, buttons)
+                                VALUES (?, ?, ?, ?, ?)""",
+                             (title, content, media_type, encode_media(media_file_id), json.dumps(buttons)))
+        self._post_changed(c.lastrowid)
+        return c.lastrowid
 
     def update_post(self, post_id, title, content, media_type, media_file_id, buttons):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("""UPDATE posts SET title = ?, content = ?, media_type = ?, media_file_id = ?, buttons = ?
-                     WHERE id = ?""",
-                  (title, content, media_type, media_file_id, json.dumps(buttons), post_id))
-        conn.commit()
-        conn.close()
+        """Update a post and queue an edit of its published copies; returns how many messages will be edited."""
+        conn = self._connect()
+        with conn:
+            conn.execute("""UPDATE posts SET title = ?, content = ?, media_type = ?, media_file_id = ?, buttons = ?
+                            WHERE id = ?""",
+                         (title, content, media_type, encode_media(media_file_id), json.dumps(buttons), post_id))
+            # An edit arriving while an earlier one is in flight queues the message again
+            c = conn.execute("""UPDATE published_messages SET pending = 'edit', attempts = 0, next_attempt_at = NULL
+                                WHERE post_id = ? AND part != 'album_item'
+                                  AND (pending IS NULL OR pending IN ('edit', 'editing'))""", (post_id,))
+            # Copies being sent right now were prepared from the old post; edit them once recorded
+            conn.execute("""UPDATE deliveries SET post_change = 'edit'
+                            WHERE post_id = ? AND status = 'sending' AND post_change IS NULL""", (post_id,))
+        self._post_changed(post_id)
+        return c.rowcount
 
     def get_post(self, post_id):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
+        c = self._connect().cursor()
         c.execute("SELECT content, media_type, media_file_id, buttons FROM posts WHERE id = ?", (post_id,))
-        post = c.fetchone()
-        conn.close()
-        return post
+        return c.fetchone()
 
     def get_all_posts(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("SELECT id, title, created_at FROM posts ORDER BY created_at DESC")
-        posts = c.fetchall()
-        conn.close()
-        return posts
+        c = self._connect().cursor()
+        c.execute("SELECT id, title, created_at FROM posts ORDER BY created_at DESC, id DESC")
+        return c.fetchall()
+
+    def get_posts_page(self, limit, cursor=None, forward=True):
+        """Keyset page of (id, title, created_at) rows, newest first.
+
+        `cursor` is the (created_at, id) of the row to continue from: forward
+        returns the rows after it, backward the rows before it. Returns
+        (rows, has_prev, has_next).
+        """
+        c = self._connect().cursor()
+        if cursor is None:
+            c.execute("SELECT id, title, created_at FROM posts ORDER BY created_at DESC, id DESC LIMIT ?",
+                      (limit + 1,))
+        elif forward:
+            c.execute("""SELECT id, title, created_at FROM posts WHERE (created_at, id) < (?, ?)
+                         ORDER BY created_at DESC, id DESC LIMIT ?""",
+                      (cursor[0], cursor[1], limit + 1))
+        else:
+            c.execute("""SELECT id, title, created_at FROM posts WHERE (created_at, id) > (?, ?)
+                         ORDER BY created_at ASC, id ASC LIMIT ?""",
+                      (cursor[0], cursor[1], limit + 1))
+        rows = c.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if cursor is None:
+            return rows, False, has_more
+        if forward:
+            return rows, True, has_more
+        return rows[::-1], has_more, True
 
     def delete_post(self, post_id):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("DELETE FROM posts WHERE id = ?", (post_id,))
-        conn.commit()
-        conn.close()
+        """Delete a post and queue the deletion of its published copies; returns how many messages will be deleted."""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM posts WHERE id = ?", (post_id,))
+            conn.execute("DELETE FROM post_stats WHERE post_id = ?", (post_id,))
+            c = conn.execute("""UPDATE published_messages SET pending = 'delete', attempts = 0, next_attempt_at = NULL
+                                WHERE post_id = ? AND (pending IS NULL OR pending != 'deleting')""", (post_id,))
+            conn.execute("UPDATE deliveries SET post_change = 'delete' WHERE post_id = ? AND status = 'sending'", (post_id,))
+        self._post_changed(post_id)
+        return c.rowcount
 
-    def search_posts(self, query):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        # Using LOWER() for case-insensitive search
-        c.execute("SELECT id, title FROM posts WHERE LOWER(title) LIKE LOWER(?) OR LOWER(content) LIKE LOWER(?) ORDER BY created_at DESC",
-                  (f'%{query}%', f'%{query}%'))
-        posts = c.fetchall()
-        conn.close()
-        return posts
+    def search_posts(self, query, limit=20, offset=0):
+        match = fts_query(query)
+        if not match:
+            return []
+        c = self._connect().cursor()
+        # BM25 ranking, with title matches weighted above content matches
+        c.execute("""SELECT rowid, title FROM posts_fts WHERE posts_fts MATCH ?
+                     ORDER BY bm25(posts_fts, 10.0, 1.0) LIMIT ? OFFSET ?""",
+                  (match, limit, offset))
+        return c.fetchall()
 
     def add_channel(self, channel_id, channel_name):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
-                 (channel_id, channel_name))
-        conn.commit()
-        conn.close()
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO channels (channel_id, channel_name) VALUES (?, ?)",
+                         (channel_id, channel_name))
+        self._channel_changed()
 
     def get_all_channels(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute("SELECT channel_id, channel_name FROM channels")
-        channels = c.fetchall()
-        conn.close()
-        return channels
+        c = self._connect().cursor()
+        c.execute("SELECT channel_id, channel_name FROM channels ORDER BY channel_name, channel_id")
+        return c.fetchall()
+
+    def get_active_channels(self):
+        """Channels that are not quarantined, for publishing."""
+        c = self._connect().cursor()
+        c.execute("""SELECT channel_id, channel_name FROM channels WHERE quarantined_at IS NULL
+                     ORDER BY channel_name, channel_id""")
+        return c.fetchall()
 
     def remove_channel(self, channel_id):
-        conn = sqlite3.connect(self.db_name)
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
+            conn.execute("DELETE FROM channel_groups WHERE channel_id = ?", (channel_id,))
+        self._channel_changed()
+
+    def get_channel_groups(self):
+        """Every group membership as (group name, channel_id), by group name."""
+        c = self._connect().cursor()
+        c.execute("SELECT name, channel_id FROM channel_groups ORDER BY name")
+        return c.fetchall()
+
+    def add_to_channel_group(self, name, channel_ids):
+        """Add known channels to group `name`; returns how many were not in it yet."""
+        conn = self._connect()
+        with conn:
+            c = conn.executemany("""INSERT OR IGNORE INTO channel_groups (name, channel_id)
+                                    SELECT ?, channel_id FROM channels WHERE channel_id = ?""",
+                                 [(name, str(channel_id)) for channel_id in channel_ids])
+        self._channel_changed()
+        return c.rowcount
+
+    def remove_from_channel_group(self, name, channel_ids=None):
+        """Remove channels from group `name`, or the whole group without `channel_ids`; returns how many."""
+        conn = self._connect()
+        with conn:
+            if channel_ids is None:
+                c = conn.execute("DELETE FROM channel_groups WHERE name = ?", (name,))
+            else:
+                c = conn.executemany("DELETE FROM channel_groups WHERE name = ? AND channel_id = ?",
+                                     [(name, str(channel_id)) for channel_id in channel_ids])
+        self._channel_changed()
+        return c.rowcount
+
+    def get_short_url(self, long_url, ttl):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT short_url, last_used FROM short_urls WHERE long_url = ? AND created_at > ?",
+                           (long_url, now - ttl)).fetchone()
+        if row is None:
+            return None
+        # LRU order only needs to be roughly right, so most hits stay read-only
+        if row[1] < now - ttl * SHORT_URL_SLACK:
+            with conn:
+                conn.execute("UPDATE short_urls SET last_used = ? WHERE long_url = ?", (now, long_url))
+        return row[0]
+
+    def save_short_url(self, long_url, short_url, max_entries):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO short_urls (long_url, short_url, created_at, last_used) VALUES (?, ?, ?, ?)",
+                         (long_url, short_url, now, now))
+            # Evict the least recently used entries beyond the size cap
+            if self._short_url_eviction_due(max_entries):
+                conn.execute("""DELETE FROM short_urls WHERE long_url IN
+                                (SELECT long_url FROM short_urls ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                             (max_entries,))
+
+    def enqueue_publish(self, post_id, channel_ids, status_chat_id=None, status_message_id=None):
+        """Create a publish job with one pending delivery per channel and return its id."""
+        conn = self._connect()
+        with conn:
+            return self._enqueue_publish(conn, post_id, channel_ids, status_chat_id, status_message_id)
+
+    def _enqueue_publish(self, conn, post_id, channel_ids, status_chat_id, status_message_id):
+        c = conn.execute("INSERT INTO publish_jobs (post_id, status_chat_id, status_message_id) VALUES (?, ?, ?)",
+                         (post_id, status_chat_id, status_message_id))
+        job_id = c.lastrowid
+        now = time.time()
+        conn.executemany("""INSERT OR IGNORE INTO deliveries (job_id, post_id, channel_id, next_attempt_at, shard)
+                            VALUES (?, ?, ?, ?, ?)""",
+                         [(job_id, post_id, str(channel_id), now, self.shard_for(channel_id)) for channel_id in channel_ids])
+        return job_id
+
+    def claim_deliveries(self, limit, now, shard=0):
+        """Atomically mark up to `limit` due deliveries of `shard` as sending and return them.
+
+        The last column is the quarantine error of the channel, None while it is healthy.
+        """
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE deliveries SET status = 'sending', attempts = attempts + 1, post_change = NULL
+                                WHERE id IN (SELECT id FROM deliveries
+                                             WHERE shard = ? AND status = 'pending' AND next_attempt_at <= ?
+                                             ORDER BY next_attempt_at LIMIT ?)
+                                RETURNING id, job_id, post_id, channel_id, attempts,
+                                  (SELECT c.last_error_class FROM channels c
+                                   WHERE c.channel_id = deliveries.channel_id AND c.quarantined_at IS NOT NULL)""",
+                             (shard, now, limit))
+            return c.fetchall()
+
+    def next_delivery_due(self, shard=0):
+        c = self._connect().cursor()
+        c.execute("SELECT MIN(next_attempt_at) FROM deliveries WHERE shard = ? AND status = 'pending'", (shard,))
+        return c.fetchone()[0]
+
+    def mark_delivery_sent(self, delivery_id, message_id, parts=()):
+        """Mark a delivery sent and record its [(part, message_id)] in the published messages ledger.
+
+        Messages of a post edited or deleted while they were being sent are
+        recorded with that edit or delete already queued.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE deliveries SET status = 'sent', message_id = ?, last_error = NULL WHERE id = ?",
+                         (message_id, delivery_id))
+            conn.execute("""UPDATE channels SET failures = 0, last_success_at = ?, quarantined_at = NULL, next_probe_at = NULL
+                            WHERE channel_id = (SELECT channel_id FROM deliveries WHERE id = ?)""",
+                         (time.time(), delivery_id))
+            conn.executemany("""INSERT INTO published_messages (post_id, chat_id, message_id, part, shard, pending)
+                                SELECT post_id, channel_id, :message_id, :part, shard,
+                                  CASE WHEN post_change = 'delete' OR (post_change = 'edit' AND :part != 'album_item')
+                                       THEN post_change END
+                                FROM deliveries WHERE id = :delivery_id""",
+                             [{'message_id': part_message_id, 'part': part, 'delivery_id': delivery_id}
+                              for part, part_message_id in parts])
+
+    def mark_delivery_failed(self, delivery_id, error, retry_at=None):
+        """Record a failed attempt; schedule a retry at `retry_at` or give up if it is None."""
+        conn = self._connect()
+        with conn:
+            if retry_at is None:
+                conn.execute("UPDATE deliveries SET status = 'failed', last_error = ? WHERE id = ?",
+                             (error, delivery_id))
+            else:
+                conn.execute("UPDATE deliveries SET status = 'pending', last_error = ?, next_attempt_at = ? WHERE id = ?",
+                             (error, retry_at, delivery_id))
+
+    def reset_stale_deliveries(self, shard=0):
+        """Return deliveries left 'sending' by a crashed process to the queue."""
+        conn = self._connect()
+        with conn:
+            c = conn.execute("UPDATE deliveries SET status = 'pending' WHERE shard = ? AND status = 'sending'", (shard,))
+        return c.rowcount
+
+    def finish_job(self, job_id):
+        """Mark a job finished once none of its deliveries are outstanding; True only for the caller that finished it."""
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE publish_jobs SET finished_at = CURRENT_TIMESTAMP
+                                WHERE id = ? AND finished_at IS NULL AND NOT EXISTS
+                                  (SELECT 1 FROM deliveries WHERE job_id = ? AND status IN ('pending', 'sending'))""",
+                             (job_id, job_id))
+        return c.rowcount == 1
+
+    def claim_job_reports(self):
+        """Return finished jobs whose report has not been sent yet, marking them reported."""
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE publish_jobs SET reported = 1
+                                WHERE reported = 0 AND finished_at IS NOT NULL RETURNING id""")
+            return [row[0] for row in c.fetchall()]
+
+    def claim_message_syncs(self, limit, now, shard=0):
+        """Atomically take up to `limit` queued edits/deletes of published messages for `shard`."""
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE published_messages
+                                SET pending = CASE pending WHEN 'edit' THEN 'editing' ELSE 'deleting' END, attempts = attempts + 1
+                                WHERE id IN (SELECT id FROM published_messages
+                                             WHERE shard = ? AND pending IN ('edit', 'delete')
+                                               AND COALESCE(next_attempt_at, 0) <= ?
+                                             ORDER BY next_attempt_at LIMIT ?)
+                                RETURNING id, post_id, chat_id, message_id, part, pending, attempts""",
+                             (shard, now, limit))
+            return c.fetchall()
+
+    def next_message_sync_due(self, shard=0):
+        c = self._connect().cursor()
+        c.execute("""SELECT MIN(COALESCE(next_attempt_at, 0)) FROM published_messages
+                     WHERE shard = ? AND pending IN ('edit', 'delete')""", (shard,))
+        return c.fetchone()[0]
+
+    def finish_message_syncs(self, ids):
+        """Clear finished (or abandoned) edits and drop deleted messages from the ledger.
+
+        Rows re-queued by a newer edit or delete while in flight are left queued.
+        """
+        conn = self._connect()
+        params = [(message_row_id,) for message_row_id in ids]
+        with conn:
+            conn.executemany("UPDATE published_messages SET pending = NULL, attempts = 0 WHERE id = ? AND pending = 'editing'", params)
+            conn.executemany("DELETE FROM published_messages WHERE id = ? AND pending = 'deleting'", params)
+
+    def retry_message_syncs(self, ids, retry_at):
+        conn = self._connect()
+        with conn:
+            conn.executemany("""UPDATE published_messages SET pending = CASE pending WHEN 'editing' THEN 'edit' ELSE 'delete' END, next_attempt_at = ?
+                                WHERE id = ? AND pending IN ('editing', 'deleting')""",
+                             [(retry_at, message_row_id) for message_row_id in ids])
+
+    def reset_stale_message_syncs(self, shard=0):
+        """Re-queue edits/deletes left in flight by a crashed process."""
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE published_messages SET pending = CASE pending WHEN 'editing' THEN 'edit' ELSE 'delete' END
+                                WHERE shard = ? AND pending IN ('editing', 'deleting')""", (shard,))
+        return c.rowcount
+
+    def record_channel_failure(self, channel_id, error_class, permanent, max_failures, now, probe_at):
+        """Count a failed send; a permanent error or `max_failures` in a row quarantines the channel.
+
+        Returns the channel's quarantined_at (`now` if this failure quarantined it), or None.
+        """
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""UPDATE channels SET failures = failures + 1, last_error_class = :error,
+                                  quarantined_at = CASE WHEN quarantined_at IS NULL AND (:permanent OR failures + 1 >= :max)
+                                                        THEN :now ELSE quarantined_at END,
+                                  next_probe_at = CASE WHEN quarantined_at IS NULL AND (:permanent OR failures + 1 >= :max)
+                                                       THEN :probe_at ELSE next_probe_at END
+                                WHERE channel_id = :channel_id RETURNING quarantined_at""",
+                             {'error': error_class, 'permanent': int(permanent), 'max': max_failures, 'now': now,
+                              'probe_at': probe_at, 'channel_id': str(channel_id)})
+            row = c.fetchone()
+        if row and row[0] == now:
+            self._channel_changed()
+        return row[0] if row else None
+
+    def get_channels_to_probe(self, now, limit, shard=None):
+        """Quarantined channels of `shard` (every shard if None) due for a re-check, as (channel_id, quarantined_at)."""
+        c = self._connect().cursor()
+        c.execute("""SELECT channel_id, quarantined_at FROM channels
+                     WHERE quarantined_at IS NOT NULL AND next_probe_at <= ? ORDER BY next_probe_at""", (now,))
+        # The ring lives in Python, so page through the due channels until the batch is full
+        rows = (row for row in c if shard is None or self.shard_for(row[0]) == shard)
+        return list(itertools.islice(rows, limit))
+
+    def record_channel_probe(self, channel_id, error_class, next_probe_at=None):
+        """Lift the quarantine after a successful probe (error_class None), else schedule the next one."""
+        conn = self._connect()
+        with conn:
+            if error_class is None:
+                c = conn.execute("UPDATE channels SET failures = 0, quarantined_at = NULL, next_probe_at = NULL WHERE channel_id = ?",
+                                 (str(channel_id),))
+            else:
+                conn.execute("""UPDATE channels SET failures = failures + 1, last_error_class = ?, next_probe_at = ?
+                                WHERE channel_id = ? AND quarantined_at IS NOT NULL""",
+                             (error_class, next_probe_at, str(channel_id)))
+        if error_class is None and c.rowcount:
+            self._channel_changed()
+
+    def get_channel_health(self):
+        """(channel count, unhealthy channels) for the admin summary.
+
+        Rows are (channel_id, channel_name, failures, last_error_class,
+        last_success_at, quarantined_at, next_probe_at), quarantined first.
+        """
+        c = self._connect().cursor()
+        total = c.execute("SELECT COUNT(*) FROM channels").fetchone()[0]
+        c.execute("""SELECT channel_id, channel_name, failures, last_error_class, last_success_at, quarantined_at, next_probe_at
+                     FROM channels WHERE failures > 0 OR quarantined_at IS NOT NULL
+                     ORDER BY quarantined_at IS NULL, quarantined_at, failures DESC""")
+        return total, c.fetchall()
+
+    def get_job(self, job_id):
+        c = self._connect().cursor()
+        c.execute("SELECT post_id, status_chat_id, status_message_id FROM publish_jobs WHERE id = ?", (job_id,))
+        return c.fetchone()
+
+    def get_job_deliveries(self, job_id):
+        c = self._connect().cursor()
+        c.execute("""SELECT d.channel_id, c.channel_name, d.status, d.last_error, d.attempts FROM deliveries d
+                     LEFT JOIN channels c ON c.channel_id = d.channel_id
+                     WHERE d.job_id = ? ORDER BY d.id""", (job_id,))
+        return c.fetchall()
+
+    def iter_posts(self, after_id=0):
+        """Stream every post with id > `after_id` in id order without loading the table into memory."""
+        c = self._connect().cursor()
+        c.execute("""SELECT id, title, content, media_type, media_file_id, buttons, created_at
+                     FROM posts WHERE id > ? ORDER BY id""", (after_id,))
+        yield from c
+
+    def iter_channels(self, after_channel_id=''):
+        c = self._connect().cursor()
+        c.execute("SELECT channel_id, channel_name FROM channels WHERE channel_id > ? ORDER BY channel_id",
+                  (after_channel_id,))
+        yield from c
+
+    def import_posts(self, rows, source=None, lines_done=None):
+        """Upsert (id, title, content, media_type, media_file_id, buttons, created_at) rows in one transaction.
+
+        Rows with an id keep it, so deep links survive a migration; rows with a
+        None id get a new one. An existing post keeps its created_at unless the
+        row has one. With a `source`, its resume point is saved in the
+        same transaction.
+        """
+        conn = self._connect()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM posts").fetchone()[0]
+        with conn:
+            conn.executemany("""INSERT INTO posts (id, title, content, media_type, media_file_id, buttons, created_at)
+                                VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                                ON CONFLICT (id) DO UPDATE SET
+                                  title = excluded.title, content = excluded.content, media_type = excluded.media_type,
+                                  media_file_id = excluded.media_file_id, buttons = excluded.buttons,
+                                  created_at = COALESCE(?, posts.created_at)""",
+                             [(post_id, title, content, media_type, encode_media(media_file_id), json.dumps(buttons), created_at,
+                               created_at)
+                              for post_id, title, content, media_type, media_file_id, buttons, created_at in rows])
+            if source is not None:
+                self._save_import_progress(conn, source, lines_done)
+            new_ids = [row[0] for row in conn.execute("SELECT id FROM posts WHERE id > ?", (last_id,))]
+        for post_id in {row[0] for row in rows if row[0] is not None} | set(new_ids):
+            self._post_changed(post_id)
+
+    def import_channels(self, rows, source=None, lines_done=None):
+        """Upsert (channel_id, channel_name) rows in one transaction."""
+        conn = self._connect()
+        with conn:
+            conn.executemany("""INSERT INTO channels (channel_id, channel_name) VALUES (?, ?)
+                                ON CONFLICT (channel_id) DO UPDATE SET channel_name = excluded.channel_name""", rows)
+            if source is not None:
+                self._save_import_progress(conn, source, lines_done)
+        self._channel_changed()
+
+    def _save_import_progress(self, conn, source, lines_done, finished=False):
+        conn.execute("""INSERT OR REPLACE INTO bulk_imports (source, lines_done, finished, updated_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)""", (source, lines_done, int(finished)))
+
+    def get_import_progress(self, source):
+        """(lines_done, finished) of an earlier import of `source`, or (0, False)."""
+        c = self._connect().cursor()
+        c.execute("SELECT lines_done, finished FROM bulk_imports WHERE source = ?", (source,))
+        row = c.fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def finish_import(self, source, lines_done):
+        conn = self._connect()
+        with conn:
+            self._save_import_progress(conn, source, lines_done, finished=True)
+
+    def add_schedule(self, post_id, channel_ids, next_run_at, interval_seconds, created_by):
+        conn = self._connect()
+        with conn:
+            c = conn.execute("""INSERT INTO schedules (post_id, channel_ids, next_run_at, interval_seconds, created_by)
+                                VALUES (?, ?, ?, ?, ?)""",
+                             (post_id, json.dumps([str(cid) for cid in channel_ids]), next_run_at, interval_seconds, created_by))
+        return c.lastrowid
+
+    def get_active_schedules(self):
+        c = self._connect().cursor()
+        c.execute("SELECT id, next_run_at FROM schedules WHERE active = 1")
+        return c.fetchall()
+
+    def list_schedules(self, limit=20):
+        c = self._connect().cursor()
+        c.execute("""SELECT s.id, s.post_id, p.title, s.next_run_at, s.interval_seconds, s.channel_ids
+                     FROM schedules s LEFT JOIN posts p ON p.id = s.post_id
+                     WHERE s.active = 1 ORDER BY s.next_run_at LIMIT ?""", (limit,))
+        return [(sid, post_id, title, next_run_at, interval, len(json.loads(channel_ids)))
+                for sid, post_id, title, next_run_at, interval, channel_ids in c.fetchall()]
+
+    def cancel_schedule(self, schedule_id):
+        conn = self._connect()
+        with conn:
+            c = conn.execute("UPDATE schedules SET active = 0 WHERE id = ? AND active = 1", (schedule_id,))
+        return c.rowcount == 1
+
+    def fire_schedule(self, schedule_id, run_at, now):
+        """Enqueue the publish for a due schedule and advance it.
+
+        `run_at` must match the stored next run time, so a cancelled or
+        already-fired schedule is skipped. Returns (job_id, next_run_at); either
+        may be None.
+        """
+        conn = self._connect()
         c = conn.cursor()
-        c.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
-        conn.commit()
-        conn.close()
+        c.execute("""SELECT s.post_id, s.channel_ids, s.interval_seconds, s.created_by, p.id FROM schedules s
+                     LEFT JOIN posts p ON p.id = s.post_id
+                     WHERE s.id = ? AND s.active = 1 AND s.next_run_at = ?""", (schedule_id, run_at))
+        row = c.fetchone()
+        if row is None:
+            return None, None
+        post_id, channel_ids, interval, created_by, post_exists = row
+
+        next_run_at = None
+        if interval and post_exists:
+            # Skip runs missed while the bot was offline instead of firing them all at once
+            missed = max(0, int((now - run_at) // interval))
+            next_run_at = run_at + (missed + 1) * interval
+
+        with conn:
+            c = conn.execute("""UPDATE schedules SET next_run_at = ?, active = ?
+                                WHERE id = ? AND active = 1 AND next_run_at = ?""",
+                             (next_run_at if next_run_at is not None else run_at, 1 if next_run_at is not None else 0,
+                              schedule_id, run_at))
+            if c.rowcount != 1 or not post_exists:
+                return None, None
+            job_id = self._enqueue_publish(conn, post_id, json.loads(channel_ids), created_by, None)
+        return job_id, next_run_at
+
+    def load_sessions(self, now):
+        c = self._connect().cursor()
+        c.execute("SELECT user_id, data, expires_at FROM sessions WHERE expires_at > ? ORDER BY expires_at", (now,))
+        return c.fetchall()
+
+    def save_sessions(self, saved, deleted):
+        """Upsert (user_id, data, expires_at) rows and delete `deleted` user ids in one transaction."""
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO sessions (user_id, data, expires_at) VALUES (?, ?, ?)", saved)
+            conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in deleted])
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def add_post_stats(self, rows):
+        """Add (post_id, views, clicks, searches, updated_at) counts to the aggregates in one transaction."""
+        conn = self._connect()
+        with conn:
+            conn.executemany("""INSERT INTO post_stats (post_id, views, clicks, searches, updated_at)
+                                VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT(post_id) DO UPDATE SET
+                                    views = views + excluded.views,
+                                    clicks = clicks + excluded.clicks,
+                                    searches = searches + excluded.searches,
+                                    updated_at = excluded.updated_at""", rows)
+
+    def get_top_posts(self, limit=10):
+        """The most viewed existing posts as (post_id, title, views, clicks, searches)."""
+        c = self._connect().cursor()
+        # Walks idx_post_stats_views from the top; deleted posts are skipped by the join
+        c.execute("""SELECT s.post_id, p.title, s.views, s.clicks, s.searches
+                     FROM post_stats s JOIN posts p ON p.id = s.post_id
+                     ORDER BY s.views DESC LIMIT ?""", (limit,))
+        return c.fetchall()
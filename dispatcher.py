@@ -0,0 +1,138 @@
+import asyncio
+import functools
+import itertools
+import logging
+from collections import deque
+from pyrogram.types import CallbackQuery
+from metrics import DISPATCH_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(update):
+    """Id of the user a raw MTProto update comes from, or None."""
+    user_id = getattr(update, 'user_id', None)
+    if user_id is None:
+        message = getattr(update, 'message', None)
+        peer = getattr(message, 'from_id', None) or getattr(message, 'peer_id', None)
+        user_id = getattr(peer, 'user_id', None)
+    return user_id
+
+
+class UpdateLanes:
+    """Stand-in for Pyrogram's dispatcher.updates_queue that keeps each user's updates in order.
+
+    Pyrogram's workers parse updates concurrently before calling handlers,
+    and parsing can wait on the API (an uncached callback message, a
+    reply_to_message), so with one shared queue a later update of a user
+    can reach its handler first. Here each worker drains a lane of its own
+    and all updates of a user go to the same lane, so they are parsed and
+    queued in UserDispatcher in arrival order. Updates without a user are
+    spread over the lanes.
+    """
+
+    def __init__(self, lanes):
+        self._lanes = [asyncio.Queue() for _ in range(lanes)]
+        self._workers = {}
+        self._bind = itertools.count()
+        self._spread = itertools.count()
+
+    def put_nowait(self, packet):
+        user_id = update_user_id(packet[0]) if packet is not None else None
+        if user_id is None:
+            # Also hands the stop sentinels (None) to one worker each
+            index = next(self._spread) % len(self._lanes)
+        else:
+            index = user_id % len(self._lanes)
+        self._lanes[index].put_nowait(packet)
+
+    async def get(self):
+        # Worker tasks take the lanes in turn on their first get(), one lane each when
+        # there are as many workers as lanes (also after a restart)
+        task = asyncio.current_task()
+        lane = self._workers.get(task)
+        if lane is None:
+            lane = self._workers[task] = next(self._bind) % len(self._lanes)
+        packet = await self._lanes[lane].get()
+        if packet is None:
+            del self._workers[task]
+        return packet
+
+    def qsize(self):
+        return sum(lane.qsize() for lane in self._lanes)
+
+
+class UserDispatcher:
+    """Runs the updates of one user strictly in arrival order, different users in parallel.
+
+    Handlers wrapped with `serialized` return as soon as the update is
+    queued, so Pyrogram's workers are never held by a busy user. Updates
+    run in the order they are queued, which is arrival order as long as
+    the client's updates_queue is an UpdateLanes. Each user has at most
+    `max_pending` queued updates; beyond that, and for a callback whose
+    button is already queued or running, the update is dropped.
+    """
+
+    def __init__(self, max_pending=20):
+        self.max_pending = max_pending
+        self._queues = {}
+        self._overflowing = set()
+        self._tasks = set()
+
+    def serialized(self, func):
+        @functools.wraps(func)
+        async def wrapper(client, update):
+            key = None
+            if isinstance(update, CallbackQuery):
+                key = (update.message.id if update.message else None, update.data)
+            if not self.submit(update.from_user.id, key, func, client, update) and key is not None:
+                try:
+                    await update.answer()
+                except Exception:
+                    pass
+        return wrapper
+
+    def submit(self, user_id, key, func, *args):
+        """Queue `func(*args)` for `user_id`; returns False if the update was dropped."""
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            task = asyncio.create_task(self._drain(user_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif key is not None and any(queued_key == key for queued_key, _, _ in queue):
+            DISPATCH_DROPPED.inc(reason='duplicate')
+            return False
+        elif len(queue) >= self.max_pending:
+            DISPATCH_DROPPED.inc(reason='overflow')
+            # Once per backlog: a flooding user must not flood the log as well
+            if user_id not in self._overflowing:
+                self._overflowing.add(user_id)
+                logger.warning(f"Dropping updates from {user_id}: {len(queue)} already pending")
+            return False
+        queue.append((key, func, args))
+        return True
+
+    async def _drain(self, user_id, queue):
+        while queue:
+            # The running update stays at the head so duplicates of it are dropped too
+            _, func, args = queue[0]
+            try:
+                await func(*args)
+            except Exception as e:
+                logger.exception(f"Handler {func.__name__} failed for {user_id}: {e}")
+            finally:
+                queue.popleft()
+        del self._queues[user_id]
+        self._overflowing.discard(user_id)
+
+    def pending(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def join(self, timeout=None):
+        """Wait for every queued update to be handled."""
+        while self._tasks:
+            done, _ = await asyncio.wait(list(self._tasks), timeout=timeout)
+            if not done:
+                logger.warning(f"Gave up waiting for {self.pending()} pending updates")
+                return
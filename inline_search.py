@@ -0,0 +1,73 @@
+from pyrogram.types import (
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InlineQueryResultCachedVideo, InputTextMessageContent
+)
+from cache import LRUCache
+from database import fts_query
+
+
+def build_result(post, title):
+    """Turn a PreparedPost into a ready-to-send inline result (albums send their first item)."""
+    media_type, file_id = post.media_type, post.media_file_id
+    if media_type == 'album':
+        media_type, file_id = file_id[0]
+    description = post.text[:100]
+    result_id = str(post.post_id)
+    if media_type == 'photo':
+        return InlineQueryResultCachedPhoto(file_id, id=result_id, title=title, description=description,
+                                            caption=post.text, caption_entities=post.entities,
+                                            parse_mode=post.parse_mode, reply_markup=post.reply_markup)
+    if media_type == 'video':
+        return InlineQueryResultCachedVideo(file_id, title, id=result_id, description=description,
+                                            caption=post.text, caption_entities=post.entities,
+                                            parse_mode=post.parse_mode, reply_markup=post.reply_markup)
+    return InlineQueryResultArticle(
+        title,
+        InputTextMessageContent(post.text or title, entities=post.entities, parse_mode=post.parse_mode,
+                                disable_web_page_preview=True),
+        id=result_id, description=description, reply_markup=post.reply_markup
+    )
+
+
+class InlineSearch:
+    """Offset-paginated inline query answers built from post search.
+
+    Built result pages are cached per (query, offset) for `cache_ttl`
+    seconds and dropped when any post changes, so popular queries are
+    answered without touching SQLite.
+    """
+
+    def __init__(self, db, search, post_cache, page_size=20, cache_size=500, cache_ttl=60):
+        self.search = search
+        self.post_cache = post_cache
+        self.page_size = page_size
+        self.cache = LRUCache(cache_size, cache_ttl)
+        self._generation = 0
+        db.on_post_change(self.invalidate)
+
+    def cached(self, text, offset):
+        """The cached (results, next_offset) page, or None."""
+        return self.cache.get((fts_query(text), offset))
+
+    async def build(self, text, offset):
+        """Build, cache and return (results, next_offset) for one page of inline results."""
+        key = (fts_query(text), offset)
+        generation = self._generation
+        # One extra row tells whether there is a next page
+        found = await self.search.search(text, offset, self.page_size + 1)
+        results = []
+        for post_id, title in found[:self.page_size]:
+            post = await self.post_cache.get(post_id)
+            if post is not None:
+                results.append(build_result(post, title))
+        next_offset = str(offset + self.page_size) if len(found) > self.page_size else ''
+        page = (results, next_offset)
+        if generation == self._generation:
+            self.cache.set(key, page)
+        return page
+
+    def invalidate(self, post_id=None):
+        self._generation += 1
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
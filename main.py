@@ -1,12 +1,50 @@
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pyrogram.enums import ParseMode
+from pyrogram import Client, filters, idle
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InlineQuery
+import asyncio
 import logging
-import requests
-from urllib.parse import quote
 import json
-from config import API_ID, API_HASH, BOT_TOKEN, SHORTENER_API, ADMINS
+import os
+import re
+import tempfile
+from config import (
+    API_ID, API_HASH, SHORTENER_API, ADMINS,
+    PUBLISH_CONCURRENCY, GLOBAL_SEND_RATE, PER_CHAT_SEND_RATE,
+    SHORTENER_URL, SHORTENER_TIMEOUT, SHORTENER_CONCURRENCY,
+    SHORT_URL_CACHE_SIZE, SHORT_URL_CACHE_TTL, SHORT_URL_CACHE_MAX_ENTRIES,
+    SEARCH_RESULT_LIMIT, POST_CACHE_SIZE, POSTS_PAGE_SIZE,
+    OUTBOX_CAPACITY, OUTBOX_MAX_ATTEMPTS, OUTBOX_POLL_INTERVAL,
+    CHANNEL_QUARANTINE_FAILURES, CHANNEL_PROBE_INTERVAL, CHANNEL_PROBE_MAX_INTERVAL,
+    CHANNEL_PICKER_PAGE_SIZE, CHANNEL_REGISTRY_TTL,
+    METRICS_HOST, METRICS_PORT,
+    SESSION_MAX_USERS, SESSION_TTL, SESSION_PERSIST,
+    WORKERS, DISPATCH_MAX_PENDING,
+    BOT_TOKENS, SHARD_INDEX,
+    SEARCH_RATE, SEARCH_BURST, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL,
+    BULK_CHUNK_SIZE,
+    INLINE_PAGE_SIZE, INLINE_CACHE_TIME, INLINE_RESULT_CACHE_SIZE,
+    ANALYTICS_FLUSH_INTERVAL,
+    DATABASE_URL, POSTGRES_POOL_MIN, POSTGRES_POOL_MAX
+)
 from database import Database
+from storage import open_storage
+from publisher import Publisher, send_post
+from shortener import Shortener, ShortUrlCache
+from post_cache import PostCache
+from outbox import OutboxWorker
+from channel_health import ChannelHealth
+from channel_registry import ChannelRegistry
+from message_sync import MessageSync
+from sessions import SessionStore
+from dispatcher import UpdateLanes, UserDispatcher
+from sharding import HashRing
+from search import SearchService
+from inline_search import InlineSearch
+from analytics import Analytics
+from bulk import KINDS, export_jsonl, import_jsonl
+from scheduler import Scheduler, parse_schedule, format_time
+import metrics
+from metrics import instrument_handler, MetricsServer, monitor_loop_lag
 
 # Setup logging
 logging.basicConfig(
@@ -15,79 +53,115 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize database
-db = Database()
+# Channels are split across the bot tokens; this process sends for shard SHARD_INDEX
+IS_PRIMARY = SHARD_INDEX == 0
+
+# Initialize storage (SQLite by default, PostgreSQL when DATABASE_URL is set)
+db = open_storage(DATABASE_URL, HashRing(len(BOT_TOKENS)), POSTGRES_POOL_MIN, POSTGRES_POOL_MAX)
+
+# Prepared hot posts for deep links and view_post_ callbacks. Posts are edited through the
+# primary; secondary shards on SQLite don't hear about it, so they re-check the row on every use.
+post_cache = PostCache(db, POST_CACHE_SIZE, revalidate=not IS_PRIMARY and isinstance(db, Database))
+
+# Throttled, cached post search for regular users
+search = SearchService(db, SEARCH_RESULT_LIMIT, SEARCH_RATE, SEARCH_BURST, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+# Inline mode (@bot query): built result pages cached per query and offset
+inline_search = InlineSearch(db, search, post_cache, INLINE_PAGE_SIZE, INLINE_RESULT_CACHE_SIZE, SEARCH_CACHE_TTL)
 
-# User data storage (temporary)
-user_data = {}
+# Per-post view/click/search counters, flushed to the database in the background
+analytics = Analytics(db, ANALYTICS_FLUSH_INTERVAL)
+
+# Per-user conversation state, expiring and optionally persisted
+user_data = SessionStore(SESSION_MAX_USERS, SESSION_TTL, db if SESSION_PERSIST else None)
+
+# Active channels and their groups, kept in memory for the publish picker
+channel_registry = ChannelRegistry(db, CHANNEL_REGISTRY_TTL)
+
+# Concurrent, rate-limited fan-out to channels
+publisher = Publisher(PUBLISH_CONCURRENCY, GLOBAL_SEND_RATE, PER_CHAT_SEND_RATE)
+
+# Failure tracking per channel; dead channels are quarantined and re-checked in the background
+channel_health = ChannelHealth(
+    db, publisher, CHANNEL_QUARANTINE_FAILURES, CHANNEL_PROBE_INTERVAL, CHANNEL_PROBE_MAX_INTERVAL, shard=SHARD_INDEX
+)
+
+# Background worker delivering queued publishes from the outbox
+outbox = OutboxWorker(
+    db, publisher, post_cache,
+    capacity=OUTBOX_CAPACITY, max_attempts=OUTBOX_MAX_ATTEMPTS, poll_interval=OUTBOX_POLL_INTERVAL,
+    shard=SHARD_INDEX, reports=IS_PRIMARY, health=channel_health
+)
+
+# Pushes post edits and deletions to the copies already published to channels
+message_sync = MessageSync(db, publisher, max_attempts=OUTBOX_MAX_ATTEMPTS, poll_interval=OUTBOX_POLL_INTERVAL, shard=SHARD_INDEX)
+
+# Scheduled and recurring publishes, fired into the outbox
+scheduler = Scheduler(db, outbox)
+
+# Async URL shortener (pooled connections, circuit breaker, persistent cache)
+short_url_cache = ShortUrlCache(db, SHORT_URL_CACHE_SIZE, SHORT_URL_CACHE_TTL, SHORT_URL_CACHE_MAX_ENTRIES)
+shortener = Shortener(
+    SHORTENER_API, SHORTENER_URL,
+    timeout=SHORTENER_TIMEOUT, concurrency=SHORTENER_CONCURRENCY, cache=short_url_cache
+)
 
 # Initialize bot
 app = Client(
-    "multi_channel_bot",
+    "multi_channel_bot" if IS_PRIMARY else f"multi_channel_bot_{SHARD_INDEX}",
     api_id=API_ID,
     api_hash=API_HASH,
-    bot_token=BOT_TOKEN
+    bot_token=BOT_TOKENS[SHARD_INDEX],
+    workers=WORKERS,
+    # Secondary shards only send; the admins talk to the primary bot
+    no_updates=not IS_PRIMARY
 )
 
+# Updates of one user run in order, different users in parallel
+app.dispatcher.updates_queue = UpdateLanes(WORKERS)
+dispatcher = UserDispatcher(DISPATCH_MAX_PENDING)
+
 # ============== HELPER FUNCTIONS ==============
 
-def shorten_url(long_url):
-    """Shorten URL using ShrinkEarn API"""
-    try:
-        encoded_url = quote(long_url)
-        api_url = f"https://shrinkearn.com/api?api={SHORTENER_API}&url={encoded_url}&format=text"
-        response = requests.get(api_url, timeout=10)
-        if response.status_code == 200 and response.text.strip():
-            return response.text.strip()
-        return long_url
-    except Exception as e:
-        logger.error(f"URL shortening failed: {e}")
-        return long_url
+# Known callback_data prefixes, used as a bounded metrics label
+CALLBACK_PREFIXES = (
+    "view_post_", "remove_ch_", "pg_", "delete_post_", "edit_post_", "publish_", "repost_",
+    "toggle_ch_", "pick_", "confirm_publish", "schedule_publish", "cancel_sched_", "save_only"
+)
+
+
+def callback_route(client, callback_query):
+    data = callback_query.data or ''
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix
+    return 'other'
 
 def is_admin(user_id):
     """Check if user is admin"""
     return user_id in ADMINS
 
+def append_lines(text, lines, limit=3500):
+    """Append whole lines while the text stays under `limit`, then note how many were left out.
+
+    The limit leaves room below Telegram's 4096 characters for headers and footers.
+    """
+    for i, line in enumerate(lines):
+        if len(text) + len(line) > limit:
+            return text + f"…and {len(lines) - i} more.\n"
+        text += line
+    return text
+
 async def send_post_to_user(client, user_id, post_id):
     """Sends a specific post to a user."""
-    post = db.get_post(post_id)
+    post = await post_cache.get(post_id)
     if not post:
         await client.send_message(user_id, "❌ Post not found.")
         return
 
-    content, media_type, media_file_id, buttons_json = post
-    buttons = json.loads(buttons_json) if buttons_json else []
-
-    keyboard = []
-    for btn in buttons:
-        keyboard.append([InlineKeyboardButton(btn['text'], url=btn['url'])])
-    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
-
     try:
-        if media_type == 'photo':
-            await client.send_photo(
-                chat_id=user_id,
-                photo=media_file_id,
-                caption=content,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reply_markup
-            )
-        elif media_type == 'video':
-            await client.send_video(
-                chat_id=user_id,
-                video=media_file_id,
-                caption=content,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reply_markup
-            )
-        else:
-            await client.send_message(
-                chat_id=user_id,
-                text=content,
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=reply_markup,
-                disable_web_page_preview=True
-            )
+        await send_post(client, user_id, post)
+        analytics.record(post_id, 'views')
     except Exception as e:
         logger.error(f"Failed to send post {post_id} to user {user_id}: {e}")
         await client.send_message(user_id, f"❌ An error occurred while fetching the post: {e}")
@@ -96,16 +170,23 @@ async def send_post_to_user(client, user_id, post_id):
 # ============== START & HELP COMMANDS ==============
 
 @app.on_message(filters.command("start") & filters.private)
+@dispatcher.serialized
+@instrument_handler("start_command")
 async def start_command(client, message: Message):
     user_id = message.from_user.id
 
-    # Deep linking for posts
-    if len(message.command) > 1:
-        post_id = message.command[1].replace('post_', '')
+    # Deep linking for posts (other start parameters, e.g. from inline mode, show the welcome)
+    param = message.command[1] if len(message.command) > 1 else ''
+    if param.startswith('post_') or param.isdigit():
+        post_id = param.replace('post_', '')
         await send_post_to_user(client, user_id, post_id)
         return
+    await send_welcome(message)
+
 
-    if is_admin(user_id):
+async def send_welcome(message):
+    """Reply with the command list (the admin one for admins); shared by /start and /help"""
+    if is_admin(message.from_user.id):
         welcome_text = """
 🤖 **Welcome Admin!**
 
@@ -117,10 +198,19 @@ This is your control panel for the Multi-Channel Post Bot.
 /listposts - View all saved posts
 /deletepost - Delete a post
 /repost - Repost from saved posts
+/schedules - View or cancel scheduled posts
+/export posts|channels - Download as JSONL
+/import posts|channels - Reply to a JSONL file to import it
 
 /addchannel - Add a channel/group
 /listchannels - View all channels
 /removechannel - Remove a channel
+/channelhealth - Show failing and quarantined channels
+/groups - Manage channel groups for one-tap selection
+
+/stats - Show latency and error metrics
+/cachestats - Show cache hit/miss counters
+/topposts - Show the most viewed posts
 
 /help - Show this message
         """
@@ -128,7 +218,8 @@ This is your control panel for the Multi-Channel Post Bot.
         welcome_text = """
 👋 **Welcome to the Bot!**
 
-You can search for posts by typing its name directly.
+You can search for posts by typing its name directly,
+or from any chat by typing the bot's @username and a query.
 
 **Available Commands:**
 /help - Show this message
@@ -136,14 +227,18 @@ You can search for posts by typing its name directly.
     await message.reply_text(welcome_text)
 
 @app.on_message(filters.command("help") & filters.private)
+@dispatcher.serialized
+@instrument_handler("help_command")
 async def help_command(client, message: Message):
-    # This is an alias for the start command without arguments
-    await start_command(client, message)
+    # Same text as /start; calling start_command would queue the update a second time
+    await send_welcome(message)
 
 
 # ============== ADMIN: CHANNEL MANAGEMENT ==============
 
 @app.on_message(filters.command("addchannel") & filters.private)
+@dispatcher.serialized
+@instrument_handler("add_channel_command")
 async def add_channel_command(client, message: Message):
     if not is_admin(message.from_user.id):
         await message.reply_text("⛔ You are not authorized for this command.")
@@ -156,9 +251,11 @@ async def add_channel_command(client, message: Message):
 
 
 @app.on_message(filters.command("listchannels") & filters.private)
+@dispatcher.serialized
+@instrument_handler("list_channels_command")
 async def list_channels_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    channels = db.get_all_channels()
+    channels = await db.aio.get_all_channels()
     if not channels:
         await message.reply_text("📭 No channels added yet.")
         return
@@ -169,9 +266,11 @@ async def list_channels_command(client, message: Message):
 
 
 @app.on_message(filters.command("removechannel") & filters.private)
+@dispatcher.serialized
+@instrument_handler("remove_channel_command")
 async def remove_channel_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    channels = db.get_all_channels()
+    channels = await db.aio.get_all_channels()
     if not channels:
         await message.reply_text("📭 No channels to remove.")
         return
@@ -181,14 +280,88 @@ async def remove_channel_command(client, message: Message):
     await message.reply_text("Select a channel to remove:", reply_markup=InlineKeyboardMarkup(buttons))
 
 
+@app.on_message(filters.command("channelhealth") & filters.private)
+@dispatcher.serialized
+@instrument_handler("channel_health_command")
+async def channel_health_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    total, unhealthy = await db.aio.get_channel_health()
+    quarantined = [row for row in unhealthy if row[5] is not None]
+    failing = [row for row in unhealthy if row[5] is None]
+    text = (
+        "🩺 **Channel Health**\n\n"
+        f"✅ {total - len(unhealthy)} healthy · ⚠️ {len(failing)} failing · 🚫 {len(quarantined)} quarantined\n"
+    )
+    if quarantined:
+        text += "\n🚫 **Quarantined** (skipped when publishing):\n"
+        text = append_lines(text, [
+            f"• {name} (`{channel_id}`): {error}, since {format_time(since)}, next check {format_time(next_probe)}\n"
+            for channel_id, name, failures, error, last_success, since, next_probe in quarantined
+        ])
+        text += "Re-add a channel with /addchannel to lift its quarantine right away.\n"
+    if failing:
+        text += "\n⚠️ **Failing:**\n"
+        text = append_lines(text, [
+            f"• {name} (`{channel_id}`): {failures} failure(s) in a row, last {error}, "
+            f"last success {format_time(last_success) if last_success else 'never'}\n"
+            for channel_id, name, failures, error, last_success, *_ in failing
+        ])
+    await message.reply_text(text)
+
+
+# Group names end up in callback_data, which Telegram caps at 64 bytes
+GROUP_NAME = re.compile(r'[A-Za-z0-9_-]{1,32}')
+
+
+@app.on_message(filters.command("groups") & filters.private)
+@dispatcher.serialized
+@instrument_handler("groups_command")
+async def groups_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    sizes = {}
+    for name, _ in await db.aio.get_channel_groups():
+        sizes[name] = sizes.get(name, 0) + 1
+    text = "👥 **Channel Groups**\n\n" if sizes else "📭 No channel groups yet.\n\n"
+    for name, size in sizes.items():
+        text += f"• `{name}`: {size} channel(s)\n"
+    text += (
+        "\n`/group name channel_id ...` adds channels to a group.\n"
+        "`/ungroup name [channel_id ...]` removes channels, or the whole group."
+    )
+    await message.reply_text(text[:4096])
+
+
+@app.on_message(filters.command(["group", "ungroup"]) & filters.private)
+@dispatcher.serialized
+@instrument_handler("group_command")
+async def group_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    command, *args = message.command
+    if not args or not GROUP_NAME.fullmatch(args[0]) or (command == "group" and len(args) < 2):
+        await message.reply_text(
+            f"Usage: `/{command} name {'channel_id ...' if command == 'group' else '[channel_id ...]'}`\n"
+            "Group names are up to 32 letters, digits, `_` or `-`."
+        )
+        return
+    name, channel_ids = args[0], args[1:]
+    if command == "group":
+        added = await db.aio.add_to_channel_group(name, channel_ids)
+        await message.reply_text(f"✅ Added {added} channel(s) to `{name}`. Unknown or already grouped ids are skipped.")
+    else:
+        removed = await db.aio.remove_from_channel_group(name, channel_ids or None)
+        await message.reply_text(f"✅ Removed {removed} channel(s) from `{name}`.")
+
+
 # ============== ADMIN: POST MANAGEMENT ==============
 
 @app.on_message(filters.command("newpost") & filters.private)
+@dispatcher.serialized
+@instrument_handler("new_post_command")
 async def new_post_command(client, message: Message):
     if not is_admin(message.from_user.id): return
     await message.reply_text(
         "📝 **Creating New Post**\n\n"
-        "Send me your post content with optional media (photo/video). "
+        "Send me your post content with optional media (photo/video, or an album of them). "
         "You can use Telegram's built-in tools for **formatting**.\n\n"
         "After that, send buttons in this format:\n"
         "`Button Text | URL`\n\n"
@@ -199,53 +372,124 @@ async def new_post_command(client, message: Message):
     user_data[message.from_user.id] = {'state': 'creating_post', 'post_data': {}}
 
 
+# Paginated post pickers: (title, empty text, button icon, button callback prefix)
+POST_PICKERS = {
+    'list': ("📝 **Your Saved Posts:**", "📭 No posts saved yet.", None, None),
+    'del': ("Select a post to delete:", "📭 No posts to delete.", "🗑", "delete_post_"),
+    'rep': ("Select a post to repost:", "📭 No posts to repost.", "📤", "repost_"),
+    'edit': ("Select a post to edit:", "📭 No posts to edit.", "✏️", "edit_post_"),
+}
+
+
+async def render_posts_page(action, cursor=None, forward=True):
+    """Build (text, reply_markup) for one keyset page of a post picker, or (None, None) if it is empty."""
+    title_text, _, icon, callback_prefix = POST_PICKERS[action]
+    posts, has_prev, has_next = await db.aio.get_posts_page(POSTS_PAGE_SIZE, cursor, forward)
+    if not posts:
+        return None, None
+
+    if callback_prefix is None:
+        text = title_text + "\n\n"
+        for post_id, title, created_at in posts:
+            text += f"• **Post #{post_id}**: {title}\n  *Created*: {created_at}\n\n"
+        buttons = []
+    else:
+        text = title_text
+        buttons = [[InlineKeyboardButton(f"{icon} {title}", callback_data=f"{callback_prefix}{post_id}")] for post_id, title, _ in posts]
+
+    # Page cursors carry the (created_at, id) keyset of the first/last row shown
+    nav = []
+    if has_prev:
+        post_id, _, created_at = posts[0]
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pg_{action}_p_{post_id}_{created_at}"))
+    if has_next:
+        post_id, _, created_at = posts[-1]
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"pg_{action}_n_{post_id}_{created_at}"))
+    if nav:
+        buttons.append(nav)
+    return text, InlineKeyboardMarkup(buttons) if buttons else None
+
+
+async def show_posts_picker(message, action):
+    text, reply_markup = await render_posts_page(action)
+    if text is None:
+        await message.reply_text(POST_PICKERS[action][1])
+        return
+    await message.reply_text(text, reply_markup=reply_markup)
+
+
+def render_channel_picker(channels, selection):
+    """Build the reply_markup of the publish picker: one page of channels, the groups and select all."""
+    selected = set(selection['selected'])
+    pages = max(1, -(-len(channels.ids) // CHANNEL_PICKER_PAGE_SIZE))
+    page = min(selection.get('page', 0), pages - 1)
+    start = page * CHANNEL_PICKER_PAGE_SIZE
+    buttons = []
+    for channel_id in channels.ids[start:start + CHANNEL_PICKER_PAGE_SIZE]:
+        status = "✅" if channel_id in selected else "🔲"
+        buttons.append([InlineKeyboardButton(f"{status} {channels.names[channel_id]}", callback_data=f"toggle_ch_{channel_id}")])
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pick_page_{page - 1}"))
+        nav.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"pick_page_{page}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"pick_page_{page + 1}"))
+        buttons.append(nav)
+
+    # Tapping a group selects all of its channels, or clears them if they all are selected
+    group_buttons = [
+        InlineKeyboardButton(f"{'✅' if selected.issuperset(members) else '👥'} {name} ({len(members)})",
+                             callback_data=f"pick_group_{name}")
+        for name, members in channels.groups.items()
+    ]
+    buttons.extend(group_buttons[i:i + 2] for i in range(0, len(group_buttons), 2))
+    select_row = [InlineKeyboardButton(f"☑️ Select all ({len(channels.ids)})", callback_data="pick_all")]
+    if selected:
+        select_row.append(InlineKeyboardButton("✖️ Clear", callback_data="pick_none"))
+    buttons.append(select_row)
+    buttons.append([
+        InlineKeyboardButton(f"✅ Publish to {len(selected)} Selected", callback_data="confirm_publish"),
+        InlineKeyboardButton("⏰ Schedule", callback_data="schedule_publish")
+    ])
+    return InlineKeyboardMarkup(buttons)
+
+
 @app.on_message(filters.command("listposts") & filters.private)
+@dispatcher.serialized
+@instrument_handler("list_posts_command")
 async def list_posts_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    posts = db.get_all_posts()
-    if not posts:
-        await message.reply_text("📭 No posts saved yet.")
-        return
-    text = "📝 **Your Saved Posts:**\n\n"
-    for post_id, title, created_at in posts:
-        text += f"• **Post #{post_id}**: {title}\n  *Created*: {created_at}\n\n"
-    await message.reply_text(text)
+    await show_posts_picker(message, 'list')
 
 
 @app.on_message(filters.command("deletepost") & filters.private)
+@dispatcher.serialized
+@instrument_handler("delete_post_command")
 async def delete_post_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    posts = db.get_all_posts()
-    if not posts:
-        await message.reply_text("📭 No posts to delete.")
-        return
-    buttons = [[InlineKeyboardButton(f"🗑 {title}", callback_data=f"delete_post_{post_id}")] for post_id, title, _ in posts]
-    await message.reply_text("Select a post to delete:", reply_markup=InlineKeyboardMarkup(buttons))
+    await show_posts_picker(message, 'del')
 
 
 @app.on_message(filters.command("repost") & filters.private)
+@dispatcher.serialized
+@instrument_handler("repost_command")
 async def repost_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    posts = db.get_all_posts()
-    if not posts:
-        await message.reply_text("📭 No posts to repost.")
-        return
-    buttons = [[InlineKeyboardButton(f"📤 {title}", callback_data=f"repost_{post_id}")] for post_id, title, _ in posts]
-    await message.reply_text("Select a post to repost:", reply_markup=InlineKeyboardMarkup(buttons))
+    await show_posts_picker(message, 'rep')
 
 
 @app.on_message(filters.command("editpost") & filters.private)
+@dispatcher.serialized
+@instrument_handler("edit_post_command")
 async def edit_post_command(client, message: Message):
     if not is_admin(message.from_user.id): return
-    posts = db.get_all_posts()
-    if not posts:
-        await message.reply_text("📭 No posts to edit.")
-        return
-    buttons = [[InlineKeyboardButton(f"✏️ {title}", callback_data=f"edit_post_{post_id}")] for post_id, title, _ in posts]
-    await message.reply_text("Select a post to edit:", reply_markup=InlineKeyboardMarkup(buttons))
+    await show_posts_picker(message, 'edit')
 
 
 @app.on_message(filters.command("done") & filters.private)
+@dispatcher.serialized
+@instrument_handler("done_command")
 async def done_command(client, message: Message):
     user_id = message.from_user.id
     if not is_admin(user_id): return
@@ -260,7 +504,7 @@ async def done_command(client, message: Message):
     title = (post_data.get('content') or "Untitled Post")[:50]
 
     if state == 'creating_post':
-        post_id = db.add_post(
+        post_id = await db.aio.add_post(
             title,
             post_data.get('content', ''),
             post_data.get('media_type'),
@@ -282,15 +526,17 @@ async def done_command(client, message: Message):
 
     elif state == 'editing_post':
         post_id = user_data[user_id]['post_id']
-        db.update_post(
+        published = await db.aio.update_post(
             post_id, title,
             post_data.get('content', ''),
             post_data.get('media_type'),
             post_data.get('media_file_id'),
             post_data.get('buttons', [])
         )
+        message_sync.wake()
+        synced = f"\n🔄 Updating {published} published message(s) in channels." if published else ""
         await message.reply_text(
-            f"✅ Post #{post_id} updated successfully!",
+            f"✅ Post #{post_id} updated successfully!{synced}",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("📤 Repost Now", callback_data=f"repost_{post_id}")]
             ])
@@ -299,12 +545,196 @@ async def done_command(client, message: Message):
     user_data.pop(user_id, None)
 
 
+# ============== ADMIN: BULK IMPORT/EXPORT ==============
+
+async def run_with_progress(status, label, func, *args, **kwargs):
+    """Run a blocking bulk job in a thread, showing its progress in `status` every few seconds."""
+    progress = {'count': 0}
+    task = asyncio.create_task(asyncio.to_thread(func, *args, progress=lambda n: progress.update(count=n), **kwargs))
+    shown = 0
+    while not task.done():
+        await asyncio.wait({task}, timeout=3)
+        if not task.done() and progress['count'] != shown:
+            shown = progress['count']
+            try:
+                await status.edit_text(f"⏳ {label}... {shown} so far")
+            except Exception as e:
+                logger.debug(f"Progress update failed: {e}")
+    return task.result()
+
+
+@app.on_message(filters.command("export") & filters.private)
+@dispatcher.serialized
+@instrument_handler("export_command")
+async def export_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    kind = message.command[1] if len(message.command) > 1 else None
+    if kind not in KINDS:
+        await message.reply_text("Usage: `/export posts` or `/export channels`")
+        return
+    if not isinstance(db, Database):
+        await message.reply_text("ℹ️ Bulk import/export works with the SQLite storage only; use pg_dump or COPY with PostgreSQL.")
+        return
+
+    status = await message.reply_text(f"⏳ Exporting {kind}...")
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, f"{kind}.jsonl")
+        count = await run_with_progress(status, f"Exporting {kind}", export_jsonl, db, kind, path)
+        await message.reply_document(path, caption=f"✅ Exported {count} {kind}.")
+    await status.delete()
+
+
+@app.on_message(filters.command("import") & filters.private)
+@dispatcher.serialized
+@instrument_handler("import_command")
+async def import_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    kind = message.command[1] if len(message.command) > 1 else None
+    document = message.reply_to_message.document if message.reply_to_message else None
+    if kind not in KINDS or document is None:
+        await message.reply_text("Usage: reply to a `.jsonl` file with `/import posts` or `/import channels`")
+        return
+    if not isinstance(db, Database):
+        await message.reply_text("ℹ️ Bulk import/export works with the SQLite storage only; use pg_dump or COPY with PostgreSQL.")
+        return
+
+    # Sending /import again for the same file continues after its last committed chunk
+    source = f"{kind}:{document.file_unique_id}"
+    if (await db.aio.get_import_progress(source))[1]:
+        await message.reply_text("ℹ️ This file was already imported.")
+        return
+
+    status = await message.reply_text(f"⏳ Importing {kind}...")
+    with tempfile.TemporaryDirectory() as workdir:
+        path = await client.download_media(document.file_id, file_name=os.path.join(workdir, f"{kind}.jsonl"))
+        try:
+            count = await run_with_progress(
+                status, f"Importing {kind}", import_jsonl, db, kind, path, BULK_CHUNK_SIZE, source=source
+            )
+        except ValueError as e:
+            await status.edit_text(f"❌ Import stopped: {e}\n\nRows before the failing chunk were saved.")
+            return
+    await status.edit_text(f"✅ Imported {count} {kind}.")
+
+
+# ============== ADMIN: SCHEDULES ==============
+
+@app.on_message(filters.command("schedules") & filters.private)
+@dispatcher.serialized
+@instrument_handler("schedules_command")
+async def schedules_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    schedules = await db.aio.list_schedules()
+    if not schedules:
+        await message.reply_text("📭 No scheduled posts.")
+        return
+    text = "⏰ **Scheduled Posts:**\n\n"
+    buttons = []
+    for schedule_id, post_id, title, next_run_at, interval, channel_count in schedules:
+        repeat = f", every {interval // 60} min" if interval else ""
+        text += f"• **#{schedule_id}** Post #{post_id}: {title}\n  *Next*: {format_time(next_run_at)}{repeat} → {channel_count} channel(s)\n\n"
+        buttons.append([InlineKeyboardButton(f"❌ Cancel #{schedule_id}", callback_data=f"cancel_sched_{schedule_id}")])
+    await message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+
+
+# ============== ADMIN: STATS ==============
+
+@app.on_message(filters.command("cachestats") & filters.private)
+@dispatcher.serialized
+@instrument_handler("cache_stats_command")
+async def cache_stats_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    url_stats = short_url_cache.stats()
+    lookups = url_stats['memory_hits'] + url_stats['db_hits'] + url_stats['misses']
+    hit_rate = (lookups - url_stats['misses']) / lookups * 100 if lookups else 0
+    post_stats = post_cache.stats()
+    search_stats = search.stats()
+    inline_stats = inline_search.stats()
+    await message.reply_text(
+        "📊 **Cache Stats**\n\n"
+        f"**Short URLs:** {url_stats['memory_hits']} memory hits, {url_stats['db_hits']} DB hits, "
+        f"{url_stats['misses']} misses ({hit_rate:.0f}% hit rate, {url_stats['memory_size']} in memory)\n"
+        f"**Posts:** {post_stats['hits']} hits, {post_stats['misses']} misses "
+        f"({post_stats['hit_rate'] * 100:.0f}% hit rate, {post_stats['size']}/{post_stats['maxsize']} cached)\n"
+        f"**Searches:** {search_stats['hits']} hits, {search_stats['misses']} misses "
+        f"({search_stats['hit_rate'] * 100:.0f}% hit rate, {search_stats['size']} queries cached)\n"
+        f"**Inline pages:** {inline_stats['hits']} hits, {inline_stats['misses']} misses "
+        f"({inline_stats['hit_rate'] * 100:.0f}% hit rate, {inline_stats['size']} pages cached)"
+    )
+
+
+@app.on_message(filters.command("topposts") & filters.private)
+@dispatcher.serialized
+@instrument_handler("top_posts_command")
+async def top_posts_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    top = await db.aio.get_top_posts(10)
+    if not top:
+        await message.reply_text("📭 No post views recorded yet.")
+        return
+    text = f"🏆 **Top Posts** (views · clicks · search appearances, up to {ANALYTICS_FLUSH_INTERVAL}s behind)\n\n"
+    for post_id, title, views, clicks, searches in top:
+        text += f"• **#{post_id}** {title}: {views} · {clicks} · {searches}\n"
+    await message.reply_text(text)
+
+
+def format_ms(seconds):
+    return "∞" if seconds == float('inf') else f"{seconds * 1000:.1f} ms"
+
+
+@app.on_message(filters.command("stats") & filters.private)
+@dispatcher.serialized
+@instrument_handler("stats_command")
+async def stats_command(client, message: Message):
+    if not is_admin(message.from_user.id): return
+    text = "📈 **Bot Stats** (count · mean · p95)\n\n**Handlers:**\n"
+    for (handler, route), (count, mean, p95) in sorted(metrics.HANDLER_SECONDS.summary().items()):
+        name = f"{handler}/{route}" if route else handler
+        text += f"• {name}: {count} · {format_ms(mean)} · ≤{format_ms(p95)}\n"
+
+    db_stats = sorted(metrics.DB_QUERY_SECONDS.summary().items(), key=lambda item: -item[1][1])[:5]
+    if db_stats:
+        text += "\n**Slowest DB methods:**\n"
+        for (method,), (count, mean, p95) in db_stats:
+            text += f"• {method}: {count} · {format_ms(mean)} · ≤{format_ms(p95)}\n"
+
+    sends = metrics.TELEGRAM_SEND_SECONDS.summary_all()
+    send_errors = sum(v for (_, result), v in metrics.TELEGRAM_SENDS.items().items() if result == 'error')
+    text += (
+        f"\n**Telegram sends:** {sends[0]} · {format_ms(sends[1])} · ≤{format_ms(sends[2])}, "
+        f"{send_errors} errors, {metrics.FLOOD_WAITS.total()} FloodWaits\n"
+    )
+    top_floods = sorted(metrics.FLOOD_WAITS.items().items(), key=lambda item: -item[1])[:3]
+    if top_floods:
+        text += "  Most FloodWaits: " + ", ".join(f"`{chat_id}` ({n})" for (chat_id,), n in top_floods) + "\n"
+    slowest_chats = sorted(metrics.TELEGRAM_SEND_SECONDS.summary().items(), key=lambda item: -item[1][1])[:3]
+    if len(slowest_chats) > 1:
+        text += "  Slowest chats: " + ", ".join(f"`{chat_id}` ({format_ms(mean)})" for (chat_id,), (_, mean, _) in slowest_chats) + "\n"
+
+    shortener_calls = metrics.SHORTENER_SECONDS.summary().get((), (0, 0.0, 0.0))
+    shortener_total = metrics.SHORTENER_REQUESTS.total()
+    shortener_errors = metrics.SHORTENER_REQUESTS.value(result='error')
+    error_rate = shortener_errors / shortener_total * 100 if shortener_total else 0
+    text += (
+        f"**Shortener:** {shortener_calls[0]} · {format_ms(shortener_calls[1])} · ≤{format_ms(shortener_calls[2])}, "
+        f"{error_rate:.0f}% errors, {metrics.SHORTENER_REQUESTS.value(result='circuit_open')} skipped by circuit breaker\n"
+    )
+
+    lag = metrics.LOOP_LAG.summary().get((), (0, 0.0, 0.0))
+    text += f"**Event loop lag:** now {format_ms(metrics.LOOP_LAG_SECONDS.value())}, p95 ≤{format_ms(lag[2])}"
+    await message.reply_text(text[:4096])
+
+
 # ============== MESSAGE HANDLER ==============
 
 @app.on_message(filters.private & ~filters.command([
     "start", "help", "addchannel", "listchannels", "removechannel",
-    "newpost", "listposts", "deletepost", "repost", "editpost", "done"
+    "newpost", "listposts", "deletepost", "repost", "editpost", "done",
+    "cachestats", "schedules", "stats", "export", "import", "topposts", "channelhealth",
+    "groups", "group", "ungroup"
 ]))
+@dispatcher.serialized
+@instrument_handler("handle_messages")
 async def handle_messages(client, message: Message):
     user_id = message.from_user.id
 
@@ -327,16 +757,36 @@ async def handle_messages(client, message: Message):
                     await message.reply_text(f"❌ Invalid channel ID or I don't have access. Error: {e}")
                     return
 
-            db.add_channel(channel_id, channel_name)
+            await db.aio.add_channel(channel_id, channel_name)
             await message.reply_text(f"✅ Channel **{channel_name}** (`{channel_id}`) added successfully!")
             user_data.pop(user_id, None)
             return
 
+        # Admin entering a schedule time
+        if user_data[user_id].get('state') == 'scheduling':
+            try:
+                run_at, interval = parse_schedule(message.text or '')
+            except ValueError as e:
+                await message.reply_text(f"❌ {e}")
+                return
+            schedule = user_data.pop(user_id)['schedule']
+            schedule_id = await scheduler.add(schedule['post_id'], schedule['selected'], run_at, interval, user_id)
+            repeat = f", then every {interval // 60} min" if interval else ""
+            await message.reply_text(
+                f"✅ Post #{schedule['post_id']} scheduled as **Schedule #{schedule_id}** "
+                f"for {format_time(run_at)}{repeat}.\nUse /schedules to view or cancel."
+            )
+            return
+
         # Admin creating/editing a post
         state = user_data[user_id].get('state')
         if state in ['creating_post', 'editing_post']:
             post_data = user_data[user_id]['post_data']
 
+            # The rest of an album that was already captured as a whole
+            if message.media_group_id and message.media_group_id == post_data.get('media_group_id'):
+                return
+
             # Capture content and media
             if not post_data.get('content_set'):
                 # MODIFICATION: Use message.text.markdown to preserve formatting
@@ -347,7 +797,22 @@ async def handle_messages(client, message: Message):
                 else:
                     post_data['content'] = ""
 
-                if message.photo:
+                if message.media_group_id:
+                    # Telegram delivers an album as one message per item; fetch them all at once
+                    media, caption = [], None
+                    for item in await client.get_media_group(message.chat.id, message.id):
+                        if item.photo:
+                            media.append(['photo', item.photo.file_id])
+                        elif item.video:
+                            media.append(['video', item.video.file_id])
+                        if item.caption and caption is None:
+                            caption = item.caption.markdown
+                    post_data['content'] = caption or ""
+                    if media:
+                        post_data['media_type'] = 'album'
+                        post_data['media_file_id'] = media
+                    post_data['media_group_id'] = message.media_group_id
+                elif message.photo:
                     post_data['media_type'] = 'photo'
                     post_data['media_file_id'] = message.photo.file_id
                 elif message.video:
@@ -355,6 +820,7 @@ async def handle_messages(client, message: Message):
                     post_data['media_file_id'] = message.video.file_id
 
                 post_data['content_set'] = True
+                user_data.save(user_id)
                 await message.reply_text(
                     "✅ Content saved! Now send buttons (one per line) in `Text | URL` format, or /done to finish."
                 )
@@ -363,44 +829,77 @@ async def handle_messages(client, message: Message):
                 if message.text: # Ensure there is text to process
                     lines = message.text.strip().split('\n')
                     buttons = post_data.get('buttons', [])
-                    new_buttons = 0
+                    parsed = []
                     for line in lines:
                         if '|' in line:
                             parts = line.split('|', 1)
-                            btn_text = parts[0].strip()
-                            btn_url = parts[1].strip()
-                            
-                            # MODIFICATION: Conditional URL Shortening
-                            if btn_url.endswith('{url}'):
-                                url_to_shorten = btn_url[:-5] # Remove {url}
-                                final_url = shorten_url(url_to_shorten)
-                            else:
-                                final_url = btn_url
-
-                            buttons.append({'text': btn_text, 'url': final_url})
-                            new_buttons += 1
+                            parsed.append((parts[0].strip(), parts[1].strip()))
+
+                    # MODIFICATION: Conditional URL Shortening, all {url} lines at once
+                    to_shorten = [btn_url[:-5] for _, btn_url in parsed if btn_url.endswith('{url}')]
+                    short_urls = await shortener.shorten_many(to_shorten) if to_shorten else {}
+
+                    for btn_text, btn_url in parsed:
+                        if btn_url.endswith('{url}'):
+                            final_url = short_urls[btn_url[:-5]] # Remove {url}
+                        else:
+                            final_url = btn_url
+                        buttons.append({'text': btn_text, 'url': final_url})
+                    new_buttons = len(parsed)
 
                     post_data['buttons'] = buttons
+                    user_data.save(user_id)
                     await message.reply_text(f"✅ Added {new_buttons} button(s)! Send more or use /done.")
         return
 
     # If user is not in a specific state, treat as a search query for non-admins
     if not is_admin(user_id):
         if message.text:
-            query = message.text
-            results = db.search_posts(query)
+            wait = search.throttle(user_id)
+            if wait:
+                if search.should_notify(user_id, wait):
+                    await message.reply_text(f"⏳ You're searching too fast. Please wait {max(1, round(wait))}s and try again.")
+                return
+            results = await search.search(message.text)
             if not results:
                 await message.reply_text("😕 No results found for your query.")
             else:
+                analytics.record_many([post_id for post_id, _ in results], 'searches')
                 buttons = [[InlineKeyboardButton(title, callback_data=f"view_post_{post_id}")] for post_id, title in results]
                 await message.reply_text("🔎 **Here are the search results:**", reply_markup=InlineKeyboardMarkup(buttons))
         else:
             await message.reply_text("Please use text to search for posts, or /help for more information.")
 
 
-# ============== CALLBACK HANDLERS ==============
+# ============== INLINE QUERIES ==============
+
+@app.on_inline_query()
+@instrument_handler("inline_query")
+async def handle_inline_query(client, inline_query: InlineQuery):
+    # Not serialized per user: every keystroke is a new, independent query
+    query = inline_query.query.strip()
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+    if not query:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME, switch_pm_text="Type to search posts", switch_pm_parameter="inline")
+        return
+
+    page = inline_search.cached(query, offset)
+    if page is None:
+        # Only queries that reach the database count against the user's search budget
+        if search.throttle(inline_query.from_user.id):
+            await inline_query.answer([], cache_time=0, is_personal=True)
+            return
+        page = await inline_search.build(query, offset)
+    results, next_offset = page
+    analytics.record_many([result.id for result in results], 'searches')
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
 
 @app.on_callback_query()
+@dispatcher.serialized
+@instrument_handler("handle_callback_queries", route=callback_route)
 async def handle_callback_queries(client, callback_query: CallbackQuery):
     data = callback_query.data
     user_id = callback_query.from_user.id
@@ -408,6 +907,7 @@ async def handle_callback_queries(client, callback_query: CallbackQuery):
     # User viewing a search result
     if data.startswith("view_post_"):
         post_id = data.split('_')[2]
+        analytics.record(post_id, 'clicks')
         await send_post_to_user(client, user_id, post_id)
         await callback_query.answer()
         return
@@ -420,21 +920,35 @@ async def handle_callback_queries(client, callback_query: CallbackQuery):
     # Channel Removal
     if data.startswith("remove_ch_"):
         channel_id = data.replace('remove_ch_', '')
-        db.remove_channel(channel_id)
+        await db.aio.remove_channel(channel_id)
         await callback_query.answer("✅ Channel removed!", show_alert=True)
         await callback_query.message.edit_text("✅ Channel removed successfully!")
 
+    # Post picker pagination
+    elif data.startswith("pg_"):
+        _, action, direction, post_id, created_at = data.split('_', 4)
+        text, reply_markup = await render_posts_page(action, (created_at, int(post_id)), direction == 'n')
+        if text is None:
+            # The neighbouring page was emptied by deletions; start over from the newest posts
+            text, reply_markup = await render_posts_page(action)
+        if text is None:
+            await callback_query.message.edit_text(POST_PICKERS[action][1])
+        else:
+            await callback_query.message.edit_text(text, reply_markup=reply_markup)
+
     # Post Deletion
     elif data.startswith("delete_post_"):
         post_id = data.replace('delete_post_', '')
-        db.delete_post(post_id)
+        published = await db.aio.delete_post(post_id)
+        message_sync.wake()
         await callback_query.answer("✅ Post deleted!", show_alert=True)
-        await callback_query.message.edit_text("✅ Post deleted successfully!")
+        synced = f"\n🗑 Removing {published} published message(s) from channels." if published else ""
+        await callback_query.message.edit_text(f"✅ Post deleted successfully!{synced}")
 
     # Edit Post Selection
     elif data.startswith("edit_post_"):
         post_id = data.replace('edit_post_', '')
-        post = db.get_post(post_id)
+        post = await db.aio.get_post(post_id)
         if not post:
             await callback_query.answer("❌ Post not found!", show_alert=True)
             return
@@ -462,42 +976,54 @@ async def handle_callback_queries(client, callback_query: CallbackQuery):
     # Publish/Repost - Step 1: Show channel list
     elif data.startswith("publish_") or data.startswith("repost_"):
         post_id = data.split('_')[1]
-        channels = db.get_all_channels()
-        if not channels:
-            await callback_query.answer("❌ No channels added!", show_alert=True)
+        channels = await channel_registry.get()
+        if not channels.ids:
+            await callback_query.answer("❌ No channels available! See /channelhealth.", show_alert=True)
             return
 
-        user_data[user_id] = {'selecting_channels': {'post_id': post_id, 'selected': []}}
-
-        buttons = []
-        for channel_id, channel_name in channels:
-            buttons.append([InlineKeyboardButton(f"🔲 {channel_name}", callback_data=f"toggle_ch_{channel_id}")])
-        buttons.append([InlineKeyboardButton("✅ Publish to Selected", callback_data="confirm_publish")])
+        selection_data = {'post_id': post_id, 'selected': [], 'page': 0}
+        user_data[user_id] = {'selecting_channels': selection_data}
 
         await callback_query.message.edit_text(
             f"**Select channels to publish Post #{post_id} to:**",
-            reply_markup=InlineKeyboardMarkup(buttons)
+            reply_markup=render_channel_picker(channels, selection_data)
         )
 
-    # Publish/Repost - Step 2: Toggle channel selection
-    elif data.startswith("toggle_ch_"):
-        channel_id = data.replace('toggle_ch_', '')
+    # Publish/Repost - Step 2: Toggle channels one by one, by group or all at once
+    elif data.startswith(("toggle_ch_", "pick_")):
         if user_id in user_data and 'selecting_channels' in user_data[user_id]:
             selection_data = user_data[user_id]['selecting_channels']
             selected_channels = selection_data['selected']
+            # Served from memory: a tap costs one page of buttons whatever the channel count
+            channels = await channel_registry.get()
 
-            if channel_id in selected_channels:
-                selected_channels.remove(channel_id)
-            else:
-                selected_channels.append(channel_id)
-
-            buttons = []
-            for cid, cname in db.get_all_channels():
-                status = "✅" if str(cid) in selected_channels else "🔲"
-                buttons.append([InlineKeyboardButton(f"{status} {cname}", callback_data=f"toggle_ch_{cid}")])
-            buttons.append([InlineKeyboardButton("✅ Publish to Selected", callback_data="confirm_publish")])
-
-            await callback_query.message.edit_reply_markup(InlineKeyboardMarkup(buttons))
+            if data.startswith("toggle_ch_"):
+                channel_id = data.replace('toggle_ch_', '')
+                if channel_id in selected_channels:
+                    selected_channels.remove(channel_id)
+                else:
+                    selected_channels.append(channel_id)
+            elif data.startswith("pick_page_"):
+                selection_data['page'] = int(data.replace('pick_page_', ''))
+            elif data.startswith("pick_group_"):
+                members = channels.groups.get(data.replace('pick_group_', ''), ())
+                chosen = set(selected_channels)
+                if chosen.issuperset(members):
+                    members = set(members)
+                    selection_data['selected'] = [cid for cid in selected_channels if cid not in members]
+                else:
+                    selected_channels.extend(cid for cid in members if cid not in chosen)
+            elif data == "pick_all":
+                selection_data['selected'] = list(channels.ids)
+            elif data == "pick_none":
+                selection_data['selected'] = []
+            user_data.save(user_id)
+
+            try:
+                await callback_query.message.edit_reply_markup(render_channel_picker(channels, selection_data))
+            except MessageNotModified:
+                # e.g. the page counter, or a group whose channels were all quarantined
+                await callback_query.answer()
         else:
             await callback_query.answer("Session expired. Please start over.", show_alert=True)
 
@@ -513,38 +1039,51 @@ async def handle_callback_queries(client, callback_query: CallbackQuery):
                 await callback_query.answer("⚠️ Please select at least one channel!", show_alert=True)
                 return
 
-            post = db.get_post(post_id)
+            post = await post_cache.get(post_id)
             if not post:
                 await callback_query.answer("❌ Post not found!", show_alert=True)
                 return
+            user_data.pop(user_id, None)
 
-            content, media_type, media_file_id, buttons_json = post
-            buttons = json.loads(buttons_json) if buttons_json else []
-            keyboard = [[InlineKeyboardButton(b['text'], url=b['url'])] for b in buttons]
-            reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+            await callback_query.message.edit_text(
+                f"🚀 **Publishing to {len(selected_channels)} channel(s)...**\n\n"
+                "This message will show the report when it's done."
+            )
 
-            success_count = 0
-            await callback_query.message.edit_text("🚀 **Publishing...**")
+            # Queue one delivery per channel; the outbox worker sends them in the background
+            await db.aio.enqueue_publish(
+                post.post_id, selected_channels,
+                callback_query.message.chat.id, callback_query.message.id
+            )
+            outbox.wake()
+        else:
+            await callback_query.answer("Session expired. Please start over.", show_alert=True)
 
-            for channel_id in selected_channels:
-                try:
-                    if media_type == 'photo':
-                        await client.send_photo(int(channel_id), media_file_id, caption=content, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-                    elif media_type == 'video':
-                        await client.send_video(int(channel_id), media_file_id, caption=content, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-                    else:
-                        await client.send_message(int(channel_id), content, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-                    success_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to post to {channel_id}: {e}")
 
+    # Publish/Repost - Step 3 (alternative): Schedule for later
+    elif data == "schedule_publish":
+        if user_id in user_data and 'selecting_channels' in user_data[user_id]:
+            selection_data = user_data[user_id]['selecting_channels']
+            if not selection_data['selected']:
+                await callback_query.answer("⚠️ Please select at least one channel!", show_alert=True)
+                return
+            user_data[user_id] = {'state': 'scheduling', 'schedule': selection_data}
             await callback_query.message.edit_text(
-                f"✅ **Published!**\n\nPosted to {success_count}/{len(selected_channels)} selected channels."
+                f"⏰ **Scheduling Post #{selection_data['post_id']}** to {len(selection_data['selected'])} channel(s)\n\n"
+                "Send the time (UTC) as `YYYY-MM-DD HH:MM`.\n"
+                "To repeat, add an interval, e.g. `2025-01-31 18:00 every 6h` (units: m, h, d)."
             )
-            user_data.pop(user_id, None)
         else:
             await callback_query.answer("Session expired. Please start over.", show_alert=True)
 
+    # Cancel a schedule
+    elif data.startswith("cancel_sched_"):
+        schedule_id = int(data.replace('cancel_sched_', ''))
+        if await db.aio.cancel_schedule(schedule_id):
+            await callback_query.answer("✅ Schedule cancelled!", show_alert=True)
+            await callback_query.message.edit_text(f"✅ Schedule #{schedule_id} cancelled.")
+        else:
+            await callback_query.answer("❌ Schedule not found!", show_alert=True)
 
     # Save Only
     elif data == "save_only":
@@ -557,6 +1096,38 @@ async def handle_callback_queries(client, callback_query: CallbackQuery):
 
 # ============== RUN BOT ==============
 
+async def main():
+    await db.start()
+    await app.start()
+    outbox.start(app)
+    message_sync.start(app)
+    channel_health.start(app)
+    if IS_PRIMARY:
+        await scheduler.start()
+        await user_data.load()
+        user_data.start()
+        analytics.start()
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    # Each shard serves metrics on its own port
+    metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT + SHARD_INDEX) if METRICS_PORT else None
+    if metrics_server:
+        await metrics_server.start()
+    print(f"🤖 Bot started successfully! (shard {SHARD_INDEX + 1}/{len(BOT_TOKENS)})")
+    await idle()
+    await dispatcher.join(timeout=10)
+    if metrics_server:
+        await metrics_server.stop()
+    lag_monitor.cancel()
+    await scheduler.stop()
+    await outbox.stop()
+    await message_sync.stop()
+    await channel_health.stop()
+    await user_data.stop()
+    await analytics.stop()
+    await shortener.close()
+    await app.stop()
+    await db.stop()
+
+
 if __name__ == "__main__":
-    print("🤖 Bot started successfully!")
-    app.run()
+    app.run(main())
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from post_cache import prepare_post
+from publisher import edit_sent_post
+
+logger = logging.getLogger(__name__)
+
+# Telegram deletes at most 100 messages per call
+DELETE_BATCH = 100
+
+
+class MessageSync:
+    """Background worker that pushes post edits and deletions to the published copies.
+
+    Database.update_post and delete_post queue every ledger row of the post;
+    this worker claims them in batches, edits each message or deletes them
+    with one delete_messages call per chat, all through the shared Publisher
+    so the sends stay within the rate limits. Failures are retried with
+    backoff up to `max_attempts`, then given up.
+    """
+
+    def __init__(self, db, publisher, batch_size=200, max_attempts=5, base_delay=5, max_delay=600,
+                 poll_interval=5, shard=0):
+        self.db = db
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.shard = shard
+        self.client = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Tell the worker that edits or deletions were queued."""
+        self._wake.set()
+
+    async def _run(self):
+        resumed = await self.db.aio.reset_stale_message_syncs(self.shard)
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted message edits/deletions")
+        while True:
+            try:
+                self._wake.clear()
+                rows = await self.db.aio.claim_message_syncs(self.batch_size, time.time(), self.shard)
+                if rows:
+                    await self._apply(rows)
+                    continue
+                timeout = self.poll_interval
+                next_due = await self.db.aio.next_message_sync_due(self.shard)
+                if next_due is not None:
+                    timeout = min(timeout, max(0.0, next_due - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Message sync error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _apply(self, rows):
+        posts, deletes, tasks = {}, defaultdict(list), []
+        for row in rows:
+            row_id, post_id, chat_id, message_id, part, pending, attempts = row
+            if pending == 'deleting':
+                deletes[chat_id].append(row)
+                continue
+            if post_id not in posts:
+                # Read the post fresh: other shards' post caches don't see this process's edits
+                post_row = await self.db.aio.get_post(post_id)
+                posts[post_id] = await prepare_post(post_id, post_row) if post_row else None
+            if posts[post_id] is not None:
+                tasks.append(self._edit(row, posts[post_id]))
+            else:
+                # Deleted meanwhile; its delete is queued separately
+                await self.db.aio.finish_message_syncs([row_id])
+        for chat_rows in deletes.values():
+            for i in range(0, len(chat_rows), DELETE_BATCH):
+                tasks.append(self._delete(chat_rows[i:i + DELETE_BATCH]))
+        await asyncio.gather(*tasks)
+
+    async def _edit(self, row, post):
+        row_id, _, chat_id, message_id, part, _, _ = row
+        try:
+            await self.publisher.call(int(chat_id), edit_sent_post, self.client, int(chat_id), message_id, part, post)
+        except Exception as e:
+            await self._failed([row], f"edit {message_id} in {chat_id}", e)
+            return
+        await self.db.aio.finish_message_syncs([row_id])
+
+    async def _delete(self, rows):
+        chat_id = int(rows[0][2])
+        try:
+            await self.publisher.call(chat_id, self.client.delete_messages, chat_id, [row[3] for row in rows])
+        except Exception as e:
+            await self._failed(rows, f"delete {len(rows)} message(s) in {chat_id}", e)
+            return
+        await self.db.aio.finish_message_syncs([row[0] for row in rows])
+
+    async def _failed(self, rows, action, error):
+        attempts = max(row[6] for row in rows)
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up on {action} after {attempts} attempts: {error}")
+            await self.db.aio.finish_message_syncs([row[0] for row in rows])
+            return
+        logger.warning(f"Failed to {action} (attempt {attempts}): {error}")
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        await self.db.aio.retry_message_syncs([row[0] for row in rows], time.time() + delay)
@@ -0,0 +1,241 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def items(self):
+        """{label values: count} snapshot."""
+        with self._lock:
+            return dict(self._values)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (non-cumulative) counts plus +Inf, then sum and count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _summarize(self, counts, total, count):
+        if not count:
+            return 0, 0.0, 0.0
+        target, seen, p95 = count * 0.95, 0, float('inf')
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            seen += n
+            if seen >= target:
+                p95 = bound
+                break
+        return count, total / count, p95
+
+    def summary(self):
+        """{label values: (count, mean, approximate p95)} for the /stats command."""
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        return {key: self._summarize(counts, total, count) for key, counts, total, count in items}
+
+    def summary_all(self):
+        """(count, mean, approximate p95) over every label value."""
+        counts, total, count = [0] * (len(self.buckets) + 1), 0.0, 0
+        with self._lock:
+            for key_counts, key_total, key_count in self._values.values():
+                counts = [a + b for a, b in zip(counts, key_counts)]
+                total += key_total
+                count += key_count
+        return self._summarize(counts, total, count)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', repr(float(bound)))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+REGISTRY = []
+
+HANDLER_SECONDS = Histogram('bot_handler_seconds', "Time spent in update handlers", ['handler', 'route'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', "Unhandled exceptions in update handlers", ['handler', 'route'])
+DB_QUERY_SECONDS = Histogram('bot_db_query_seconds', "Database method execution time", ['method'])
+TELEGRAM_SEND_SECONDS = Histogram('bot_telegram_send_seconds', "Latency of Telegram send calls per chat", ['chat_id'])
+TELEGRAM_SENDS = Counter('bot_telegram_sends_total', "Telegram send attempts per chat", ['chat_id', 'result'])
+FLOOD_WAITS = Counter('bot_telegram_flood_waits_total', "FloodWait errors per chat", ['chat_id'])
+SHORTENER_SECONDS = Histogram('bot_shortener_request_seconds', "ShrinkEarn request latency")
+SHORTENER_REQUESTS = Counter('bot_shortener_requests_total', "ShrinkEarn requests by result", ['result'])
+DISPATCH_DROPPED = Counter('bot_dispatch_dropped_total', "Updates dropped by the per-user dispatcher", ['reason'])
+SEARCH_REQUESTS = Counter('bot_search_requests_total', "User searches by outcome", ['result'])
+LOOP_LAG_SECONDS = Gauge('bot_event_loop_lag_seconds', "Most recent event-loop scheduling lag")
+LOOP_LAG = Histogram('bot_event_loop_lag_histogram_seconds', "Event-loop scheduling lag")
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def instrument_handler(name, route=None):
+    """Record latency and errors of an async handler; `route(*args)` labels sub-routes."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            label = route(*args) if route is not None else ''
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name, route=label)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name, route=label)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval=1.0):
+    """Measure how late the event loop wakes a sleeping task."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        LOOP_LAG_SECONDS.set(lag)
+        LOOP_LAG.observe(lag)
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the registry in Prometheus text format at /metrics."""
+
+    def __init__(self, host='127.0.0.1', port=9464):
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Drain the request headers
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                body, status = render().encode(), '200 OK'
+            else:
+                body, status = b'Not Found\n', '404 Not Found'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
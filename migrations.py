@@ -0,0 +1,235 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# Databases created before versioning start at user_version 0 with any part of
+# the schema below already in place, so migrations 1-10 only add what is missing.
+
+def create_posts_and_channels(conn):
+    """Create the posts and channels tables"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS posts
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     title TEXT,
+                     content TEXT,
+                     media_type TEXT,
+                     media_file_id TEXT,
+                     buttons TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS channels
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     channel_id TEXT UNIQUE,
+                     channel_name TEXT,
+                     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+
+def index_posts_and_channels(conn):
+    """Index posts by creation time and channels by name"""
+    # Newest-first post lists and keyset pages walk this index instead of sorting
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts (created_at, id)")
+    # Covers the sorted channel list used by the pickers
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_channels_name ON channels (channel_name, channel_id)")
+
+
+def create_short_urls(conn):
+    """Create the shortened URL cache"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS short_urls
+                    (long_url TEXT PRIMARY KEY,
+                     short_url TEXT,
+                     created_at REAL,
+                     last_used REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_short_urls_last_used ON short_urls (last_used)")
+
+
+def create_outbox(conn):
+    """Create the publish outbox: jobs and their per-channel deliveries"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS publish_jobs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     post_id INTEGER,
+                     status_chat_id INTEGER,
+                     status_message_id INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     finished_at TIMESTAMP,
+                     reported INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS deliveries
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     job_id INTEGER,
+                     post_id INTEGER,
+                     channel_id TEXT,
+                     status TEXT DEFAULT 'pending',
+                     attempts INTEGER DEFAULT 0,
+                     next_attempt_at REAL,
+                     last_error TEXT,
+                     message_id INTEGER,
+                     shard INTEGER DEFAULT 0,
+                     post_change TEXT,
+                     UNIQUE (job_id, channel_id))''')
+    # Columns added for multi-token sharding
+    if 'reported' not in _columns(conn, 'publish_jobs'):
+        conn.execute("ALTER TABLE publish_jobs ADD COLUMN reported INTEGER DEFAULT 0")
+        conn.execute("UPDATE publish_jobs SET reported = 1 WHERE finished_at IS NOT NULL")
+    if 'shard' not in _columns(conn, 'deliveries'):
+        conn.execute("ALTER TABLE deliveries ADD COLUMN shard INTEGER DEFAULT 0")
+    # 'edit' or 'delete' of the post while the copy is being sent, queued once it is recorded as sent
+    if 'post_change' not in _columns(conn, 'deliveries'):
+        conn.execute("ALTER TABLE deliveries ADD COLUMN post_change TEXT")
+    conn.execute("DROP INDEX IF EXISTS idx_deliveries_due")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_shard_due ON deliveries (shard, status, next_attempt_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_publish_jobs_unreported ON publish_jobs (id) WHERE reported = 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_sending ON deliveries (post_id) WHERE status = 'sending'")
+
+
+def create_published_messages(conn):
+    """Create the ledger of messages published to channels"""
+    # `pending` is 'edit'/'delete' while queued and 'editing'/'deleting' while in flight
+    conn.execute('''CREATE TABLE IF NOT EXISTS published_messages
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     post_id INTEGER,
+                     chat_id TEXT,
+                     message_id INTEGER,
+                     part TEXT,
+                     shard INTEGER DEFAULT 0,
+                     pending TEXT,
+                     attempts INTEGER DEFAULT 0,
+                     next_attempt_at REAL,
+                     sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_published_messages_post ON published_messages (post_id)")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_published_messages_pending ON published_messages (shard, next_attempt_at)
+                    WHERE pending IN ('edit', 'delete')""")
+
+
+def create_bulk_imports(conn):
+    """Create the resume points of bulk JSONL imports"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS bulk_imports
+                    (source TEXT PRIMARY KEY,
+                     lines_done INTEGER,
+                     finished INTEGER DEFAULT 0,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+
+def create_sessions(conn):
+    """Create the persisted conversation sessions"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                    (user_id INTEGER PRIMARY KEY,
+                     data TEXT,
+                     expires_at REAL)''')
+
+
+def create_post_stats(conn):
+    """Create the aggregated per-post analytics counters"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS post_stats
+                    (post_id INTEGER PRIMARY KEY,
+                     views INTEGER DEFAULT 0,
+                     clicks INTEGER DEFAULT 0,
+                     searches INTEGER DEFAULT 0,
+                     updated_at REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_post_stats_views ON post_stats (views)")
+
+
+def create_schedules(conn):
+    """Create the scheduled (one-off or recurring) publishes"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS schedules
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     post_id INTEGER,
+                     channel_ids TEXT,
+                     next_run_at REAL,
+                     interval_seconds INTEGER,
+                     created_by INTEGER,
+                     active INTEGER DEFAULT 1,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_active ON schedules (active, next_run_at)")
+
+
+def create_posts_fts(conn):
+    """Create the full-text index over posts, kept in sync by triggers"""
+    fts_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone() is not None
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts
+                    USING fts5(title, content, content='posts', content_rowid='id',
+                               tokenize='unicode61 remove_diacritics 2')''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+                      INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+                      INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF title, content ON posts BEGIN
+                      INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+                      INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+                    END''')
+    if not fts_exists:
+        # Backfill posts created before the index existed
+        conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+
+
+def add_channel_health(conn):
+    """Track channel health: consecutive failures, last error, last success and quarantine"""
+    for column in ("failures INTEGER DEFAULT 0", "last_error_class TEXT", "last_success_at REAL",
+                   "quarantined_at REAL", "next_probe_at REAL"):
+        conn.execute(f"ALTER TABLE channels ADD COLUMN {column}")
+    conn.execute("CREATE INDEX idx_channels_probe ON channels (next_probe_at) WHERE quarantined_at IS NOT NULL")
+
+
+def create_channel_groups(conn):
+    """Create the named channel groups used to select many channels at once"""
+    conn.execute('''CREATE TABLE channel_groups
+                    (name TEXT,
+                     channel_id TEXT,
+                     PRIMARY KEY (name, channel_id))''')
+    # Removing a channel drops its memberships
+    conn.execute("CREATE INDEX idx_channel_groups_channel ON channel_groups (channel_id)")
+
+
+# Applied in order; the schema version is the number applied. Only ever append.
+MIGRATIONS = [
+    create_posts_and_channels,
+    index_posts_and_channels,
+    create_short_urls,
+    create_outbox,
+    create_published_messages,
+    create_bulk_imports,
+    create_sessions,
+    create_post_stats,
+    create_schedules,
+    create_posts_fts,
+    add_channel_health,
+    create_channel_groups,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply the pending migrations, each in its own transaction; returns the schema version.
+
+    A current database costs one PRAGMA read. Migrations run under a write
+    lock and re-check the version, so processes starting together (one per
+    shard) apply each migration once.
+    """
+    latest = len(MIGRATIONS)
+    version = schema_version(conn)
+    if version > latest:
+        raise RuntimeError(f"Database schema version {version} is newer than this code supports ({latest})")
+    while version < latest:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            version = schema_version(conn)
+            if version >= latest:
+                conn.commit()
+                break
+            migration = MIGRATIONS[version]
+            migration(conn)
+            version += 1
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        logger.info(f"Applied schema migration {version}: {migration.__doc__}")
+    return version
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import random
+import time
+from publisher import DeliveryResult, send_post, format_report
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxWorker:
+    """Background worker that drains the persistent deliveries outbox.
+
+    Each delivery is claimed atomically, sent through the rate-limited
+    Publisher and marked sent with its message id, so after a restart only
+    deliveries that were never confirmed are attempted again. Failed sends
+    are retried with exponential backoff up to `max_attempts`.
+
+    With several bot tokens each process runs a worker for its own `shard`
+    of the deliveries; only the worker with `reports` (the bot the admins
+    talk to) sends the publish reports, whichever shard finished the job.
+
+    With a ChannelHealth, failed sends count against the channel's health
+    and deliveries to quarantined channels fail at once without an API call.
+    """
+
+    def __init__(self, db, publisher, post_cache, capacity=50, max_attempts=5,
+                 base_delay=5, max_delay=600, poll_interval=5, shard=0, reports=True, health=None):
+        self.db = db
+        self.publisher = publisher
+        self.post_cache = post_cache
+        self.capacity = capacity
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.shard = shard
+        self.reports = reports
+        self.health = health
+        self.client = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self, client):
+        self.client = client
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Tell the worker new deliveries were enqueued."""
+        self._wake.set()
+
+    def retry_delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _run(self):
+        resumed = await self.db.aio.reset_stale_deliveries(self.shard)
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted deliveries")
+        in_flight = set()
+        while True:
+            try:
+                self._wake.clear()
+                if self.reports:
+                    # Jobs finished by the other shards
+                    await self._send_reports()
+                free = self.capacity - len(in_flight)
+                if free > 0:
+                    for row in await self.db.aio.claim_deliveries(free, time.time(), self.shard):
+                        in_flight.add(asyncio.create_task(self._deliver(*row)))
+
+                if len(in_flight) >= self.capacity:
+                    timeout = None
+                else:
+                    timeout = self.poll_interval
+                    next_due = await self.db.aio.next_delivery_due(self.shard)
+                    if next_due is not None:
+                        timeout = min(timeout, max(0.0, next_due - time.time()))
+
+                wake = asyncio.create_task(self._wake.wait())
+                try:
+                    done, _ = await asyncio.wait(in_flight | {wake}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    wake.cancel()
+                in_flight -= done
+                for task in done:
+                    if task is not wake and not task.cancelled() and task.exception():
+                        logger.error(f"Delivery task failed: {task.exception()}")
+            except asyncio.CancelledError:
+                for task in in_flight:
+                    task.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _deliver(self, delivery_id, job_id, post_id, channel_id, attempts, quarantine_error):
+        try:
+            await self._attempt(delivery_id, post_id, channel_id, attempts, quarantine_error)
+        except Exception as e:
+            # A cache, database or health bookkeeping error before the send: put the delivery
+            # back in the queue instead of leaving it 'sending' until the next restart
+            error = str(e) or type(e).__name__
+            logger.error(f"Delivery {delivery_id} to {channel_id} failed unexpectedly: {error}")
+            await self.db.aio.mark_delivery_failed(delivery_id, error, self._retry_at(attempts))
+
+        if await self.db.aio.finish_job(job_id) and self.reports:
+            await self._send_reports()
+
+    def _retry_at(self, attempts):
+        return time.time() + self.retry_delay(attempts) if attempts < self.max_attempts else None
+
+    async def _attempt(self, delivery_id, post_id, channel_id, attempts, quarantine_error):
+        post = await self.post_cache.get(post_id)
+        if post is None:
+            await self.db.aio.mark_delivery_failed(delivery_id, "Post was deleted")
+        elif quarantine_error is not None:
+            await self.db.aio.mark_delivery_failed(delivery_id, f"Channel is quarantined ({quarantine_error})")
+        else:
+            chat_id = int(channel_id)
+            try:
+                sent, _ = await self.publisher.call(chat_id, send_post, self.client, chat_id, post)
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                quarantined = self.health is not None and await self.health.record_failure(channel_id, e)
+                logger.error(f"Failed to post to {channel_id} (attempt {attempts}): {error}")
+                await self.db.aio.mark_delivery_failed(delivery_id, error, None if quarantined else self._retry_at(attempts))
+                return
+            await self._record_sent(delivery_id, channel_id, [(part, message.id) for part, message in sent])
+
+    async def _record_sent(self, delivery_id, channel_id, parts):
+        """Mark a delivery sent, retrying the database update until it succeeds.
+
+        The post is already in the channel, so a failure here must never put
+        the delivery back in the queue: that would send it a second time.
+        """
+        attempts = 0
+        while True:
+            try:
+                await self.db.aio.mark_delivery_sent(delivery_id, parts[0][1], parts)
+                return
+            except Exception as e:
+                attempts += 1
+                logger.error(f"Failed to record delivery {delivery_id} to {channel_id} as sent (attempt {attempts}): {e}")
+                await asyncio.sleep(self.retry_delay(attempts))
+
+    async def _send_reports(self):
+        for job_id in await self.db.aio.claim_job_reports():
+            await self._report(job_id)
+
+    async def _report(self, job_id):
+        """Replace the admin's "Publishing..." message with the per-channel report.
+
+        Scheduled jobs have no status message, so the report is sent as a new one.
+        """
+        job = await self.db.aio.get_job(job_id)
+        if job is None or job[1] is None:
+            return
+        _, status_chat_id, status_message_id = job
+        rows = await self.db.aio.get_job_deliveries(job_id)
+        results = [DeliveryResult(channel_id, status == 'sent', error, attempts)
+                   for channel_id, _, status, error, attempts in rows]
+        channel_names = {channel_id: name for channel_id, name, *_ in rows if name}
+        try:
+            if status_message_id is None:
+                await self.client.send_message(status_chat_id, format_report(results, channel_names))
+            else:
+                await self.client.edit_message_text(status_chat_id, status_message_id, format_report(results, channel_names))
+        except Exception as e:
+            logger.error(f"Failed to send publish report for job {job_id}: {e}")
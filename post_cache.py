@@ -0,0 +1,89 @@
+import json
+from collections import namedtuple
+from pyrogram.enums import ParseMode
+from pyrogram.parser import Parser
+from pyrogram.raw.types import InputMessageEntityMentionName
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, MessageEntity
+from cache import LRUCache
+
+# A post ready to be sent: parsed buttons already turned into a reply_markup, the
+# markdown content compiled into plain text + entities to send with `parse_mode`,
+# and for albums media_file_id holds the list of (media_type, file_id) items
+PreparedPost = namedtuple('PreparedPost', 'post_id content media_type media_file_id reply_markup text entities parse_mode')
+
+# Markdown needs no client; user mentions are the exception and are left to the sender
+_parser = Parser(None)
+
+
+def build_keyboard(buttons):
+    keyboard = [[InlineKeyboardButton(btn['text'], url=btn['url'])] for btn in buttons]
+    return InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+async def parse_markdown(content):
+    """Compile markdown once into (text, entities, parse_mode) for sends.
+
+    A user mention (tg://user?id=N) needs a peer resolved by the client that
+    sends it, so content with one is kept as markdown for each send to parse.
+    """
+    parsed = await _parser.parse(content, ParseMode.MARKDOWN)
+    raw_entities = parsed['entities'] or []
+    if any(isinstance(entity, InputMessageEntityMentionName) for entity in raw_entities):
+        return content, None, ParseMode.MARKDOWN
+    entities = [MessageEntity._parse(None, entity, {}) for entity in raw_entities]
+    return parsed['message'], [entity for entity in entities if entity is not None] or None, ParseMode.DISABLED
+
+
+async def prepare_post(post_id, row):
+    content, media_type, media_file_id, buttons_json = row
+    buttons = json.loads(buttons_json) if buttons_json else []
+    if media_type == 'album':
+        media_file_id = [tuple(item) for item in json.loads(media_file_id)]
+    text, entities, parse_mode = await parse_markdown(content)
+    return PreparedPost(post_id, content, media_type, media_file_id, build_keyboard(buttons), text, entities, parse_mode)
+
+
+class PostCache:
+    """Bounded LRU of prepared posts so hot posts are served without DB access or JSON parsing.
+
+    Edits and deletes invalidate it through `db.on_post_change`, which only
+    fires in the process that made them. A process that can't hear those
+    (a secondary shard on SQLite) uses `revalidate`: every get re-reads the
+    row and keeps the prepared post only while the row is unchanged.
+    """
+
+    def __init__(self, db, maxsize=500, revalidate=False):
+        self.db = db
+        self.cache = LRUCache(maxsize)
+        self.revalidate = revalidate
+        self._generation = 0
+        db.on_post_change(self.invalidate)
+
+    async def get(self, post_id):
+        """Return the PreparedPost for `post_id`, or None if it does not exist."""
+        try:
+            post_id = int(post_id)
+        except (TypeError, ValueError):
+            return None
+        cached = self.cache.get(post_id)
+        if cached is not None and not self.revalidate:
+            return cached[1]
+        generation = self._generation
+        row = await self.db.aio.get_post(post_id)
+        if row is None:
+            self.cache.pop(post_id)
+            return None
+        if cached is not None and cached[0] == row:
+            return cached[1]
+        post = await prepare_post(post_id, row)
+        # Don't cache a row that was read before a concurrent update or delete
+        if generation == self._generation:
+            self.cache.set(post_id, (row, post))
+        return post
+
+    def invalidate(self, post_id):
+        self._generation += 1
+        self.cache.pop(int(post_id))
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,664 @@
+import functools
+import json
+import logging
+import re
+import time
+import asyncpg
+from database import encode_media
+from metrics import DB_QUERY_SECONDS
+from storage import SHORT_URL_SLACK, Storage
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock held while migrating, so concurrent starts migrate once
+MIGRATION_LOCK = 7405528
+
+# SQLite's CURRENT_TIMESTAMP: UTC, whole seconds
+NOW_UTC = "(now() AT TIME ZONE 'utc')::timestamp(0)"
+
+# Applied in order; the schema version is the number applied. Only ever append.
+MIGRATIONS = [
+    f"""
+    CREATE TABLE posts
+        (id BIGSERIAL PRIMARY KEY,
+         title TEXT,
+         content TEXT,
+         media_type TEXT,
+         media_file_id TEXT,
+         buttons TEXT,
+         created_at TIMESTAMP(0) DEFAULT {NOW_UTC},
+         search tsvector GENERATED ALWAYS AS (
+             setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+             setweight(to_tsvector('simple', coalesce(content, '')), 'B')) STORED);
+    CREATE INDEX idx_posts_created_at_id ON posts (created_at, id);
+    CREATE INDEX idx_posts_search ON posts USING GIN (search);
+
+    CREATE TABLE channels
+        (id BIGSERIAL PRIMARY KEY,
+         channel_id TEXT UNIQUE,
+         channel_name TEXT,
+         added_at TIMESTAMP(0) DEFAULT {NOW_UTC});
+    CREATE INDEX idx_channels_name ON channels (channel_name, channel_id);
+
+    CREATE TABLE short_urls
+        (long_url TEXT PRIMARY KEY,
+         short_url TEXT,
+         created_at DOUBLE PRECISION,
+         last_used DOUBLE PRECISION);
+    CREATE INDEX idx_short_urls_last_used ON short_urls (last_used);
+
+    CREATE TABLE publish_jobs
+        (id BIGSERIAL PRIMARY KEY,
+         post_id BIGINT,
+         status_chat_id BIGINT,
+         status_message_id BIGINT,
+         created_at TIMESTAMP(0) DEFAULT {NOW_UTC},
+         finished_at TIMESTAMP(0),
+         reported INTEGER DEFAULT 0);
+    CREATE INDEX idx_publish_jobs_unreported ON publish_jobs (id) WHERE reported = 0;
+    CREATE TABLE deliveries
+        (id BIGSERIAL PRIMARY KEY,
+         job_id BIGINT,
+         post_id BIGINT,
+         channel_id TEXT,
+         status TEXT DEFAULT 'pending',
+         attempts INTEGER DEFAULT 0,
+         next_attempt_at DOUBLE PRECISION,
+         last_error TEXT,
+         message_id BIGINT,
+         shard INTEGER DEFAULT 0,
+         post_change TEXT,
+         UNIQUE (job_id, channel_id));
+    CREATE INDEX idx_deliveries_shard_due ON deliveries (shard, status, next_attempt_at);
+    CREATE INDEX idx_deliveries_sending ON deliveries (post_id) WHERE status = 'sending';
+
+    CREATE TABLE published_messages
+        (id BIGSERIAL PRIMARY KEY,
+         post_id BIGINT,
+         chat_id TEXT,
+         message_id BIGINT,
+         part TEXT,
+         shard INTEGER DEFAULT 0,
+         pending TEXT,
+         attempts INTEGER DEFAULT 0,
+         next_attempt_at DOUBLE PRECISION,
+         sent_at TIMESTAMP(0) DEFAULT {NOW_UTC});
+    CREATE INDEX idx_published_messages_post ON published_messages (post_id);
+    CREATE INDEX idx_published_messages_pending ON published_messages (shard, next_attempt_at)
+        WHERE pending IN ('edit', 'delete');
+
+    CREATE TABLE sessions
+        (user_id BIGINT PRIMARY KEY,
+         data TEXT,
+         expires_at DOUBLE PRECISION);
+
+    CREATE TABLE post_stats
+        (post_id BIGINT PRIMARY KEY,
+         views BIGINT DEFAULT 0,
+         clicks BIGINT DEFAULT 0,
+         searches BIGINT DEFAULT 0,
+         updated_at DOUBLE PRECISION);
+    CREATE INDEX idx_post_stats_views ON post_stats (views);
+
+    CREATE TABLE schedules
+        (id BIGSERIAL PRIMARY KEY,
+         post_id BIGINT,
+         channel_ids TEXT,
+         next_run_at DOUBLE PRECISION,
+         interval_seconds INTEGER,
+         created_by BIGINT,
+         active INTEGER DEFAULT 1,
+         created_at TIMESTAMP(0) DEFAULT {NOW_UTC});
+    CREATE INDEX idx_schedules_active ON schedules (active, next_run_at);
+    """,
+    """
+    ALTER TABLE channels
+        ADD COLUMN failures INTEGER DEFAULT 0,
+        ADD COLUMN last_error_class TEXT,
+        ADD COLUMN last_success_at DOUBLE PRECISION,
+        ADD COLUMN quarantined_at DOUBLE PRECISION,
+        ADD COLUMN next_probe_at DOUBLE PRECISION;
+    CREATE INDEX idx_channels_probe ON channels (next_probe_at) WHERE quarantined_at IS NOT NULL;
+    """,
+    """
+    CREATE TABLE channel_groups
+        (name TEXT,
+         channel_id TEXT,
+         PRIMARY KEY (name, channel_id));
+    CREATE INDEX idx_channel_groups_channel ON channel_groups (channel_id);
+    """,
+]
+
+
+def ts_query(text, max_terms=8):
+    """Turn free text into a tsquery that prefix-matches every word (the Postgres twin of fts_query)."""
+    terms = re.findall(r'\w+', text.lower())[:max_terms]
+    return ' & '.join(f"'{term}':*" for term in terms)
+
+
+def _rows(records):
+    return [tuple(record) for record in records]
+
+
+def _row(record):
+    return tuple(record) if record is not None else None
+
+
+def _rowcount(status):
+    """Rows affected, from a command status such as 'UPDATE 3'."""
+    return int(status.split()[-1])
+
+
+def timed(func):
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        with DB_QUERY_SECONDS.time(method=func.__name__):
+            return await func(self, *args, **kwargs)
+    return wrapper
+
+
+class PostgresDatabase(Storage):
+    """PostgreSQL storage on an asyncpg connection pool, for processes on several hosts sharing state.
+
+    Methods mirror database.Database but are coroutines, so the object is its
+    own `aio`. asyncpg prepares each statement once per pooled connection and
+    reuses it. Claims use FOR UPDATE SKIP LOCKED, so processes never take the
+    same rows. Post and channel changes are broadcast with NOTIFY, which keeps
+    the post, search and channel caches of every process fresh. Bulk JSONL import/export (bulk.py)
+    streams through the SQLite backend only.
+    """
+
+    def __init__(self, dsn, shard_ring=None, min_size=2, max_size=10):
+        super().__init__(shard_ring)
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self._listener = None
+        self.aio = self
+
+    async def start(self):
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            await self._migrate(conn)
+        self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener('post_changed', self._on_post_notify)
+        await self._listener.add_listener('channels_changed', self._on_channels_notify)
+
+    async def stop(self):
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _migrate(self, conn):
+        while True:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+                await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                version = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                if version > len(MIGRATIONS):
+                    raise RuntimeError(f"Database schema version {version} is newer than this code supports ({len(MIGRATIONS)})")
+                if version == len(MIGRATIONS):
+                    return version
+                await conn.execute(MIGRATIONS[version])
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", version + 1)
+            logger.info(f"Applied schema migration {version + 1}")
+
+    def _on_post_notify(self, connection, pid, channel, payload):
+        self._post_changed(int(payload))
+
+    async def _notify_post_changed(self, conn, post_id):
+        # Delivered on commit to every process, including this one
+        await conn.execute("SELECT pg_notify('post_changed', $1)", str(post_id))
+
+    def _on_channels_notify(self, connection, pid, channel, payload):
+        self._channel_changed()
+
+    async def _notify_channels_changed(self, conn):
+        await conn.execute("SELECT pg_notify('channels_changed', '')")
+
+    @timed
+    async def add_post(self, title, content, media_type, media_file_id, buttons):
+        async with self.pool.acquire() as conn, conn.transaction():
+            post_id = await conn.fetchval("""INSERT INTO posts (title, content, media_type, media_file_id, buttons)
+                                             VALUES ($1, $2, $3, $4, $5) RETURNING id""",
+                                          title, content, media_type, encode_media(media_file_id), json.dumps(buttons))
+            await self._notify_post_changed(conn, post_id)
+        self._post_changed(post_id)
+        return post_id
+
+    @timed
+    async def update_post(self, post_id, title, content, media_type, media_file_id, buttons):
+        post_id = int(post_id)
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""UPDATE posts SET title = $1, content = $2, media_type = $3, media_file_id = $4, buttons = $5
+                                  WHERE id = $6""",
+                               title, content, media_type, encode_media(media_file_id), json.dumps(buttons), post_id)
+            status = await conn.execute("""UPDATE published_messages SET pending = 'edit', attempts = 0, next_attempt_at = NULL
+                                           WHERE post_id = $1 AND part != 'album_item'
+                                             AND (pending IS NULL OR pending IN ('edit', 'editing'))""", post_id)
+            await conn.execute("""UPDATE deliveries SET post_change = 'edit'
+                                  WHERE post_id = $1 AND status = 'sending' AND post_change IS NULL""", post_id)
+            await self._notify_post_changed(conn, post_id)
+        self._post_changed(post_id)
+        return _rowcount(status)
+
+    @timed
+    async def get_post(self, post_id):
+        return _row(await self.pool.fetchrow("SELECT content, media_type, media_file_id, buttons FROM posts WHERE id = $1",
+                                             int(post_id)))
+
+    @timed
+    async def get_all_posts(self):
+        return _rows(await self.pool.fetch("SELECT id, title, created_at::text FROM posts ORDER BY created_at DESC, id DESC"))
+
+    @timed
+    async def get_posts_page(self, limit, cursor=None, forward=True):
+        """Keyset page of (id, title, created_at) rows, newest first; see Database.get_posts_page."""
+        if cursor is None:
+            rows = await self.pool.fetch("""SELECT id, title, created_at::text FROM posts
+                                            ORDER BY created_at DESC, id DESC LIMIT $1""", limit + 1)
+        elif forward:
+            rows = await self.pool.fetch("""SELECT id, title, created_at::text FROM posts
+                                            WHERE (created_at, id) < ($1::text::timestamp, $2)
+                                            ORDER BY created_at DESC, id DESC LIMIT $3""",
+                                         cursor[0], int(cursor[1]), limit + 1)
+        else:
+            rows = await self.pool.fetch("""SELECT id, title, created_at::text FROM posts
+                                            WHERE (created_at, id) > ($1::text::timestamp, $2)
+                                            ORDER BY created_at ASC, id ASC LIMIT $3""",
+                                         cursor[0], int(cursor[1]), limit + 1)
+        rows = _rows(rows)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if cursor is None:
+            return rows, False, has_more
+        if forward:
+            return rows, True, has_more
+        return rows[::-1], has_more, True
+
+    @timed
+    async def delete_post(self, post_id):
+        post_id = int(post_id)
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM posts WHERE id = $1", post_id)
+            await conn.execute("DELETE FROM post_stats WHERE post_id = $1", post_id)
+            status = await conn.execute("""UPDATE published_messages SET pending = 'delete', attempts = 0, next_attempt_at = NULL
+                                           WHERE post_id = $1 AND (pending IS NULL OR pending != 'deleting')""", post_id)
+            await conn.execute("UPDATE deliveries SET post_change = 'delete' WHERE post_id = $1 AND status = 'sending'", post_id)
+            await self._notify_post_changed(conn, post_id)
+        self._post_changed(post_id)
+        return _rowcount(status)
+
+    @timed
+    async def search_posts(self, query, limit=20, offset=0):
+        match = ts_query(query)
+        if not match:
+            return []
+        # Title (weight A) matches rank ten times content (weight B) matches, like the SQLite bm25 weights
+        return _rows(await self.pool.fetch("""SELECT id, title FROM posts WHERE search @@ to_tsquery('simple', $1)
+                                              ORDER BY ts_rank('{0.1, 0.1, 0.1, 1.0}', search, to_tsquery('simple', $1)) DESC, id
+                                              LIMIT $2 OFFSET $3""", match, limit, offset))
+
+    @timed
+    async def add_channel(self, channel_id, channel_name):
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""INSERT INTO channels (channel_id, channel_name) VALUES ($1, $2)
+                                  ON CONFLICT (channel_id) DO UPDATE SET channel_name = excluded.channel_name,
+                                    failures = 0, quarantined_at = NULL, next_probe_at = NULL""",
+                               str(channel_id), channel_name)
+            await self._notify_channels_changed(conn)
+        self._channel_changed()
+
+    @timed
+    async def get_all_channels(self):
+        return _rows(await self.pool.fetch("SELECT channel_id, channel_name FROM channels ORDER BY channel_name, channel_id"))
+
+    @timed
+    async def get_active_channels(self):
+        """Channels that are not quarantined, for publishing."""
+        return _rows(await self.pool.fetch("""SELECT channel_id, channel_name FROM channels WHERE quarantined_at IS NULL
+                                              ORDER BY channel_name, channel_id"""))
+
+    @timed
+    async def remove_channel(self, channel_id):
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("DELETE FROM channels WHERE channel_id = $1", str(channel_id))
+            await conn.execute("DELETE FROM channel_groups WHERE channel_id = $1", str(channel_id))
+            await self._notify_channels_changed(conn)
+        self._channel_changed()
+
+    @timed
+    async def get_channel_groups(self):
+        """Every group membership as (group name, channel_id), by group name."""
+        return _rows(await self.pool.fetch("SELECT name, channel_id FROM channel_groups ORDER BY name"))
+
+    @timed
+    async def add_to_channel_group(self, name, channel_ids):
+        """Add known channels to group `name`; returns how many were not in it yet."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            status = await conn.execute("""INSERT INTO channel_groups (name, channel_id)
+                                           SELECT $1, channel_id FROM channels WHERE channel_id = ANY($2::text[])
+                                           ON CONFLICT DO NOTHING""",
+                                        name, [str(channel_id) for channel_id in channel_ids])
+            await self._notify_channels_changed(conn)
+        self._channel_changed()
+        return _rowcount(status)
+
+    @timed
+    async def remove_from_channel_group(self, name, channel_ids=None):
+        """Remove channels from group `name`, or the whole group without `channel_ids`; returns how many."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            if channel_ids is None:
+                status = await conn.execute("DELETE FROM channel_groups WHERE name = $1", name)
+            else:
+                status = await conn.execute("DELETE FROM channel_groups WHERE name = $1 AND channel_id = ANY($2::text[])",
+                                            name, [str(channel_id) for channel_id in channel_ids])
+            await self._notify_channels_changed(conn)
+        self._channel_changed()
+        return _rowcount(status)
+
+    @timed
+    async def get_short_url(self, long_url, ttl):
+        now = time.time()
+        row = await self.pool.fetchrow("SELECT short_url, last_used FROM short_urls WHERE long_url = $1 AND created_at > $2",
+                                       long_url, now - ttl)
+        if row is None:
+            return None
+        # LRU order only needs to be roughly right, so most hits stay read-only
+        if row[1] < now - ttl * SHORT_URL_SLACK:
+            await self.pool.execute("UPDATE short_urls SET last_used = $1 WHERE long_url = $2", now, long_url)
+        return row[0]
+
+    @timed
+    async def save_short_url(self, long_url, short_url, max_entries):
+        now = time.time()
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("""INSERT INTO short_urls (long_url, short_url, created_at, last_used) VALUES ($1, $2, $3, $3)
+                                  ON CONFLICT (long_url) DO UPDATE SET
+                                    short_url = excluded.short_url, created_at = excluded.created_at, last_used = excluded.last_used""",
+                               long_url, short_url, now)
+            # Evict the least recently used entries beyond the size cap
+            if self._short_url_eviction_due(max_entries):
+                await conn.execute("""DELETE FROM short_urls WHERE long_url IN
+                                      (SELECT long_url FROM short_urls ORDER BY last_used DESC OFFSET $1)""", max_entries)
+
+    @timed
+    async def enqueue_publish(self, post_id, channel_ids, status_chat_id=None, status_message_id=None):
+        """Create a publish job with one pending delivery per channel and return its id."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            return await self._enqueue_publish(conn, post_id, channel_ids, status_chat_id, status_message_id)
+
+    async def _enqueue_publish(self, conn, post_id, channel_ids, status_chat_id, status_message_id):
+        post_id = int(post_id)
+        job_id = await conn.fetchval("""INSERT INTO publish_jobs (post_id, status_chat_id, status_message_id)
+                                        VALUES ($1, $2, $3) RETURNING id""", post_id, status_chat_id, status_message_id)
+        now = time.time()
+        await conn.executemany("""INSERT INTO deliveries (job_id, post_id, channel_id, next_attempt_at, shard)
+                                  VALUES ($1, $2, $3, $4, $5) ON CONFLICT DO NOTHING""",
+                               [(job_id, post_id, str(channel_id), now, self.shard_for(channel_id)) for channel_id in channel_ids])
+        return job_id
+
+    @timed
+    async def claim_deliveries(self, limit, now, shard=0):
+        """Atomically mark up to `limit` due deliveries of `shard` as sending and return them.
+
+        The last column is the quarantine error of the channel, None while it is healthy.
+        """
+        return _rows(await self.pool.fetch("""UPDATE deliveries SET status = 'sending', attempts = attempts + 1, post_change = NULL
+                                              WHERE id IN (SELECT id FROM deliveries
+                                                           WHERE shard = $1 AND status = 'pending' AND next_attempt_at <= $2
+                                                           ORDER BY next_attempt_at LIMIT $3 FOR UPDATE SKIP LOCKED)
+                                              RETURNING id, job_id, post_id, channel_id, attempts,
+                                                (SELECT c.last_error_class FROM channels c
+                                                 WHERE c.channel_id = deliveries.channel_id AND c.quarantined_at IS NOT NULL)""",
+                                           shard, now, limit))
+
+    @timed
+    async def next_delivery_due(self, shard=0):
+        return await self.pool.fetchval("SELECT MIN(next_attempt_at) FROM deliveries WHERE shard = $1 AND status = 'pending'",
+                                        shard)
+
+    @timed
+    async def mark_delivery_sent(self, delivery_id, message_id, parts=()):
+        """Mark a delivery sent and record it in the published messages ledger; see Database.mark_delivery_sent."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("UPDATE deliveries SET status = 'sent', message_id = $1, last_error = NULL WHERE id = $2",
+                               message_id, delivery_id)
+            await conn.execute("""UPDATE channels SET failures = 0, last_success_at = $1, quarantined_at = NULL, next_probe_at = NULL
+                                  WHERE channel_id = (SELECT channel_id FROM deliveries WHERE id = $2)""",
+                               time.time(), delivery_id)
+            await conn.executemany("""INSERT INTO published_messages (post_id, chat_id, message_id, part, shard, pending)
+                                      SELECT post_id, channel_id, $1, $2::text, shard,
+                                        CASE WHEN post_change = 'delete' OR (post_change = 'edit' AND $2::text != 'album_item')
+                                             THEN post_change END
+                                      FROM deliveries WHERE id = $3""",
+                                   [(part_message_id, part, delivery_id) for part, part_message_id in parts])
+
+    @timed
+    async def mark_delivery_failed(self, delivery_id, error, retry_at=None):
+        """Record a failed attempt; schedule a retry at `retry_at` or give up if it is None."""
+        if retry_at is None:
+            await self.pool.execute("UPDATE deliveries SET status = 'failed', last_error = $1 WHERE id = $2",
+                                    error, delivery_id)
+        else:
+            await self.pool.execute("UPDATE deliveries SET status = 'pending', last_error = $1, next_attempt_at = $2 WHERE id = $3",
+                                    error, retry_at, delivery_id)
+
+    @timed
+    async def reset_stale_deliveries(self, shard=0):
+        """Return deliveries left 'sending' by a crashed process to the queue."""
+        return _rowcount(await self.pool.execute(
+            "UPDATE deliveries SET status = 'pending' WHERE shard = $1 AND status = 'sending'", shard))
+
+    @timed
+    async def finish_job(self, job_id):
+        """Mark a job finished once none of its deliveries are outstanding; True only for the caller that finished it."""
+        status = await self.pool.execute(f"""UPDATE publish_jobs SET finished_at = {NOW_UTC}
+                                             WHERE id = $1 AND finished_at IS NULL AND NOT EXISTS
+                                               (SELECT 1 FROM deliveries WHERE job_id = $1 AND status IN ('pending', 'sending'))""",
+                                         job_id)
+        return _rowcount(status) == 1
+
+    @timed
+    async def claim_job_reports(self):
+        """Return finished jobs whose report has not been sent yet, marking them reported."""
+        rows = await self.pool.fetch("""UPDATE publish_jobs SET reported = 1
+                                        WHERE reported = 0 AND finished_at IS NOT NULL RETURNING id""")
+        return [row[0] for row in rows]
+
+    @timed
+    async def record_channel_failure(self, channel_id, error_class, permanent, max_failures, now, probe_at):
+        """Count a failed send; see Database.record_channel_failure."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            quarantined_at = await conn.fetchval("""UPDATE channels SET failures = failures + 1, last_error_class = $1,
+                                                     quarantined_at = CASE WHEN quarantined_at IS NULL AND ($2 OR failures + 1 >= $3)
+                                                                           THEN $4 ELSE quarantined_at END,
+                                                     next_probe_at = CASE WHEN quarantined_at IS NULL AND ($2 OR failures + 1 >= $3)
+                                                                          THEN $5 ELSE next_probe_at END
+                                                   WHERE channel_id = $6 RETURNING quarantined_at""",
+                                                error_class, bool(permanent), max_failures, now, probe_at, str(channel_id))
+            if quarantined_at == now:
+                await self._notify_channels_changed(conn)
+        if quarantined_at == now:
+            self._channel_changed()
+        return quarantined_at
+
+    @timed
+    async def get_channels_to_probe(self, now, limit, shard=None):
+        """Quarantined channels of `shard` (every shard if None) due for a re-check, as (channel_id, quarantined_at)."""
+        rows = []
+        async with self.pool.acquire() as conn, conn.transaction():
+            # The ring lives in Python, so page through the due channels until the batch is full
+            async for record in conn.cursor("""SELECT channel_id, quarantined_at FROM channels
+                                               WHERE quarantined_at IS NOT NULL AND next_probe_at <= $1
+                                               ORDER BY next_probe_at""", now):
+                if shard is None or self.shard_for(record[0]) == shard:
+                    rows.append(tuple(record))
+                    if len(rows) == limit:
+                        break
+        return rows
+
+    @timed
+    async def record_channel_probe(self, channel_id, error_class, next_probe_at=None):
+        """Lift the quarantine after a successful probe (error_class None), else schedule the next one."""
+        if error_class is None:
+            async with self.pool.acquire() as conn, conn.transaction():
+                await conn.execute("UPDATE channels SET failures = 0, quarantined_at = NULL, next_probe_at = NULL WHERE channel_id = $1",
+                                   str(channel_id))
+                await self._notify_channels_changed(conn)
+            self._channel_changed()
+        else:
+            await self.pool.execute("""UPDATE channels SET failures = failures + 1, last_error_class = $1, next_probe_at = $2
+                                       WHERE channel_id = $3 AND quarantined_at IS NOT NULL""",
+                                    error_class, next_probe_at, str(channel_id))
+
+    @timed
+    async def get_channel_health(self):
+        """(channel count, unhealthy channels) for the admin summary; see Database.get_channel_health."""
+        async with self.pool.acquire() as conn:
+            total = await conn.fetchval("SELECT COUNT(*) FROM channels")
+            rows = await conn.fetch("""SELECT channel_id, channel_name, failures, last_error_class, last_success_at,
+                                              quarantined_at, next_probe_at
+                                       FROM channels WHERE failures > 0 OR quarantined_at IS NOT NULL
+                                       ORDER BY quarantined_at IS NULL, quarantined_at, failures DESC""")
+        return total, _rows(rows)
+
+    @timed
+    async def get_job(self, job_id):
+        return _row(await self.pool.fetchrow("SELECT post_id, status_chat_id, status_message_id FROM publish_jobs WHERE id = $1",
+                                             job_id))
+
+    @timed
+    async def get_job_deliveries(self, job_id):
+        return _rows(await self.pool.fetch("""SELECT d.channel_id, c.channel_name, d.status, d.last_error, d.attempts
+                                              FROM deliveries d LEFT JOIN channels c ON c.channel_id = d.channel_id
+                                              WHERE d.job_id = $1 ORDER BY d.id""", job_id))
+
+    @timed
+    async def claim_message_syncs(self, limit, now, shard=0):
+        """Atomically take up to `limit` queued edits/deletes of published messages for `shard`."""
+        return _rows(await self.pool.fetch("""UPDATE published_messages
+                                              SET pending = CASE pending WHEN 'edit' THEN 'editing' ELSE 'deleting' END,
+                                                  attempts = attempts + 1
+                                              WHERE id IN (SELECT id FROM published_messages
+                                                           WHERE shard = $1 AND pending IN ('edit', 'delete')
+                                                             AND COALESCE(next_attempt_at, 0) <= $2
+                                                           ORDER BY next_attempt_at NULLS FIRST LIMIT $3
+                                                           FOR UPDATE SKIP LOCKED)
+                                              RETURNING id, post_id, chat_id, message_id, part, pending, attempts""",
+                                           shard, now, limit))
+
+    @timed
+    async def next_message_sync_due(self, shard=0):
+        return await self.pool.fetchval("""SELECT MIN(COALESCE(next_attempt_at, 0)) FROM published_messages
+                                           WHERE shard = $1 AND pending IN ('edit', 'delete')""", shard)
+
+    @timed
+    async def finish_message_syncs(self, ids):
+        """Clear finished (or abandoned) edits and drop deleted messages from the ledger."""
+        ids = list(ids)
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute("UPDATE published_messages SET pending = NULL, attempts = 0 WHERE id = ANY($1) AND pending = 'editing'",
+                               ids)
+            await conn.execute("DELETE FROM published_messages WHERE id = ANY($1) AND pending = 'deleting'", ids)
+
+    @timed
+    async def retry_message_syncs(self, ids, retry_at):
+        await self.pool.execute("""UPDATE published_messages
+                                   SET pending = CASE pending WHEN 'editing' THEN 'edit' ELSE 'delete' END, next_attempt_at = $1
+                                   WHERE id = ANY($2) AND pending IN ('editing', 'deleting')""", retry_at, list(ids))
+
+    @timed
+    async def reset_stale_message_syncs(self, shard=0):
+        """Re-queue edits/deletes left in flight by a crashed process."""
+        return _rowcount(await self.pool.execute(
+            """UPDATE published_messages SET pending = CASE pending WHEN 'editing' THEN 'edit' ELSE 'delete' END
+               WHERE shard = $1 AND pending IN ('editing', 'deleting')""", shard))
+
+    @timed
+    async def add_schedule(self, post_id, channel_ids, next_run_at, interval_seconds, created_by):
+        return await self.pool.fetchval("""INSERT INTO schedules (post_id, channel_ids, next_run_at, interval_seconds, created_by)
+                                           VALUES ($1, $2, $3, $4, $5) RETURNING id""",
+                                        int(post_id), json.dumps([str(cid) for cid in channel_ids]), next_run_at,
+                                        interval_seconds, created_by)
+
+    @timed
+    async def get_active_schedules(self):
+        return _rows(await self.pool.fetch("SELECT id, next_run_at FROM schedules WHERE active = 1"))
+
+    @timed
+    async def list_schedules(self, limit=20):
+        rows = await self.pool.fetch("""SELECT s.id, s.post_id, p.title, s.next_run_at, s.interval_seconds, s.channel_ids
+                                        FROM schedules s LEFT JOIN posts p ON p.id = s.post_id
+                                        WHERE s.active = 1 ORDER BY s.next_run_at LIMIT $1""", limit)
+        return [(sid, post_id, title, next_run_at, interval, len(json.loads(channel_ids)))
+                for sid, post_id, title, next_run_at, interval, channel_ids in rows]
+
+    @timed
+    async def cancel_schedule(self, schedule_id):
+        status = await self.pool.execute("UPDATE schedules SET active = 0 WHERE id = $1 AND active = 1", int(schedule_id))
+        return _rowcount(status) == 1
+
+    @timed
+    async def fire_schedule(self, schedule_id, run_at, now):
+        """Enqueue the publish for a due schedule and advance it; see Database.fire_schedule."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            row = await conn.fetchrow("""SELECT s.post_id, s.channel_ids, s.interval_seconds, s.created_by, p.id FROM schedules s
+                                         LEFT JOIN posts p ON p.id = s.post_id
+                                         WHERE s.id = $1 AND s.active = 1 AND s.next_run_at = $2
+                                         FOR UPDATE OF s""", schedule_id, run_at)
+            if row is None:
+                return None, None
+            post_id, channel_ids, interval, created_by, post_exists = row
+
+            next_run_at = None
+            if interval and post_exists:
+                # Skip runs missed while the bot was offline instead of firing them all at once
+                missed = max(0, int((now - run_at) // interval))
+                next_run_at = run_at + (missed + 1) * interval
+
+            await conn.execute("UPDATE schedules SET next_run_at = $1, active = $2 WHERE id = $3",
+                               next_run_at if next_run_at is not None else run_at, 1 if next_run_at is not None else 0,
+                               schedule_id)
+            if not post_exists:
+                return None, None
+            job_id = await self._enqueue_publish(conn, post_id, json.loads(channel_ids), created_by, None)
+        return job_id, next_run_at
+
+    @timed
+    async def load_sessions(self, now):
+        return _rows(await self.pool.fetch("""SELECT user_id, data, expires_at FROM sessions
+                                              WHERE expires_at > $1 ORDER BY expires_at""", now))
+
+    @timed
+    async def save_sessions(self, saved, deleted):
+        """Upsert (user_id, data, expires_at) rows and delete `deleted` user ids in one transaction."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.executemany("""INSERT INTO sessions (user_id, data, expires_at) VALUES ($1, $2, $3)
+                                      ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at""",
+                                   saved)
+            await conn.execute("DELETE FROM sessions WHERE user_id = ANY($1)", list(deleted))
+            await conn.execute("DELETE FROM sessions WHERE expires_at <= $1", time.time())
+
+    @timed
+    async def add_post_stats(self, rows):
+        """Add (post_id, views, clicks, searches, updated_at) counts to the aggregates in one transaction."""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.executemany("""INSERT INTO post_stats AS s (post_id, views, clicks, searches, updated_at)
+                                      VALUES ($1, $2, $3, $4, $5)
+                                      ON CONFLICT (post_id) DO UPDATE SET
+                                          views = s.views + excluded.views,
+                                          clicks = s.clicks + excluded.clicks,
+                                          searches = s.searches + excluded.searches,
+                                          updated_at = excluded.updated_at""", rows)
+
+    @timed
+    async def get_top_posts(self, limit=10):
+        """The most viewed existing posts as (post_id, title, views, clicks, searches)."""
+        return _rows(await self.pool.fetch("""SELECT s.post_id, p.title, s.views, s.clicks, s.searches
+                                              FROM post_stats s JOIN posts p ON p.id = s.post_id
+                                              ORDER BY s.views DESC LIMIT $1""", limit))
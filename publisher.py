@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from pyrogram.enums import ParseMode
+from pyrogram.errors import FloodWait, MessageNotModified
+from pyrogram.types import InputMediaPhoto, InputMediaVideo
+from ratelimit import RateLimiter
+from metrics import TELEGRAM_SEND_SECONDS, TELEGRAM_SENDS, FLOOD_WAITS
+
+logger = logging.getLogger(__name__)
+
+# Outcome of publishing a post to one channel
+DeliveryResult = namedtuple('DeliveryResult', 'channel_id ok error attempts')
+
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'video': InputMediaVideo}
+ALBUM_BUTTONS_TEXT = "🔗 Links"
+
+
+async def send_post(client, chat_id, post):
+    """Send a PreparedPost to a single chat and return the sent [(part, message)].
+
+    The part ('text', 'caption', 'album_caption', 'album_item' or 'buttons')
+    says how the message is updated when the post is edited later. The
+    content was parsed into text + entities when the post was prepared, so
+    sends pass the entities with parse_mode DISABLED instead of making
+    Pyrogram parse the markdown again for every recipient (except for posts
+    with user mentions, see post_cache.parse_markdown).
+    """
+    if post.media_type == 'album':
+        # The caption goes on the first item; albums can't carry a keyboard, so buttons follow separately.
+        # send_media_group ignores caption_entities, so album captions are still parsed per send.
+        media = [INPUT_MEDIA[media_type](file_id, caption=post.content if i == 0 else '', parse_mode=ParseMode.MARKDOWN)
+                 for i, (media_type, file_id) in enumerate(post.media_file_id)]
+        messages = await client.send_media_group(chat_id, media)
+        sent = [('album_caption' if i == 0 else 'album_item', message) for i, message in enumerate(messages)]
+        if post.reply_markup:
+            sent.append(('buttons', await client.send_message(chat_id, ALBUM_BUTTONS_TEXT, reply_markup=post.reply_markup)))
+        return sent
+    elif post.media_type == 'photo':
+        message = await client.send_photo(chat_id, post.media_file_id, caption=post.text, caption_entities=post.entities, reply_markup=post.reply_markup, parse_mode=post.parse_mode)
+        return [('caption', message)]
+    elif post.media_type == 'video':
+        message = await client.send_video(chat_id, post.media_file_id, caption=post.text, caption_entities=post.entities, reply_markup=post.reply_markup, parse_mode=post.parse_mode)
+        return [('caption', message)]
+    else:
+        message = await client.send_message(chat_id, post.text, entities=post.entities, reply_markup=post.reply_markup, parse_mode=post.parse_mode, disable_web_page_preview=True)
+        return [('text', message)]
+
+
+async def edit_sent_post(client, chat_id, message_id, part, post):
+    """Bring one message sent by send_post in line with the edited post.
+
+    Only text, captions and buttons can change in place; a changed media
+    type is not propagated. Returns False if the message needs no edit.
+    """
+    try:
+        if part == 'text':
+            await client.edit_message_text(chat_id, message_id, post.text, entities=post.entities, reply_markup=post.reply_markup, parse_mode=post.parse_mode, disable_web_page_preview=True)
+        elif part == 'caption':
+            await client.edit_message_caption(chat_id, message_id, post.text, caption_entities=post.entities, reply_markup=post.reply_markup, parse_mode=post.parse_mode)
+        elif part == 'album_caption':
+            await client.edit_message_caption(chat_id, message_id, post.text, caption_entities=post.entities, parse_mode=post.parse_mode)
+        elif part == 'buttons':
+            await client.edit_message_reply_markup(chat_id, message_id, post.reply_markup)
+        else:
+            return False
+    except MessageNotModified:
+        return False
+    return True
+
+
+class Publisher:
+    """Fans a post out to many channels concurrently within Telegram's rate limits."""
+
+    def __init__(self, concurrency, global_rate, per_chat_rate, max_flood_retries=3):
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(global_rate, per_chat_rate)
+        self.max_flood_retries = max_flood_retries
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def call(self, chat_id, func, *args, **kwargs):
+        """Run one rate-limited API call for `chat_id`, waiting out FloodWaits for that chat only."""
+        attempts = 0
+        while True:
+            attempts += 1
+            await self.limiter.acquire(chat_id)
+            try:
+                async with self.semaphore:
+                    start = time.perf_counter()
+                    try:
+                        result = await func(*args, **kwargs)
+                    finally:
+                        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, chat_id=chat_id)
+                TELEGRAM_SENDS.inc(chat_id=chat_id, result='ok')
+                return result, attempts
+            except FloodWait as e:
+                TELEGRAM_SENDS.inc(chat_id=chat_id, result='flood_wait')
+                FLOOD_WAITS.inc(chat_id=chat_id)
+                if attempts > self.max_flood_retries:
+                    raise
+                logger.warning(f"FloodWait of {e.value}s for chat {chat_id}, retrying")
+                self.limiter.flood_wait(chat_id, e.value)
+            except Exception:
+                TELEGRAM_SENDS.inc(chat_id=chat_id, result='error')
+                raise
+
+    async def deliver(self, client, channel_id, post):
+        chat_id = int(channel_id)
+        try:
+            _, attempts = await self.call(chat_id, send_post, client, chat_id, post)
+            return DeliveryResult(channel_id, True, None, attempts)
+        except Exception as e:
+            logger.error(f"Failed to post to {channel_id}: {e}")
+            return DeliveryResult(channel_id, False, str(e) or type(e).__name__, None)
+
+    async def publish(self, client, channel_ids, post):
+        """Send the post to every channel and return one DeliveryResult per channel, in order."""
+        return await asyncio.gather(*[self.deliver(client, channel_id, post) for channel_id in channel_ids])
+
+
+def format_report(results, channel_names, limit=3500):
+    """Build the per-channel summary shown to the admin after publishing."""
+    success_count = sum(1 for r in results if r.ok)
+    text = f"✅ **Published!**\n\nPosted to {success_count}/{len(results)} selected channels.\n"
+    failed = [r for r in results if not r.ok]
+    if failed:
+        text += "\n**Failed:**\n"
+        for i, r in enumerate(failed):
+            line = f"• {channel_names.get(str(r.channel_id), r.channel_id)} (`{r.channel_id}`): {r.error}\n"
+            if len(text) + len(line) > limit:
+                text += f"…and {len(failed) - i} more.\n"
+                break
+            text += line
+    return text
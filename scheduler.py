@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import logging
+import re
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400}
+MIN_INTERVAL = 60
+
+
+def parse_schedule(text):
+    """Parse `YYYY-MM-DD HH:MM [every N(m|h|d)]` (UTC) into (timestamp, interval_seconds or None)."""
+    match = re.fullmatch(r'\s*(\d{4}-\d{2}-\d{2} \d{1,2}:\d{2})(?:\s+every\s+(\d+)\s*([mhd]))?\s*', text, re.IGNORECASE)
+    if not match:
+        raise ValueError("Use `YYYY-MM-DD HH:MM`, optionally followed by `every 6h` (units: m, h, d).")
+    run_at = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M').replace(tzinfo=timezone.utc).timestamp()
+    interval = None
+    if match.group(2):
+        interval = int(match.group(2)) * INTERVAL_UNITS[match.group(3).lower()]
+        if interval < MIN_INTERVAL:
+            raise ValueError("The repeat interval must be at least 1 minute.")
+    elif run_at <= time.time():
+        raise ValueError("That time is in the past.")
+    return run_at, interval
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+
+
+class Scheduler:
+    """Fires scheduled publishes into the outbox.
+
+    Due times live in a min-heap of (next_run_at, schedule_id); the task
+    sleeps until the earliest one instead of polling the schedules table.
+    Cancelled schedules are dropped lazily when they reach the top of the
+    heap, because Database.fire_schedule only fires rows that are still
+    active and due at that exact time.
+    """
+
+    def __init__(self, db, outbox):
+        self.db = db
+        self.outbox = outbox
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        self._heap = [(next_run_at, schedule_id) for schedule_id, next_run_at in await self.db.aio.get_active_schedules()]
+        heapq.heapify(self._heap)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def add(self, post_id, channel_ids, run_at, interval_seconds, created_by):
+        schedule_id = await self.db.aio.add_schedule(post_id, channel_ids, run_at, interval_seconds, created_by)
+        heapq.heappush(self._heap, (run_at, schedule_id))
+        self._wake.set()
+        return schedule_id
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                run_at, schedule_id = heapq.heappop(self._heap)
+                try:
+                    job_id, next_run_at = await self.db.aio.fire_schedule(schedule_id, run_at, now)
+                except Exception as e:
+                    logger.error(f"Failed to fire schedule {schedule_id}: {e}")
+                    heapq.heappush(self._heap, (run_at, schedule_id))
+                    await asyncio.sleep(5)
+                    break
+                if job_id is not None:
+                    logger.info(f"Schedule {schedule_id} queued publish job {job_id}")
+                    self.outbox.wake()
+                if next_run_at is not None:
+                    heapq.heappush(self._heap, (next_run_at, schedule_id))
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,84 @@
+import asyncio
+from cache import LRUCache
+from database import fts_query
+from ratelimit import TokenBucket
+from metrics import SEARCH_REQUESTS
+
+
+class SearchService:
+    """Post search for regular users: per-user throttling plus a short-lived result cache.
+
+    Each user gets a token bucket of `burst` searches refilled at `rate`
+    per second. Results are cached by normalized query for `cache_ttl`
+    seconds and dropped whenever a post changes; concurrent misses for the
+    same query share one database call.
+    """
+
+    def __init__(self, db, limit=20, rate=0.5, burst=5, cache_size=1000, cache_ttl=60, max_users=10000):
+        self.db = db
+        self.limit = limit
+        self.rate = rate
+        self.burst = burst
+        self.cache = LRUCache(cache_size, cache_ttl)
+        # Buckets are forgotten once idle long enough to be full again, see throttle()
+        self._buckets = LRUCache(max_users)
+        self._notified = LRUCache(max_users)
+        self._pending = {}
+        self._generation = 0
+        db.on_post_change(self.invalidate)
+
+    def throttle(self, user_id):
+        """Take a search token for `user_id`; returns 0 if allowed, else seconds until the next one."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        allowed = bucket.try_acquire()
+        # Expire from the last use, not from creation, or a steady flooder would get a fresh full bucket
+        self._buckets.set(user_id, bucket, ttl=(self.burst - bucket.tokens) / self.rate)
+        if allowed:
+            return 0
+        SEARCH_REQUESTS.inc(result='throttled')
+        return bucket.retry_after()
+
+    def should_notify(self, user_id, wait):
+        """True for the first throttled search of a cooldown, so a flooder gets one notice, not one per message."""
+        if self._notified.get(user_id) is not None:
+            return False
+        self._notified.set(user_id, True, ttl=wait)
+        return True
+
+    async def search(self, text, offset=0, limit=None):
+        """Return up to `limit` (default: the configured limit) [(post_id, title)] for `text`, from `offset`."""
+        limit = limit or self.limit
+        query = fts_query(text)
+        if not query:
+            return []
+        key = (query, offset, limit)
+        results = self.cache.get(key)
+        if results is not None:
+            SEARCH_REQUESTS.inc(result='cached')
+            return results
+        pending = self._pending.get(key)
+        if pending is not None:
+            SEARCH_REQUESTS.inc(result='cached')
+            return await asyncio.shield(pending)
+        SEARCH_REQUESTS.inc(result='db')
+        generation = self._generation
+        pending = self._pending[key] = asyncio.ensure_future(self.db.aio.search_posts(text, limit, offset))
+        try:
+            results = await asyncio.shield(pending)
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
+        # Don't cache results read before a concurrent post change
+        if generation == self._generation:
+            self.cache.set(key, results)
+        return results
+
+    def invalidate(self, post_id=None):
+        self._generation += 1
+        self._pending.clear()
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Per-user conversation state (the old `user_data` dict) with expiry and a size cap.
+
+    Entries expire `ttl` seconds after they were last used and the least
+    recently used entry is evicted beyond `maxsize`. Reads and writes are
+    plain in-memory operations. With a `db`, changes are written behind in
+    batches every `flush_interval` seconds, so drafts survive restarts.
+    Sessions are mutated in place by the handlers, so call `save(user_id)`
+    after changing one.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600, db=None, flush_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db = db
+        self.flush_interval = flush_interval
+        self._data = OrderedDict()
+        self._dirty = set()
+        self._task = None
+
+    def _get_entry(self, user_id):
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self._remove(user_id)
+            return None
+        # Touching a session refreshes its TTL and LRU position; the new expiry is
+        # written behind too, or a restart would drop a session still in use
+        entry[1] = time.time() + self.ttl
+        self._data.move_to_end(user_id)
+        self._mark(user_id)
+        return entry
+
+    def _mark(self, user_id):
+        if self.db is not None:
+            self._dirty.add(user_id)
+
+    def _remove(self, user_id):
+        self._data.pop(user_id, None)
+        self._mark(user_id)
+
+    def __contains__(self, user_id):
+        return self._get_entry(user_id) is not None
+
+    def __getitem__(self, user_id):
+        entry = self._get_entry(user_id)
+        if entry is None:
+            raise KeyError(user_id)
+        return entry[0]
+
+    def get(self, user_id, default=None):
+        entry = self._get_entry(user_id)
+        return entry[0] if entry is not None else default
+
+    def __setitem__(self, user_id, session):
+        self._data[user_id] = [session, time.time() + self.ttl]
+        self._data.move_to_end(user_id)
+        self._mark(user_id)
+        while len(self._data) > self.maxsize:
+            evicted, _ = self._data.popitem(last=False)
+            self._mark(evicted)
+
+    def pop(self, user_id, default=None):
+        entry = self._data.pop(user_id, None)
+        if entry is None:
+            return default
+        self._mark(user_id)
+        return entry[0]
+
+    def save(self, user_id):
+        """Mark a session that was changed in place for persistence."""
+        if user_id in self._data:
+            self._mark(user_id)
+
+    def __len__(self):
+        return len(self._data)
+
+    def expire(self):
+        """Drop expired sessions; entries are in last-used order, so stop at the first live one."""
+        now = time.time()
+        while self._data:
+            user_id, (_, expires_at) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            self._remove(user_id)
+
+    async def load(self):
+        if self.db is None:
+            return
+        for user_id, data, expires_at in await self.db.aio.load_sessions(time.time()):
+            self._data[user_id] = [json.loads(data), expires_at]
+        logger.info(f"Restored {len(self._data)} sessions")
+
+    async def flush(self):
+        self.expire()
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        saved, deleted = [], []
+        for user_id in dirty:
+            entry = self._data.get(user_id)
+            if entry is None:
+                deleted.append(user_id)
+            else:
+                saved.append((user_id, json.dumps(entry[0]), entry[1]))
+        try:
+            await self.db.aio.save_sessions(saved, deleted)
+        except Exception as e:
+            logger.error(f"Failed to persist sessions: {e}")
+            self._dirty |= dirty
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
@@ -0,0 +1,28 @@
+import bisect
+import hashlib
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring assigning channel ids to bot shards.
+
+    Every shard owns `replicas` points on the ring and a channel belongs to
+    the first point at or after its own hash, so going from N to N+1 shards
+    only moves about 1/(N+1) of the channels.
+    """
+
+    def __init__(self, shards, replicas=100):
+        self.shards = shards
+        points = sorted((_hash(f"shard-{shard}-{replica}"), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, channel_id):
+        if self.shards <= 1:
+            return 0
+        index = bisect.bisect_left(self._hashes, _hash(str(channel_id))) % len(self._hashes)
+        return self._owners[index]
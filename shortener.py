@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit, urlunsplit
+import aiohttp
+from cache import LRUCache
+from metrics import SHORTENER_SECONDS, SHORTENER_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for `reset_timeout` seconds after `threshold` failures in a row."""
+
+    def __init__(self, threshold=3, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        # Half-open: let requests through again once the timeout has passed
+        return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("URL shortener is failing, falling back to long URLs")
+            self.opened_at = time.monotonic()
+
+
+def normalize_url(url):
+    """Canonical cache key: lowercase scheme and host, default port dropped.
+
+    Credentials, path, query and fragment are kept as written: single-page
+    sites route on the fragment, so it tells links apart.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, at, hostport = parts.netloc.rpartition('@')
+    host, port = hostport, ''
+    # A bracketed IPv6 host without a port has colons of its own
+    if ':' in hostport and not hostport.endswith(']'):
+        host, port = hostport.rsplit(':', 1)
+    if (scheme, port) in (('http', '80'), ('https', '443')):
+        port = ''
+    netloc = f"{userinfo}{at}{host.lower()}{':' + port if port else ''}"
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, parts.fragment))
+
+
+class ShortUrlCache:
+    """In-process LRU in front of the persistent short_urls table."""
+
+    def __init__(self, db, maxsize=1000, ttl=30 * 24 * 3600, max_entries=100000):
+        self.db = db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = LRUCache(maxsize, ttl)
+        self.db_hits = 0
+        self.misses = 0
+
+    async def get(self, long_url):
+        key = normalize_url(long_url)
+        short_url = self.memory.get(key)
+        if short_url is not None:
+            return short_url
+        short_url = await self.db.aio.get_short_url(key, self.ttl)
+        if short_url is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self.memory.set(key, short_url)
+        return short_url
+
+    async def set(self, long_url, short_url):
+        key = normalize_url(long_url)
+        self.memory.set(key, short_url)
+        await self.db.aio.save_short_url(key, short_url, self.max_entries)
+
+    def stats(self):
+        return {
+            'memory_hits': self.memory.hits,
+            'db_hits': self.db_hits,
+            'misses': self.misses,
+            'memory_size': len(self.memory),
+        }
+
+
+class Shortener:
+    """Async ShrinkEarn client with a pooled HTTP session and bounded parallelism."""
+
+    def __init__(self, api_key, base_url, timeout=5, concurrency=5, pool_size=10, breaker=None, cache=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def shorten(self, long_url):
+        """Shorten URL using ShrinkEarn API, returning the long URL on any failure"""
+        if self.cache is not None:
+            short_url = await self.cache.get(long_url)
+            if short_url is not None:
+                return short_url
+        if not self.breaker.allow():
+            SHORTENER_REQUESTS.inc(result='circuit_open')
+            return long_url
+        session = self._get_session()
+        params = {'api': self.api_key, 'url': long_url, 'format': 'text'}
+        try:
+            async with self._semaphore:
+                with SHORTENER_SECONDS.time():
+                    async with session.get(self.base_url, params=params) as response:
+                        text = (await response.text()).strip()
+            if response.status == 200 and text:
+                SHORTENER_REQUESTS.inc(result='ok')
+                self.breaker.record_success()
+                if self.cache is not None:
+                    await self.cache.set(long_url, text)
+                return text
+            logger.error(f"URL shortening failed: HTTP {response.status}")
+        except Exception as e:
+            logger.error(f"URL shortening failed: {e!r}")
+        SHORTENER_REQUESTS.inc(result='error')
+        self.breaker.record_failure()
+        return long_url
+
+    async def shorten_many(self, long_urls):
+        """Shorten several URLs concurrently; returns a {long_url: short_url} dict."""
+        unique = list(dict.fromkeys(long_urls))
+        short_urls = await asyncio.gather(*[self.shorten(url) for url in unique])
+        return dict(zip(unique, short_urls))
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,264 @@
+from abc import ABC, abstractmethod
+
+# The short URL cache may outgrow its cap by this fraction between evictions,
+# and a hit only refreshes last_used once it is this fraction of the TTL old
+SHORT_URL_SLACK = 0.1
+
+class Storage(ABC):
+    """Common base of the storage backends.
+
+    Application code talks to storage only through `await db.aio.<method>(...)`
+    plus `on_post_change` and `on_channel_change`, so any backend providing
+    the same methods with the same return shapes can be swapped in:
+    `database.Database` (SQLite, the default) runs its blocking calls on a
+    thread pool behind `aio`, while `postgres_database.PostgresDatabase` is
+    natively async and is its own `aio`. `start()` and `stop()` bracket the
+    bot's lifetime.
+
+    The abstract methods below are that contract: a backend missing one
+    fails when it is created, not halfway through a handler.
+    tests/test_storage.py runs the same checks against each backend. Bulk JSONL
+    import/export (iter_*/import_* in database.Database) is SQLite-only.
+    """
+
+    def __init__(self, shard_ring=None):
+        self.shard_ring = shard_ring
+        self._post_listeners = []
+        self._channel_listeners = []
+        self._short_url_saves = 0
+
+    def on_post_change(self, callback):
+        """Register `callback(post_id)` to run on the event loop after a post is added, updated or deleted."""
+        self._post_listeners.append(callback)
+
+    def _post_changed(self, post_id):
+        for callback in self._post_listeners:
+            callback(post_id)
+
+    def on_channel_change(self, callback):
+        """Register `callback()` to run on the event loop after channels, their groups or their quarantine change."""
+        self._channel_listeners.append(callback)
+
+    def _channel_changed(self):
+        for callback in self._channel_listeners:
+            callback()
+
+    def shard_for(self, channel_id):
+        """Index of the bot shard that delivers to `channel_id`."""
+        return self.shard_ring.shard_for(channel_id) if self.shard_ring else 0
+
+    def _short_url_eviction_due(self, max_entries):
+        """True on every save that may have pushed the short URL cache past its slack."""
+        self._short_url_saves += 1
+        if self._short_url_saves < max(1, int(max_entries * SHORT_URL_SLACK)):
+            return False
+        self._short_url_saves = 0
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    # Posts
+
+    @abstractmethod
+    def add_post(self, title, content, media_type, media_file_id, buttons):
+        """Insert a post; returns its id."""
+
+    @abstractmethod
+    def update_post(self, post_id, title, content, media_type, media_file_id, buttons):
+        """Update a post and queue an edit of its published copies; returns how many."""
+
+    @abstractmethod
+    def get_post(self, post_id):
+        """(content, media_type, media_file_id, buttons JSON) of a post, or None."""
+
+    @abstractmethod
+    def get_all_posts(self):
+        """Every post as (id, title, created_at), newest first."""
+
+    @abstractmethod
+    def get_posts_page(self, limit, cursor=None, forward=True):
+        """Keyset page as (rows, has_prev, has_next); see Database.get_posts_page."""
+
+    @abstractmethod
+    def delete_post(self, post_id):
+        """Delete a post and queue the deletion of its published copies; returns how many."""
+
+    @abstractmethod
+    def search_posts(self, query, limit=20, offset=0):
+        """Best matches for free text as (id, title), titles ranked above content."""
+
+    # Channels and groups
+
+    @abstractmethod
+    def add_channel(self, channel_id, channel_name):
+        """Add or rename a channel, lifting any quarantine."""
+
+    @abstractmethod
+    def get_all_channels(self):
+        """Every channel as (channel_id, channel_name), by name."""
+
+    @abstractmethod
+    def get_active_channels(self):
+        """Channels that are not quarantined, as (channel_id, channel_name), by name."""
+
+    @abstractmethod
+    def remove_channel(self, channel_id):
+        """Delete a channel and its group memberships."""
+
+    @abstractmethod
+    def get_channel_groups(self):
+        """Every group membership as (group name, channel_id), by group name."""
+
+    @abstractmethod
+    def add_to_channel_group(self, name, channel_ids):
+        """Add known channels to group `name`; returns how many were not in it yet."""
+
+    @abstractmethod
+    def remove_from_channel_group(self, name, channel_ids=None):
+        """Remove channels from group `name` (all without `channel_ids`); returns how many."""
+
+    # Channel health
+
+    @abstractmethod
+    def record_channel_failure(self, channel_id, error_class, permanent, max_failures, now, probe_at):
+        """Count a failed send; returns quarantined_at (`now` if it just quarantined the channel) or None."""
+
+    @abstractmethod
+    def get_channels_to_probe(self, now, limit, shard=None):
+        """Quarantined channels of `shard` (every shard if None) due for a re-check, as (channel_id, quarantined_at)."""
+
+    @abstractmethod
+    def record_channel_probe(self, channel_id, error_class, next_probe_at=None):
+        """Lift the quarantine after a successful probe (error_class None), else schedule the next one."""
+
+    @abstractmethod
+    def get_channel_health(self):
+        """(channel count, unhealthy channels); see Database.get_channel_health."""
+
+    # Short URL cache
+
+    @abstractmethod
+    def get_short_url(self, long_url, ttl):
+        """The cached short URL of `long_url` if younger than `ttl` seconds, else None."""
+
+    @abstractmethod
+    def save_short_url(self, long_url, short_url, max_entries):
+        """Cache a short URL, now and then evicting the least recently used beyond `max_entries`."""
+
+    # Publish outbox
+
+    @abstractmethod
+    def enqueue_publish(self, post_id, channel_ids, status_chat_id=None, status_message_id=None):
+        """Create a publish job with one pending delivery per channel and return its id."""
+
+    @abstractmethod
+    def claim_deliveries(self, limit, now, shard=0):
+        """Mark up to `limit` due deliveries of `shard` sending; see Database.claim_deliveries."""
+
+    @abstractmethod
+    def next_delivery_due(self, shard=0):
+        """Earliest next_attempt_at of the pending deliveries of `shard`, or None."""
+
+    @abstractmethod
+    def mark_delivery_sent(self, delivery_id, message_id, parts=()):
+        """Mark a delivery sent and record its [(part, message_id)] in the ledger."""
+
+    @abstractmethod
+    def mark_delivery_failed(self, delivery_id, error, retry_at=None):
+        """Record a failed attempt; schedule a retry at `retry_at` or give up if it is None."""
+
+    @abstractmethod
+    def reset_stale_deliveries(self, shard=0):
+        """Return deliveries left 'sending' by a crashed process to the queue; returns how many."""
+
+    @abstractmethod
+    def finish_job(self, job_id):
+        """Mark a job finished once no delivery is outstanding; True only for the caller that did."""
+
+    @abstractmethod
+    def claim_job_reports(self):
+        """Ids of finished jobs whose report has not been sent yet, marking them reported."""
+
+    @abstractmethod
+    def get_job(self, job_id):
+        """(post_id, status_chat_id, status_message_id) of a job, or None."""
+
+    @abstractmethod
+    def get_job_deliveries(self, job_id):
+        """A job's deliveries as (channel_id, channel_name, status, last_error, attempts)."""
+
+    # Published messages ledger
+
+    @abstractmethod
+    def claim_message_syncs(self, limit, now, shard=0):
+        """Take up to `limit` queued edits/deletes of `shard`; see Database.claim_message_syncs."""
+
+    @abstractmethod
+    def next_message_sync_due(self, shard=0):
+        """Earliest due time of the queued edits/deletes of `shard`, or None."""
+
+    @abstractmethod
+    def finish_message_syncs(self, ids):
+        """Clear finished (or abandoned) edits and drop deleted messages from the ledger."""
+
+    @abstractmethod
+    def retry_message_syncs(self, ids, retry_at):
+        """Re-queue in-flight edits/deletes for another attempt at `retry_at`."""
+
+    @abstractmethod
+    def reset_stale_message_syncs(self, shard=0):
+        """Re-queue edits/deletes left in flight by a crashed process; returns how many."""
+
+    # Schedules
+
+    @abstractmethod
+    def add_schedule(self, post_id, channel_ids, next_run_at, interval_seconds, created_by):
+        """Create an active schedule and return its id."""
+
+    @abstractmethod
+    def get_active_schedules(self):
+        """Every active schedule as (id, next_run_at)."""
+
+    @abstractmethod
+    def list_schedules(self, limit=20):
+        """Active schedules as (id, post_id, title, next_run_at, interval_seconds, channel count)."""
+
+    @abstractmethod
+    def cancel_schedule(self, schedule_id):
+        """Deactivate a schedule; True if it was active."""
+
+    @abstractmethod
+    def fire_schedule(self, schedule_id, run_at, now):
+        """Enqueue a due schedule's publish and advance it; returns (job_id, next_run_at)."""
+
+    # Sessions and analytics
+
+    @abstractmethod
+    def load_sessions(self, now):
+        """Unexpired sessions as (user_id, data JSON, expires_at), soonest to expire first."""
+
+    @abstractmethod
+    def save_sessions(self, saved, deleted):
+        """Upsert (user_id, data, expires_at) rows and delete `deleted` user ids in one transaction."""
+
+    @abstractmethod
+    def add_post_stats(self, rows):
+        """Add (post_id, views, clicks, searches, updated_at) counts to the aggregates."""
+
+    @abstractmethod
+    def get_top_posts(self, limit=10):
+        """The most viewed existing posts as (post_id, title, views, clicks, searches)."""
+
+
+def open_storage(url='', shard_ring=None, pool_min=2, pool_max=10):
+    """The backend for `url`: a postgresql:// DSN, or else a SQLite file path (default bot_data.db)."""
+    if url.startswith(('postgres://', 'postgresql://')):
+        # asyncpg is only needed when PostgreSQL is configured
+        from postgres_database import PostgresDatabase
+        return PostgresDatabase(url, shard_ring=shard_ring, min_size=pool_min, max_size=pool_max)
+    from database import Database
+    return Database(url or 'bot_data.db', shard_ring=shard_ring)
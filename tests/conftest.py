@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import uuid
+import pytest
+
+# The bot's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def run():
+    """Run a coroutine to completion on this test's event loop."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+def postgres_dsn():
+    url = os.environ.get('DATABASE_URL', '')
+    if not url.startswith(('postgres://', 'postgresql://')):
+        pytest.skip("DATABASE_URL is not a PostgreSQL DSN")
+    # A configured server that can't be used is an error, not a skip
+    try:
+        import asyncpg  # noqa: F401
+    except ImportError:
+        pytest.fail("DATABASE_URL is a PostgreSQL DSN but asyncpg is not installed")
+    return url
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def db(request, tmp_path, run):
+    """A started, empty storage backend: SQLite in a temp file, or PostgreSQL in a throwaway schema."""
+    if request.param == 'sqlite':
+        from database import Database
+        storage = Database(str(tmp_path / 'bot_data.db'))
+        run(storage.start())
+        yield storage
+        run(storage.stop())
+        return
+
+    dsn = postgres_dsn()
+    import asyncpg
+    from postgres_database import PostgresDatabase
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+
+    async def execute(sql):
+        conn = await asyncpg.connect(dsn)
+        try:
+            await conn.execute(sql)
+        finally:
+            await conn.close()
+
+    run(execute(f"CREATE SCHEMA {schema}"))
+    # asyncpg passes unknown DSN parameters on as server settings
+    storage = PostgresDatabase(f"{dsn}{'&' if '?' in dsn else '?'}search_path={schema}", min_size=1, max_size=4)
+    try:
+        run(storage.start())
+        yield storage
+        run(storage.stop())
+    finally:
+        run(execute(f"DROP SCHEMA {schema} CASCADE"))
@@ -0,0 +1,26 @@
+import json
+import pytest
+from bulk import import_jsonl
+from database import Database
+
+
+def write_posts(path, *created_at):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, value in enumerate(created_at, 1):
+            f.write(json.dumps({'id': i, 'title': f"Post {i}", 'content': "body", 'created_at': value}) + '\n')
+
+
+def test_import_normalizes_created_at(tmp_path):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    path = tmp_path / 'posts.jsonl'
+    write_posts(path, "2024-05-01T12:00:00.250000+02:00", "2024-05-01 11:30:00", "2024-05-01T09:00:00Z")
+    assert import_jsonl(db, 'posts', str(path)) == 3
+    # Newest first, in the same UTC 'YYYY-MM-DD HH:MM:SS' form as CURRENT_TIMESTAMP
+    assert [(post_id, created_at) for post_id, _, created_at in db.get_all_posts()] == [
+        (2, "2024-05-01 11:30:00"), (1, "2024-05-01 10:00:00"), (3, "2024-05-01 09:00:00")
+    ]
+
+    write_posts(path, "2024-05-01 10:00:00", "last tuesday")
+    with pytest.raises(ValueError, match="line 2"):
+        import_jsonl(db, 'posts', str(path), restart=True)
+    db.close()
@@ -0,0 +1,75 @@
+import time
+from types import SimpleNamespace
+import pytest
+from pyrogram.enums import ChatMemberStatus, ChatType
+from channel_health import ChannelHealth
+from database import Database
+from publisher import Publisher
+from sharding import HashRing
+
+
+def quarantine(run, db, channel_ids, now):
+    for channel_id in channel_ids:
+        run(db.aio.add_channel(channel_id, f"Channel {channel_id}"))
+        run(db.aio.record_channel_failure(channel_id, "ChatWriteForbidden", True, 10, now, now))
+
+
+def test_probe_batch_only_holds_this_shards_channels(db, run):
+    db.shard_ring = HashRing(2)
+    channel_ids = [str(-1001000000000 - i) for i in range(60)]
+    quarantine(run, db, channel_ids, time.time())
+    mine = [channel_id for channel_id in channel_ids if db.shard_for(channel_id) == 1]
+    assert 0 < len(mine) < len(channel_ids)
+
+    # A full batch of shard 1's channels, however many of shard 0's are due before them
+    batch = run(db.aio.get_channels_to_probe(time.time(), 5, 1))
+    assert len(batch) == 5
+    assert {row[0] for row in batch} <= set(mine)
+    assert len(run(db.aio.get_channels_to_probe(time.time(), 100, 1))) == len(mine)
+    assert len(run(db.aio.get_channels_to_probe(time.time(), 100))) == len(channel_ids)
+
+
+class ProbeClient:
+    """Answers get_chat_member("me") and get_chat for one chat."""
+
+    def __init__(self, status, chat_type, can_post_messages=None):
+        self.status = status
+        self.chat_type = chat_type
+        self.can_post_messages = can_post_messages
+
+    async def get_chat_member(self, chat_id, user_id):
+        privileges = None
+        if self.status == ChatMemberStatus.ADMINISTRATOR:
+            privileges = SimpleNamespace(can_post_messages=self.can_post_messages)
+        return SimpleNamespace(status=self.status, privileges=privileges)
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id, type=self.chat_type)
+
+
+@pytest.mark.parametrize("client, lifted", [
+    (ProbeClient(ChatMemberStatus.OWNER, ChatType.CHANNEL), True),
+    (ProbeClient(ChatMemberStatus.ADMINISTRATOR, ChatType.CHANNEL, can_post_messages=True), True),
+    (ProbeClient(ChatMemberStatus.ADMINISTRATOR, ChatType.CHANNEL, can_post_messages=False), False),
+    (ProbeClient(ChatMemberStatus.MEMBER, ChatType.CHANNEL), False),
+    (ProbeClient(ChatMemberStatus.MEMBER, ChatType.SUPERGROUP), True),
+    (ProbeClient(ChatMemberStatus.ADMINISTRATOR, ChatType.SUPERGROUP, can_post_messages=False), True),
+    (ProbeClient(ChatMemberStatus.RESTRICTED, ChatType.SUPERGROUP), False),
+    (ProbeClient(ChatMemberStatus.LEFT, ChatType.CHANNEL), False),
+])
+def test_probe_lifts_quarantine_only_when_the_bot_can_post(tmp_path, run, client, lifted):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    try:
+        now = time.time()
+        quarantine(run, db, ["-1001"], now)
+        health = ChannelHealth(db, Publisher(10, 1e9, 1e9))
+        health.client = client
+        run(health._probe("-1001", now))
+
+        active = [row[0] for row in run(db.aio.get_active_channels())]
+        assert active == (["-1001"] if lifted else [])
+        if not lifted:
+            assert run(db.aio.get_channels_to_probe(now + 1, 10)) == []
+    finally:
+        run(db.stop())
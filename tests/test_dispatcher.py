@@ -0,0 +1,70 @@
+import asyncio
+import random
+from types import SimpleNamespace
+from dispatcher import UpdateLanes, UserDispatcher
+
+
+def test_updates_of_a_user_run_in_arrival_order(run):
+    """Workers parse with random delays, as Pyrogram's do when parsing waits on the API."""
+    lanes = UpdateLanes(4)
+    dispatcher = UserDispatcher(max_pending=100)
+    handled = {user_id: [] for user_id in range(1, 4)}
+    rng = random.Random(0)
+
+    async def handle(user_id, seq):
+        handled[user_id].append(seq)
+
+    async def worker():
+        while (packet := await lanes.get()) is not None:
+            update, _, _ = packet
+            await asyncio.sleep(rng.uniform(0, 0.005))
+            dispatcher.submit(update.user_id, None, handle, update.user_id, update.seq)
+
+    async def scenario():
+        workers = [asyncio.create_task(worker()) for _ in range(4)]
+        for seq in range(20):
+            for user_id in handled:
+                lanes.put_nowait((SimpleNamespace(user_id=user_id, seq=seq), {}, {}))
+        for _ in workers:
+            lanes.put_nowait(None)
+        await asyncio.gather(*workers)
+        await dispatcher.join()
+
+    run(scenario())
+    assert handled == {user_id: list(range(20)) for user_id in handled}
+
+
+def test_message_updates_are_routed_by_sender():
+    lanes = UpdateLanes(3)
+    message = SimpleNamespace(from_id=None, peer_id=SimpleNamespace(user_id=7))
+    for _ in range(3):
+        lanes.put_nowait((SimpleNamespace(message=message), {}, {}))
+    assert sorted(lane.qsize() for lane in lanes._lanes) == [0, 0, 3]
+
+
+def test_duplicate_callbacks_and_overflow_are_dropped(run):
+    dispatcher = UserDispatcher(max_pending=3)
+    handled = []
+
+    async def handle(user_id, value):
+        await asyncio.sleep(0)
+        handled.append((user_id, value))
+
+    async def scenario():
+        assert dispatcher.submit(1, (10, 'toggle_ch_1'), handle, 1, 'first tap')
+        # The same button queued or running again is dropped
+        assert not dispatcher.submit(1, (10, 'toggle_ch_1'), handle, 1, 'double tap')
+        assert dispatcher.submit(1, (10, 'toggle_ch_2'), handle, 1, 'other button')
+        assert dispatcher.submit(1, None, handle, 1, 'message')
+        # Beyond max_pending
+        assert not dispatcher.submit(1, None, handle, 1, 'overflow')
+        # Other users have queues of their own
+        assert dispatcher.submit(2, None, handle, 2, 'other user')
+        await dispatcher.join()
+        # Once the queue has drained, the button works again
+        assert dispatcher.submit(1, (10, 'toggle_ch_1'), handle, 1, 'later tap')
+        await dispatcher.join()
+
+    run(scenario())
+    assert [value for user_id, value in handled if user_id == 1] == ['first tap', 'other button', 'message', 'later tap']
+    assert [value for user_id, value in handled if user_id == 2] == ['other user']
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from database import Database
+from message_sync import MessageSync
+from publisher import Publisher
+
+
+class RecordingClient:
+    """Records edits and deletes; the first `failures` calls raise a transient error."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.edits = []
+        self.deletes = []
+
+    def _fail(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self._fail()
+        self.edits.append((chat_id, message_id, text))
+
+    async def delete_messages(self, chat_id, message_ids, revoke=True):
+        self._fail()
+        self.deletes.append((chat_id, len(message_ids)))
+        return len(message_ids)
+
+
+def published(db, run, channel_ids):
+    """Add a post and claim its deliveries to `channel_ids`, as if they were being sent."""
+    post_id = run(db.aio.add_post("Post", "old text", None, None, []))
+    for channel_id in channel_ids:
+        run(db.aio.add_channel(channel_id, channel_id))
+    run(db.aio.enqueue_publish(post_id, channel_ids))
+    deliveries = run(db.aio.claim_deliveries(len(channel_ids), time.time() + 1))
+    return post_id, deliveries
+
+
+def sync(db, run, client):
+    worker = MessageSync(db, Publisher(10, 1e9, 1e9), base_delay=0.01, poll_interval=0.01)
+
+    async def drain():
+        worker.start(client)
+        deadline = time.time() + 5
+        while await db.aio.next_message_sync_due() is not None:
+            assert time.time() < deadline
+            await asyncio.sleep(0.01)
+        await worker.stop()
+
+    run(drain())
+
+
+def test_edit_reaches_a_copy_that_was_sending(tmp_path, run):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    post_id, [delivery] = published(db, run, ["-1001"])
+    # Edited while the copy is on its way: nothing in the ledger to edit yet
+    assert run(db.aio.update_post(post_id, "Post", "new text", None, None, [])) == 0
+    run(db.aio.mark_delivery_sent(delivery[0], 500, [('text', 500)]))
+
+    client = RecordingClient()
+    sync(db, run, client)
+    assert client.edits == [(-1001, 500, "new text")]
+    run(db.stop())
+
+
+def test_deletes_are_batched_per_chat(tmp_path, run):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    counts = {"-1001": 250, "-1002": 3}
+    post_id, deliveries = published(db, run, list(counts))
+    for delivery_id, _, _, channel_id, _, _ in deliveries:
+        parts = [('album_item', message_id) for message_id in range(1, counts[channel_id] + 1)]
+        run(db.aio.mark_delivery_sent(delivery_id, 1, parts))
+    assert run(db.aio.delete_post(post_id)) == 253
+
+    client = RecordingClient()
+    sync(db, run, client)
+    assert sorted(client.deletes) == [(-1002, 3), (-1001, 50), (-1001, 100), (-1001, 100)]
+    assert db._connect().execute("SELECT COUNT(*) FROM published_messages").fetchone()[0] == 0
+    run(db.stop())
+
+
+def test_transient_errors_are_retried(tmp_path, run):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    post_id, [delivery] = published(db, run, ["-1001"])
+    run(db.aio.mark_delivery_sent(delivery[0], 500, [('text', 500)]))
+    assert run(db.aio.update_post(post_id, "Post", "new text", None, None, [])) == 1
+
+    client = RecordingClient(failures=2)
+    sync(db, run, client)
+    assert client.edits == [(-1001, 500, "new text")]
+    assert db._connect().execute("SELECT pending, attempts FROM published_messages").fetchone() == (None, 0)
+    run(db.stop())
@@ -0,0 +1,20 @@
+import pytest
+from metrics import Histogram, REGISTRY
+
+
+def test_histogram_per_label_and_overall_summaries():
+    histogram = Histogram('test_send_seconds', "Test latency per chat", ['chat_id'], buckets=(0.1, 1))
+    REGISTRY.remove(histogram)
+    assert histogram.summary_all() == (0, 0.0, 0.0)
+    for value in (0.05, 0.05, 0.5):
+        histogram.observe(value, chat_id=-1001)
+    histogram.observe(2, chat_id=-1002)
+
+    summary = histogram.summary()
+    assert summary[('-1001',)] == (3, pytest.approx(0.2), 1)
+    assert summary[('-1002',)] == (1, 2, float('inf'))
+    assert histogram.summary_all() == (4, pytest.approx(0.65), float('inf'))
+
+    rendered = histogram.render()
+    assert 'test_send_seconds_bucket{chat_id="-1001",le="0.1"} 2' in rendered
+    assert 'test_send_seconds_count{chat_id="-1002"} 1' in rendered
@@ -0,0 +1,66 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from migrations import MIGRATIONS, migrate, schema_version
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_fresh_database_gets_the_whole_schema(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'bot_data.db')
+    assert migrate(conn) == len(MIGRATIONS) == schema_version(conn)
+    names = {name for name, in conn.execute("SELECT name FROM sqlite_master")}
+    assert {'posts', 'channels', 'deliveries', 'published_messages', 'posts_fts', 'channel_groups',
+            'idx_deliveries_sending', 'idx_channels_probe'} <= names
+    assert 'post_change' in {row[1] for row in conn.execute("PRAGMA table_info(deliveries)")}
+
+
+def test_current_database_is_left_alone(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'bot_data.db')
+    migrate(conn)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert migrate(conn) == len(MIGRATIONS)
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_pre_versioning_database_is_upgraded(tmp_path):
+    # The database the bot shipped with before schema versions: posts and channels only
+    path = tmp_path / 'bot_data.db'
+    shutil.copy(os.path.join(ROOT, 'bot_data.db'), path)
+    conn = sqlite3.connect(path)
+    assert schema_version(conn) == 0
+    posts = conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+    assert migrate(conn) == len(MIGRATIONS)
+    # Existing posts are backfilled into the search index
+    assert conn.execute("SELECT COUNT(*) FROM posts_fts").fetchone()[0] == posts
+
+
+def test_racing_processes_apply_each_migration_once(tmp_path, caplog):
+    path = tmp_path / 'bot_data.db'
+    start = threading.Barrier(4)
+    results, errors = [], []
+
+    def run():
+        conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        start.wait()
+        try:
+            results.append(migrate(conn))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            conn.close()
+
+    with caplog.at_level(logging.INFO, logger='migrations'):
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert results == [len(MIGRATIONS)] * 4
+    applied = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Applied")]
+    assert len(applied) == len(MIGRATIONS)
@@ -0,0 +1,47 @@
+import asyncio
+import sqlite3
+import time
+from database import Database
+from outbox import OutboxWorker
+from post_cache import PostCache
+from publisher import Publisher
+from benchmarks.fake_client import FakeClient
+
+
+def test_failed_bookkeeping_after_a_send_does_not_resend(tmp_path, run):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    run(db.aio.add_channel("-1001", "Channel"))
+    post_id = run(db.aio.add_post("Post", "body", None, None, []))
+    job_id = run(db.aio.enqueue_publish(post_id, ["-1001"]))
+
+    # The first attempt to record the send hits a locked database
+    mark_delivery_sent = db.mark_delivery_sent
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return mark_delivery_sent(*args)
+
+    db.mark_delivery_sent = flaky
+    client = FakeClient(latency=0, jitter=0)
+    worker = OutboxWorker(db, Publisher(10, 1e9, 1e9), PostCache(db), base_delay=0.01, poll_interval=0.01)
+
+    async def publish():
+        worker.start(client)
+        deadline = time.time() + 5
+        while run_query("SELECT finished_at FROM publish_jobs WHERE id = ?", job_id) is None:
+            assert time.time() < deadline
+            await asyncio.sleep(0.01)
+        await worker.stop()
+
+    def run_query(sql, *params):
+        return db._connect().execute(sql, params).fetchone()[0]
+
+    run(publish())
+    assert client.sent == 1
+    assert len(calls) == 2
+    assert run_query("SELECT status FROM deliveries WHERE job_id = ?", job_id) == 'sent'
+    run(db.stop())
@@ -0,0 +1,48 @@
+import pytest
+from pyrogram import raw, utils
+from pyrogram.enums import ParseMode
+from pyrogram.parser import Parser
+from post_cache import parse_markdown, prepare_post
+
+
+class ParsingClient:
+    """Just enough of a Client for Pyrogram's send-side text parsing."""
+
+    parse_mode = ParseMode.DEFAULT
+
+    def __init__(self):
+        self.parser = Parser(self)
+
+    async def resolve_peer(self, peer_id):
+        return raw.types.InputUser(user_id=int(peer_id), access_hash=0)
+
+
+async def sent(client, text, parse_mode, entities):
+    """The message and raw entities send_message would put on the wire."""
+    return await utils.parse_text_entities(client, text, parse_mode, entities)
+
+
+@pytest.mark.parametrize("content", [
+    "Plain text, no markup",
+    "**Bold** and __italic__ and --underline-- and ~~strike~~ and ||spoiler||",
+    "`inline code` then\n```python\nprint('block')\n```",
+    "[A link](https://example.com/path?q=1) and **[bold link](https://t.me/channel)**",
+    "**nested __italic__ inside bold**",
+    "Emoji 🎬 before **bold 🍿** shifts UTF-16 offsets 👨‍👩‍👧",
+    "Escaped \\*\\*not bold\\*\\* and a lone * star",
+    "Mention [the admin](tg://user?id=123456) in **bold** text",
+])
+def test_prepared_text_matches_markdown_send(run, content):
+    client = ParsingClient()
+    expected = run(sent(client, content, ParseMode.MARKDOWN, None))
+
+    text, entities, parse_mode = run(parse_markdown(content))
+    assert run(sent(client, text, parse_mode, entities)) == expected
+
+    post = run(prepare_post(1, (content, None, None, None)))
+    assert run(sent(client, post.text, post.parse_mode, post.entities)) == expected
+
+
+def test_user_mention_stays_markdown(run):
+    content = "Hi [there](tg://user?id=42)"
+    assert run(parse_markdown(content)) == (content, None, ParseMode.MARKDOWN)
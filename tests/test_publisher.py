@@ -0,0 +1,103 @@
+import asyncio
+import time
+import pytest
+from pyrogram.errors import FloodWait
+import ratelimit
+from publisher import Publisher
+from ratelimit import RateLimiter, TokenBucket
+
+
+class FloodingClient:
+    """Records when each chat was sent to; chats in `floods` raise FloodWait that many times first."""
+
+    def __init__(self, floods, seconds):
+        self.floods = dict(floods)
+        self.seconds = seconds
+        self.calls = []
+        self.start = time.monotonic()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append((chat_id, time.monotonic() - self.start))
+        if self.floods.get(chat_id, 0) > 0:
+            self.floods[chat_id] -= 1
+            error = FloodWait(value=1)
+            # Pyrogram truncates value to whole seconds
+            error.value = self.seconds
+            raise error
+        return object()
+
+
+def send(client, chat_id):
+    return client.send_message(chat_id, "post")
+
+
+def test_flood_wait_only_holds_back_its_chat(run):
+    client = FloodingClient({-1001: 1}, 0.3)
+    publisher = Publisher(10, 1e9, 1e9)
+
+    async def scenario():
+        return await asyncio.gather(*[publisher.call(chat_id, send, client, chat_id)
+                                      for chat_id in (-1001, -1002, -1003, -1004)])
+
+    results = run(scenario())
+    assert [attempts for _, attempts in results] == [2, 1, 1, 1]
+    flooded = [at for chat_id, at in client.calls if chat_id == -1001]
+    others = [at for chat_id, at in client.calls if chat_id != -1001]
+    # The other chats went out at once; the flooded one waited out its FloodWait
+    assert len(others) == 3 and max(others) < 0.1
+    assert len(flooded) == 2 and flooded[1] >= 0.3
+
+
+def test_flood_wait_retries_give_up(run):
+    client = FloodingClient({-1001: 10}, 0.01)
+    publisher = Publisher(10, 1e9, 1e9, max_flood_retries=2)
+    with pytest.raises(FloodWait):
+        run(publisher.call(-1001, send, client, -1001))
+    assert len(client.calls) == 3
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        # At least a microsecond, or a rounding-sized wait would never move the clock
+        self.now += max(1e-6, seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(ratelimit.asyncio, 'sleep', clock.sleep)
+    return clock
+
+
+def test_token_bucket_burst_and_refill(clock):
+    bucket = TokenBucket(2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.retry_after() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire() and not bucket.try_acquire()
+    bucket.block(5)
+    clock.now += 10
+    assert bucket.retry_after() == 0
+    assert bucket.tokens == 3
+
+
+def test_rate_limiter_holds_global_and_per_chat_rates(clock, run):
+    async def acquire_all(limiter, chat_ids):
+        for chat_id in chat_ids:
+            await limiter.acquire(chat_id)
+
+    # One chat: a message per second after the first
+    run(acquire_all(RateLimiter(30, 1), [1] * 5))
+    assert clock.now == pytest.approx(4, abs=1e-3)
+
+    # Many chats: the global rate after its burst
+    clock.now = 100.0
+    run(acquire_all(RateLimiter(10, 1), range(30)))
+    assert clock.now - 100 == pytest.approx(2, abs=1e-3)
@@ -0,0 +1,16 @@
+import time
+from database import Database
+from search import SearchService
+
+
+def test_throttle_holds_a_steady_flooder_to_the_rate(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    search = SearchService(Database(str(tmp_path / 'bot_data.db')), rate=0.5, burst=5)
+
+    allowed = 0
+    for _ in range(120):
+        allowed += search.throttle(42) == 0
+        now[0] += 0.5
+    # The burst plus one token every two seconds over 60 seconds
+    assert allowed <= 5 + 30
@@ -0,0 +1,103 @@
+import sqlite3
+import time
+import pytest
+from database import Database
+from sessions import SessionStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def db(tmp_path, run):
+    db = Database(str(tmp_path / 'bot_data.db'))
+    run(db.start())
+    yield db
+    run(db.stop())
+
+
+def stored(db):
+    return {user_id: (data, expires_at) for user_id, data, expires_at in db.load_sessions(0)}
+
+
+def test_sessions_expire_after_their_last_use(clock):
+    store = SessionStore(ttl=60)
+    store[1] = {'state': 'creating_post'}
+    clock[0] += 50
+    # A read refreshes the TTL
+    assert store.get(1) == {'state': 'creating_post'}
+    clock[0] += 50
+    assert 1 in store
+    clock[0] += 61
+    assert store.get(1) is None and len(store) == 0
+
+    store[2] = {}
+    clock[0] += 61
+    store.expire()
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(maxsize=2)
+    store[1], store[2] = {'n': 1}, {'n': 2}
+    store.get(1)
+    store[3] = {'n': 3}
+    assert 2 not in store and store[1] == {'n': 1} and store[3] == {'n': 3}
+
+
+def test_changes_are_written_behind(clock, db, run):
+    store = SessionStore(db=db)
+    store[1] = {'state': 'creating_post', 'post_data': {}}
+    store[2] = {'state': 'searching'}
+    assert stored(db) == {}
+
+    run(store.flush())
+    assert set(stored(db)) == {1, 2}
+
+    # Handlers change sessions in place and mark them with save()
+    store[1]['post_data']['content'] = "draft"
+    store.save(1)
+    store.pop(2)
+    run(store.flush())
+    assert set(stored(db)) == {1} and '"draft"' in stored(db)[1][0]
+
+
+def test_failed_flush_keeps_changes_for_the_next_one(clock, db, run):
+    store = SessionStore(db=db)
+    store[1] = {'state': 'creating_post'}
+    save_sessions = db.save_sessions
+    calls = []
+
+    def locked_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return save_sessions(*args)
+
+    db.save_sessions = locked_once
+    run(store.flush())
+    assert stored(db) == {}
+    run(store.flush())
+    assert set(stored(db)) == {1}
+
+
+def test_sessions_are_restored_after_a_restart(clock, db, run):
+    store = SessionStore(ttl=60, db=db)
+    store[1] = {'state': 'creating_post', 'post_data': {'content': "draft"}}
+    store[2] = {'state': 'searching'}
+    run(store.flush())
+    # Still in use: the refreshed expiry is persisted as well
+    clock[0] += 30
+    store.get(1)
+    run(store.stop())
+
+    # Session 2 expires while the bot is down
+    clock[0] += 40
+    restarted = SessionStore(ttl=60, db=db)
+    run(restarted.load())
+    assert restarted.get(1) == {'state': 'creating_post', 'post_data': {'content': "draft"}}
+    assert 2 not in restarted